@@ -0,0 +1,6 @@
+"""Benchmarks of multidr.
+
+Run modules from the repository root, e.g.:
+    python -m benchmarks.bench_tdr --output current.json
+    python -m benchmarks.compare baseline.json current.json
+"""
@@ -0,0 +1,50 @@
+"""Benchmark of the first DR of TDR with sklearn's PCA and PowerPCA.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_first_learner --T 2000 --N 1000 --D 10
+"""
+import argparse
+import time
+
+import numpy as np
+from sklearn.decomposition import PCA
+
+from multidr.tdr import TDR
+from multidr.power_pca import PowerPCA
+from benchmarks.synthetic import make_tensor
+
+
+def run(X, first_learner, n_repeats):
+    tdr = TDR(first_learner=first_learner)
+    times = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        tdr.learn_first_repr(X, scaling=True)
+        times.append(time.perf_counter() - start)
+    return min(times), tdr
+
+
+def compare(name, X, n_repeats):
+    t_pca, tdr_pca = run(X, PCA(n_components=1), n_repeats)
+    t_power, tdr_power = run(X, PowerPCA(n_components=1), n_repeats)
+    max_diff = max(
+        np.max(np.abs(getattr(tdr_pca, Y) - getattr(tdr_power, Y)))
+        for Y in ['Y_tn', 'Y_nd', 'Y_dt'])
+    print(f'{name} {X.shape}: PCA {t_pca:.3f}s, PowerPCA {t_power:.3f}s '
+          f'(x{t_pca / t_power:.1f}), max abs diff of Y {max_diff:.2e}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--T', type=int, default=2000)
+    parser.add_argument('--N', type=int, default=1000)
+    parser.add_argument('--D', type=int, default=10)
+    parser.add_argument('--n_repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    compare('air_quality', np.load('./data/air_quality/tensor.npy'),
+            args.n_repeats)
+
+    X, _ = make_tensor(args.T, args.N, args.D, seed=args.seed)
+    compare('synthetic', X, args.n_repeats)
@@ -0,0 +1,91 @@
+"""Check SelectionCL against CL with ccPCA on random selections and compare
+their times.
+
+SelectionCL (exact=True) must return the same feature contributions as
+CL(CCPCA(n_components=1)).fit(X[selected], X[~selected]). The number of
+selections whose results differ is reported for exact=True and exact=False
+(the latter can choose a different alpha where ccPCA's choice depends on
+eigenvector signs). The exit status is 1 when any result of exact=True
+differs, so this can be used in CI scripts.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_selection_cl --n_selections 20
+    python -m benchmarks.bench_selection_cl --tensor data/air_quality/tensor.npy
+"""
+import argparse
+import sys
+import time
+import warnings
+
+import numpy as np
+from ccpca import CCPCA
+from sklearn.decomposition import PCA
+
+from benchmarks.synthetic import make_tensor
+from multidr.cl import CL, SelectionCL
+from multidr.tdr import TDR
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tensor', help='.npy file of a tensor (T, N, D)')
+    parser.add_argument('--n_time_points', type=int, default=200)
+    parser.add_argument('--n_instances', type=int, default=100)
+    parser.add_argument('--n_variables', type=int, default=5)
+    parser.add_argument('--n_selections', type=int, default=20)
+    parser.add_argument('--max_log_alpha', type=float, default=2.0)
+    parser.add_argument('--tolerance', type=float, default=1e-10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.tensor is not None:
+        X = np.load(args.tensor)
+    else:
+        X, _ = make_tensor(args.n_time_points,
+                           args.n_instances,
+                           args.n_variables,
+                           seed=args.seed)
+    tdr = TDR(first_learner=PCA(n_components=1))
+    tdr.learn_first_repr(X)
+    Y = tdr.Y_tn.transpose()
+    n = Y.shape[0]
+    kwargs = {'var_thres_ratio': 0.5, 'max_log_alpha': args.max_log_alpha}
+
+    selection_cls = {
+        'exact': SelectionCL(Y, exact=True),
+        'downdate': SelectionCL(Y, exact=False)
+    }
+    times = {'ccpca': 0.0, 'exact': 0.0, 'downdate': 0.0}
+    n_mismatches = {'exact': 0, 'downdate': 0}
+    max_diffs = {'exact': 0.0, 'downdate': 0.0}
+
+    rng = np.random.default_rng(args.seed)
+    for _ in range(args.n_selections):
+        selected = np.zeros(n, dtype=bool)
+        selected[rng.choice(n, rng.integers(1, n), replace=False)] = True
+
+        start = time.perf_counter()
+        cl = CL(CCPCA(n_components=1))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            cl.fit(Y[selected], Y[~selected], **kwargs)
+        times['ccpca'] += time.perf_counter() - start
+
+        for key, selection_cl in selection_cls.items():
+            start = time.perf_counter()
+            fcs = selection_cl.feat_contribs(selected, **kwargs)
+            times[key] += time.perf_counter() - start
+
+            diff = np.max(np.abs(fcs - cl.fcs))
+            max_diffs[key] = max(max_diffs[key], diff)
+            n_mismatches[key] += diff > args.tolerance
+
+    print(f'{n} rows, {Y.shape[1]} features, '
+          f'{args.n_selections} selections')
+    print(f'ccpca: {times["ccpca"]:.4f}s')
+    for key in selection_cls:
+        print(f'{key}: {times[key]:.4f}s '
+              f'(x{times["ccpca"] / times[key]:.1f}), '
+              f'{n_mismatches[key]} mismatches, '
+              f'max abs diff {max_diffs[key]:.2e}')
+
+    sys.exit(1 if n_mismatches['exact'] > 0 else 0)
@@ -0,0 +1,252 @@
+"""Scaling benchmark of TDR and CL.
+
+Wall time and peak memory are measured for each stage of TDR.fit_transform
+(unfolding, scaling, the first DR of each mode, and each second DR, as
+reported to the listeners of TDR), for the whole fit_transform, and for
+CL.fit (its sign adjustment alone and, when ccPCA is installed, with
+ccPCA). Cases are the bundled air quality tensor
+(a fixed reference) and synthetic tensors whose T, N, and D are scaled
+independently. Results are written as JSON, which can be compared with a
+stored baseline by benchmarks/compare.py. Only CPUs are used.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_tdr --output current.json
+    python -m benchmarks.bench_tdr --shape 4000 200 10 --shape 500 1600 10
+    python -m benchmarks.compare baseline.json current.json
+"""
+import argparse
+import collections
+import copy
+import functools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+import sklearn
+from sklearn.cluster import KMeans
+from sklearn.decomposition import PCA
+import umap
+from umap import UMAP
+
+from multidr.tdr import TDR
+from multidr.cl import CL
+from multidr.instrumentation import EventRecorder, Measurement
+from benchmarks.synthetic import make_tensor
+
+FORMAT_VERSION = 1
+
+AIR_QUALITY_PATH = os.path.join(os.path.dirname(__file__), '..', 'data',
+                                'air_quality', 'tensor.npy')
+
+# baseline shape and shapes scaling each of T, N, and D by 4
+DEFAULT_SHAPES = [(500, 200, 10), (2000, 200, 10), (500, 800, 10),
+                  (500, 200, 40)]
+
+
+class FixedContribs():
+    """Contrastive learner stub returning fixed feature contributions. Used
+    to measure the sign adjustment of CL.fit without the cost of ccPCA."""
+    def __init__(self, fcs):
+        self.fcs = fcs
+
+    def fit(self, K, R, **kwargs):
+        return self
+
+    def get_feat_contribs(self):
+        return self.fcs
+
+
+def measure(fn, n_repeats):
+    """Measure fn().
+
+    fn is called once as a warm-up (e.g., for numba compilation of UMAP),
+    n_repeats times to measure wall time, and once more with tracemalloc to
+    measure the peak of memory allocated during the call (NumPy allocations
+    are traced, while internal buffers of BLAS are not).
+    """
+    fn()
+
+    times = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'time': min(times),
+        'time_median': float(np.median(times)),
+        'peak_bytes': peak_bytes
+    }
+
+
+def measure_tdr_stages(X, second_learner, n_repeats, verbose=False):
+    """Measure the stages of TDR.fit_transform reported to its listeners
+    (keyed by stage and name, e.g., 'first_dr_t' and 'second_dr_Z_n_dt') and
+    the whole fit_transform in the same way as measure."""
+    recorder = EventRecorder()
+    tdr = TDR(first_learner=PCA(n_components=1),
+              second_learner=second_learner,
+              listeners=[recorder],
+              trace_memory=False)
+    tdr.fit_transform(X)
+
+    times = collections.defaultdict(list)
+    for _ in range(n_repeats):
+        recorder.clear()
+        measurement = Measurement()
+        tdr.fit_transform(X)
+        times['fit_transform'].append(measurement.stop()[0])
+        for event in recorder.events:
+            times[_stage_key(event)].append(event.wall_time)
+
+    tdr.trace_memory = True
+    recorder.clear()
+    measurement = Measurement(trace_memory=True)
+    tdr.fit_transform(X)
+    peaks = {'fit_transform': measurement.stop()[2]}
+    for event in recorder.events:
+        peaks[_stage_key(event)] = event.peak_bytes
+
+    stages = {
+        stage: {
+            'time': min(stage_times),
+            'time_median': float(np.median(stage_times)),
+            'peak_bytes': peaks[stage]
+        }
+        for stage, stage_times in times.items()
+    }
+    if verbose:
+        for stage, result in stages.items():
+            print(f"  {stage}: {result['time']:.4f}s, "
+                  f"{result['peak_bytes'] / 2**20:.1f}MiB")
+
+    return stages
+
+
+def bench_case(X, second_learner, n_repeats, with_ccpca=True, verbose=False):
+    """Measure all stages for tensor X. Returns a dict keyed by stage."""
+    stages = {}
+
+    def run(stage, fn, *args, **kwargs):
+        stages[stage] = measure(functools.partial(fn, *args, **kwargs),
+                                n_repeats)
+        if verbose:
+            print(f"  {stage}: {stages[stage]['time']:.4f}s, "
+                  f"{stages[stage]['peak_bytes'] / 2**20:.1f}MiB")
+
+    stages.update(
+        measure_tdr_stages(X, second_learner, n_repeats, verbose=verbose))
+    tdr = TDR(first_learner=PCA(n_components=1), second_learner=second_learner)
+    tdr.learn_first_repr(X, scaling=True)
+
+    # contrastive learning of the largest instance cluster against the rest
+    Y_nt = tdr.Y_tn.transpose()
+    labels = KMeans(n_clusters=3, n_init=10, random_state=0).fit_predict(Y_nt)
+    selected = labels == np.argmax(np.bincount(labels))
+    K = Y_nt[selected]
+    R = Y_nt[~selected]
+    fcs = np.random.default_rng(0).standard_normal(Y_nt.shape[1])
+    run('cl_sign_adjustment', _fit_cl, FixedContribs(fcs), K, R)
+    if with_ccpca:
+        try:
+            from ccpca import CCPCA
+        except ImportError:
+            print('ccpca is not installed. Skip cl_fit')
+        else:
+            run('cl_fit', _fit_cl, CCPCA(), K, R)
+
+    return stages
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'sklearn': sklearn.__version__,
+        'umap': getattr(umap, '__version__', None),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def _stage_key(event):
+    if event.name is None:
+        return event.stage
+    return f'{event.stage}_{event.name}'
+
+
+def _fit_cl(learner, K, R):
+    return CL(learner=copy.deepcopy(learner)).fit(K, R)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shape',
+                        type=int,
+                        nargs=3,
+                        action='append',
+                        metavar=('T', 'N', 'D'),
+                        help='shape of a synthetic tensor (repeatable)')
+    parser.add_argument('--second_learner',
+                        choices=['umap', 'pca'],
+                        default='umap')
+    parser.add_argument('--n_repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no_ccpca', action='store_true')
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+
+    if args.second_learner == 'umap':
+        second_learner = UMAP(n_components=2, random_state=args.seed)
+    else:
+        second_learner = PCA(n_components=2)
+
+    # None for the fixed reference case
+    shapes = [None] + [tuple(shape) for shape in args.shape or DEFAULT_SHAPES]
+
+    results = {
+        'format_version': FORMAT_VERSION,
+        'environment': environment(),
+        'settings': {
+            'second_learner': args.second_learner,
+            'n_repeats': args.n_repeats,
+            'seed': args.seed,
+            'command': ' '.join(sys.argv)
+        },
+        'cases': {}
+    }
+    for shape in shapes:
+        if shape is None:
+            case_name = 'air_quality'
+            X = np.load(AIR_QUALITY_PATH)
+        else:
+            case_name = 'synthetic_T{}_N{}_D{}'.format(*shape)
+            X, _ = make_tensor(*shape, seed=args.seed)
+        print(f'{case_name} {X.shape}')
+        stages = bench_case(X,
+                            second_learner,
+                            args.n_repeats,
+                            with_ccpca=not args.no_ccpca,
+                            verbose=True)
+        results['cases'][case_name] = {
+            'shape': list(X.shape),
+            'stages': stages
+        }
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results are saved in {args.output}')
@@ -0,0 +1,145 @@
+"""Compare benchmark results with a stored baseline and flag regressions.
+
+A stage is flagged when its time (or peak memory) exceeds the baseline one by
+more than the relative tolerance and also by more than the absolute
+threshold, which filters out noise of very short stages. The exit status is
+1 when any regression is flagged, so this can be used in CI scripts.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_tdr --output baseline.json   # once
+    python -m benchmarks.bench_tdr --output current.json
+    python -m benchmarks.compare baseline.json current.json
+"""
+import argparse
+import json
+import sys
+
+ENVIRONMENT_KEYS = ['numpy', 'scipy', 'sklearn', 'umap', 'cpu_count']
+
+
+def compare(baseline,
+            current,
+            time_tolerance=0.2,
+            memory_tolerance=0.1,
+            min_time=0.005,
+            min_bytes=2**20):
+    """Compare two benchmark results produced by benchmarks/bench_tdr.py.
+
+    Parameters
+    ----------
+    baseline: dict
+        Baseline results.
+    current: dict
+        Current results.
+    time_tolerance: float, optional, (default=0.2)
+        Allowed relative increase of time.
+    memory_tolerance: float, optional, (default=0.1)
+        Allowed relative increase of peak memory.
+    min_time: float, optional, (default=0.005)
+        Increases of time smaller than this (in seconds) are not flagged.
+    min_bytes: int, optional, (default=2**20)
+        Increases of peak memory smaller than this are not flagged.
+    Returns
+    -------
+    rows: list of dicts
+        Comparison of each stage found in both results. Each dict has case,
+        stage, time, baseline_time, time_ratio, peak_bytes,
+        baseline_peak_bytes, peak_ratio, and regressions (a list containing
+        'time' and/or 'memory').
+    missing: list of (case, stage) tuples
+        Stages of the baseline not found in the current results (stage is
+        None if the whole case is missing).
+    """
+    rows = []
+    missing = []
+    for case, baseline_case in baseline['cases'].items():
+        current_case = current['cases'].get(case)
+        if current_case is None:
+            missing.append((case, None))
+            continue
+        for stage, b in baseline_case['stages'].items():
+            c = current_case['stages'].get(stage)
+            if c is None:
+                missing.append((case, stage))
+                continue
+            regressions = []
+            if (c['time'] > b['time'] * (1 + time_tolerance)
+                    and c['time'] - b['time'] > min_time):
+                regressions.append('time')
+            if (c['peak_bytes'] > b['peak_bytes'] * (1 + memory_tolerance)
+                    and c['peak_bytes'] - b['peak_bytes'] > min_bytes):
+                regressions.append('memory')
+            rows.append({
+                'case': case,
+                'stage': stage,
+                'time': c['time'],
+                'baseline_time': b['time'],
+                'time_ratio': _ratio(c['time'], b['time']),
+                'peak_bytes': c['peak_bytes'],
+                'baseline_peak_bytes': b['peak_bytes'],
+                'peak_ratio': _ratio(c['peak_bytes'], b['peak_bytes']),
+                'regressions': regressions
+            })
+
+    return rows, missing
+
+
+def environment_differences(baseline, current):
+    """Return {key: (baseline value, current value)} of environment entries
+    that differ (timings of different environments are not comparable)."""
+    b = baseline.get('environment', {})
+    c = current.get('environment', {})
+    return {
+        key: (b.get(key), c.get(key))
+        for key in ENVIRONMENT_KEYS if b.get(key) != c.get(key)
+    }
+
+
+def _ratio(value, baseline_value):
+    return value / baseline_value if baseline_value > 0 else float('inf')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--time_tolerance', type=float, default=0.2)
+    parser.add_argument('--memory_tolerance', type=float, default=0.1)
+    parser.add_argument('--min_time', type=float, default=0.005)
+    parser.add_argument('--min_bytes', type=int, default=2**20)
+    parser.add_argument('--all',
+                        action='store_true',
+                        help='print all stages, not only regressions')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    for key, (b, c) in environment_differences(baseline, current).items():
+        print(f'warning: {key} differs (baseline: {b}, current: {c})')
+
+    rows, missing = compare(baseline,
+                            current,
+                            time_tolerance=args.time_tolerance,
+                            memory_tolerance=args.memory_tolerance,
+                            min_time=args.min_time,
+                            min_bytes=args.min_bytes)
+
+    print(f"{'case':<28} {'stage':<22} {'time (s)':>10} {'ratio':>7} "
+          f"{'peak (MiB)':>11} {'ratio':>7}")
+    for row in rows:
+        if not args.all and not row['regressions']:
+            continue
+        flags = ' '.join(f'<- {r} regression' for r in row['regressions'])
+        print(f"{row['case']:<28} {row['stage']:<22} {row['time']:>10.4f} "
+              f"{row['time_ratio']:>7.2f} "
+              f"{row['peak_bytes'] / 2**20:>11.1f} {row['peak_ratio']:>7.2f} "
+              f"{flags}")
+    for case, stage in missing:
+        print(f'warning: {case} {stage or ""} is missing in current results')
+
+    n_regressions = sum(1 for row in rows if row['regressions'])
+    print(f'{n_regressions} regression(s) in {len(rows)} stages')
+    sys.exit(1 if n_regressions > 0 else 0)
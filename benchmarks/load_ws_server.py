@@ -0,0 +1,503 @@
+"""Load test of the websocket server of the web UI (ui/server/ws_server.py).
+
+Simulated analysts (clients) replay brushing sessions against a locally
+started server: each brush sends addNewFcs for a lasso selection and is
+followed by a burst of getHistInfo requests hovering over feature
+contributions, as the web UI does. Sessions are synthetic (generated from the
+datasets in ui/server/data with the given selection sizes) or recorded ones
+loaded from a JSON file (see load_sessions). Requests are sent at the times
+of the sessions without waiting for responses (open loop), so the server has
+to keep up with the clients.
+
+For each case (dataset, number of clients, and selection ratio), latencies
+(p50/p95/p99) of each action, throughput, error rate, and the resident set
+size (RSS) of the server (including its worker processes) over time are
+written as JSON. Stages of the results have time (p95 latency) and
+peak_bytes (peak server RSS), so they can be compared with a stored baseline
+by benchmarks/compare.py. Everything runs offline on one Linux machine
+(RSS is read from /proc).
+
+Usage (from the repository root):
+    python -m benchmarks.load_ws_server --output current.json
+    python -m benchmarks.load_ws_server --n_clients 1 4 16 --binary \\
+        --server_args="--executor process"
+    python -m benchmarks.load_ws_server --save_sessions sessions.json
+    python -m benchmarks.load_ws_server --sessions sessions.json
+    python -m benchmarks.compare baseline.json current.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import shlex
+import signal
+import struct
+import subprocess
+import sys
+import time
+
+import numpy as np
+import websockets
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                          'ui', 'server')
+sys.path.insert(0, SERVER_DIR)
+from dataset_cache import EMB_TYPE_FILES  # noqa: E402
+
+FORMAT_VERSION = 1
+
+ADD_NEW_FCS = 0
+GET_HIST_INFO = 1
+ACTION_NAMES = {ADD_NEW_FCS: 'addNewFcs', GET_HIST_INFO: 'getHistInfo'}
+
+# emb types shown together in a view of the UI (embType and embType2 of
+# addNewFcs)
+EMB_TYPE_PAIRS = [('Z_n_dt', 'Z_n_td'), ('Z_d_nt', 'Z_d_tn'),
+                  ('Z_t_dn', 'Z_t_nd')]
+
+
+def emb_type_shape(data_key, emb_type):
+    """Return (n_rows, n_cols) of the matrix of data_key for emb_type."""
+    suffix, transpose = EMB_TYPE_FILES[emb_type]
+    path = os.path.join(SERVER_DIR, 'data', f'{data_key}_{suffix}.npy')
+    shape = np.load(path, mmap_mode='r').shape
+    return shape[::-1] if transpose else shape
+
+
+def make_session(data_key,
+                 selection_ratio,
+                 n_brushes=5,
+                 n_hovers=20,
+                 hover_interval=0.02,
+                 think_time=0.5,
+                 seed=0):
+    """Generate a synthetic brushing session.
+
+    Parameters
+    ----------
+    data_key: str
+        Dataset in ui/server/data.
+    selection_ratio: float
+        Ratio of rows selected by each lasso.
+    n_brushes: int, optional, (default=5)
+        Number of lasso selections (addNewFcs).
+    n_hovers: int, optional, (default=20)
+        Number of getHistInfo requests after each selection.
+    hover_interval: float, optional, (default=0.02)
+        Seconds between getHistInfo requests.
+    think_time: float, optional, (default=0.5)
+        Seconds between the last hover and the next selection.
+    seed: int, optional, (default=0)
+        Random seed.
+    Returns
+    -------
+    session: list of dicts
+        Messages with their send time (t, in seconds from the start).
+    """
+    rng = np.random.default_rng(seed)
+    session = []
+    t = 0.0
+    groups = []
+    for _ in range(n_brushes):
+        emb_type, emb_type2 = EMB_TYPE_PAIRS[rng.integers(len(EMB_TYPE_PAIRS))]
+        n_rows, _ = emb_type_shape(data_key, emb_type)
+
+        n_selected = max(1, int(round(n_rows * selection_ratio)))
+        rows = np.sort(rng.choice(n_rows, n_selected, replace=False))
+        selected = np.zeros(n_rows, dtype=bool)
+        selected[rows] = True
+        session.append({
+            't': t,
+            'message': {
+                'action': ADD_NEW_FCS,
+                'content': {
+                    'dataKey': data_key,
+                    'embType': emb_type,
+                    'embType2': emb_type2,
+                    'selected': {
+                        'encoding': 'bitmask',
+                        'n': n_rows,
+                        'data':
+                        base64.b64encode(np.packbits(selected)).decode('ascii')
+                    }
+                }
+            }
+        })
+        # groups of the UI are those selected in the same view
+        groups = [g for g in groups if g[0] == emb_type] + [(emb_type, rows)]
+
+        for _ in range(n_hovers):
+            t += hover_interval
+            hist_emb_type = emb_type if rng.random() < 0.5 else emb_type2
+            _, n_cols = emb_type_shape(data_key, hist_emb_type)
+            session.append({
+                't': t,
+                'message': {
+                    'action': GET_HIST_INFO,
+                    'content': {
+                        'dataKey': data_key,
+                        'embType': hist_emb_type,
+                        'groupRows': [g[1].tolist() for g in groups],
+                        'selectedCol': int(rng.integers(n_cols)),
+                        'pos': [0, 0]
+                    }
+                }
+            })
+        t += think_time
+
+    return session
+
+
+def load_sessions(path):
+    """Load recorded sessions.
+
+    The file is JSON of {"sessions": [session, ...]}, where each session is a
+    list of {"t": send time in seconds, "message": message sent by the web
+    UI}, as written with --save_sessions.
+    """
+    with open(path) as f:
+        return json.load(f)['sessions']
+
+
+def _response_seq(buf):
+    if isinstance(buf, str):
+        return json.loads(buf)['seq']
+    header_length, = struct.unpack_from('<I', buf)
+    return json.loads(buf[4:4 + header_length])['seq']
+
+
+async def run_client(url, session, binary=False, timeout=30.0):
+    """Replay a session and return the requests with their latencies."""
+    subprotocols = (['multidr.binary.v1', 'multidr.json']
+                    if binary else ['multidr.json'])
+    requests = []
+    sent_times = {}
+    latencies = {}
+    error = None
+
+    try:
+        async with websockets.connect(url,
+                                      subprotocols=subprotocols,
+                                      max_size=None) as ws:
+
+            async def receive():
+                async for buf in ws:
+                    seq = _response_seq(buf)
+                    latencies[seq] = time.perf_counter() - sent_times[seq]
+
+            receiver = asyncio.ensure_future(receive())
+            start = time.perf_counter()
+            for seq, item in enumerate(session):
+                delay = start + item['t'] - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                action = item['message']['action']
+                requests.append((seq, action))
+                sent_times[seq] = time.perf_counter()
+                await ws.send(
+                    json.dumps(dict(item['message'], seq=seq)))
+
+            # wait for outstanding responses. Superseded getHistInfo requests
+            # are never answered, but the last one of a session always is
+            expected = [
+                seq for seq, action in requests if action == ADD_NEW_FCS
+            ] + [_last_seq(requests, GET_HIST_INFO)]
+            deadline = time.perf_counter() + timeout
+            while (time.perf_counter() < deadline
+                   and not all(seq in latencies or seq < 0
+                               for seq in expected)):
+                await asyncio.sleep(0.01)
+            receiver.cancel()
+    except (OSError, websockets.WebSocketException) as e:
+        error = repr(e)
+
+    return requests, latencies, error
+
+
+def _last_seq(requests, action):
+    return max((seq for seq, a in requests if a == action), default=-1)
+
+
+def summarize(client_results, wall_time, timeout):
+    """Summarize latencies of each action of all clients. time of each stage
+    is the p95 latency (timeout if no request of the action is answered)."""
+    stages = {}
+    for action, name in ACTION_NAMES.items():
+        latencies = []
+        n_requests = 0
+        n_superseded = 0
+        n_errors = 0
+        for requests, client_latencies, error in client_results:
+            # a getHistInfo request without response is superseded when a
+            # later one of the same client is answered
+            last_answered_hist = max(
+                (seq for seq, a in requests
+                 if a == GET_HIST_INFO and seq in client_latencies),
+                default=-1)
+            for seq, a in requests:
+                if a != action:
+                    continue
+                n_requests += 1
+                if seq in client_latencies:
+                    latencies.append(client_latencies[seq])
+                elif a == GET_HIST_INFO and seq < last_answered_hist:
+                    n_superseded += 1
+                else:
+                    n_errors += 1
+
+        p50, p95, p99 = (np.percentile(latencies, [50, 95, 99]).tolist()
+                         if latencies else [None] * 3)
+        stages[name] = {
+            'time': p95 if latencies else (timeout if n_requests else 0.0),
+            'p50': p50,
+            'p95': p95,
+            'p99': p99,
+            'n_requests': n_requests,
+            'n_responses': len(latencies),
+            'n_superseded': n_superseded,
+            'n_errors': n_errors,
+            'error_rate': n_errors / n_requests if n_requests else 0.0,
+            'throughput': len(latencies) / wall_time
+        }
+
+    return stages
+
+
+def process_tree_rss(pid):
+    """Return the total RSS in bytes of process pid and its descendants."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # the command name in parentheses can contain spaces
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total = 0
+    stack = [pid]
+    while stack:
+        p = stack.pop()
+        stack.extend(children.get(p, []))
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+
+    return total
+
+
+async def sample_rss(pid, samples, interval=0.2):
+    start = time.perf_counter()
+    while True:
+        samples.append([round(time.perf_counter() - start, 3),
+                        process_tree_rss(pid)])
+        await asyncio.sleep(interval)
+
+
+async def run_case(url, sessions, n_clients, server_pid, binary, timeout):
+    rss = []
+    sampler = (asyncio.ensure_future(sample_rss(server_pid, rss))
+               if server_pid is not None else None)
+    start = time.perf_counter()
+    client_results = await asyncio.gather(*[
+        run_client(url, sessions[i % len(sessions)], binary, timeout)
+        for i in range(n_clients)
+    ])
+    wall_time = time.perf_counter() - start
+    if sampler is not None:
+        sampler.cancel()
+
+    stages = summarize(client_results, wall_time, timeout)
+    for stage in stages.values():
+        stage['peak_bytes'] = max((r for _, r in rss), default=0)
+
+    n_responses = sum(stage['n_responses'] for stage in stages.values())
+    return {
+        'n_clients': n_clients,
+        'wall_time': wall_time,
+        'throughput': n_responses / wall_time,
+        'connection_errors':
+        [error for _, _, error in client_results if error is not None],
+        'stages': stages,
+        'rss': rss
+    }
+
+
+def start_server(port, server_args, log_path):
+    """Start ws_server.py in ui/server and wait until it accepts
+    connections."""
+    log = open(log_path, 'w')
+    process = subprocess.Popen(
+        [sys.executable, 'ws_server.py', '--port',
+         str(port)] + server_args,
+        cwd=SERVER_DIR,
+        stdout=log,
+        stderr=subprocess.STDOUT)
+
+    async def wait():
+        for _ in range(600):
+            if process.poll() is not None:
+                raise RuntimeError(f'ws_server.py exited. See {log_path}')
+            try:
+                # offers a subprotocol as the load clients do
+                async with websockets.connect(f'ws://localhost:{port}',
+                                              subprotocols=['multidr.json']):
+                    return
+            except (OSError, websockets.exceptions.InvalidHandshake):
+                await asyncio.sleep(0.1)
+        raise RuntimeError(f'ws_server.py did not start. See {log_path}')
+
+    try:
+        asyncio.run(wait())
+    except BaseException:
+        stop_server(process)
+        raise
+
+    return process
+
+
+def stop_server(process, timeout=10):
+    # the server stops on SIGINT
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'websockets': websockets.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_keys',
+                        nargs='+',
+                        default=['air_quality'],
+                        help='datasets in ui/server/data')
+    parser.add_argument('--n_clients', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--selection_ratio',
+                        type=float,
+                        nargs='+',
+                        default=[0.1])
+    parser.add_argument('--n_brushes', type=int, default=5)
+    parser.add_argument('--n_hovers', type=int, default=20)
+    parser.add_argument('--hover_interval', type=float, default=0.02)
+    parser.add_argument('--think_time', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sessions',
+                        help='replay recorded sessions instead of synthetic '
+                        'ones')
+    parser.add_argument('--save_sessions',
+                        help='write the generated sessions and exit')
+    parser.add_argument('--binary',
+                        action='store_true',
+                        help='negotiate the binary protocol')
+    parser.add_argument('--timeout',
+                        type=float,
+                        default=30.0,
+                        help='seconds to wait for outstanding responses')
+    parser.add_argument('--url',
+                        help='use a running server instead of starting one '
+                        '(server RSS is not measured)')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--server_args',
+                        default='',
+                        help='arguments of ws_server.py, e.g., '
+                        '"--executor process"')
+    parser.add_argument('--server_log', default='load_ws_server.log')
+    parser.add_argument('--output', default='load_results.json')
+    args = parser.parse_args()
+
+    # (case name prefix, sessions, warm-up session) of each session set. The
+    # warm-up loads the datasets and precomputes their statistics with
+    # selections not used by the cases, so responses are not cached
+    if args.sessions:
+        sessions = load_sessions(args.sessions)
+        session_sets = [('recorded', sessions, sessions[0])]
+    else:
+        max_clients = max(args.n_clients)
+        session_sets = []
+        for data_key in args.data_keys:
+            for ratio in args.selection_ratio:
+                sessions = [
+                    make_session(data_key,
+                                 ratio,
+                                 n_brushes=args.n_brushes,
+                                 n_hovers=args.n_hovers,
+                                 hover_interval=args.hover_interval,
+                                 think_time=args.think_time,
+                                 seed=args.seed + i)
+                    for i in range(max_clients + 1)
+                ]
+                session_sets.append(
+                    (f'{data_key}_sel{ratio}', sessions[1:], sessions[0]))
+
+    if args.save_sessions:
+        with open(args.save_sessions, 'w') as f:
+            json.dump(
+                {'sessions': [s for _, ss, _ in session_sets for s in ss]}, f)
+        print(f'sessions are saved in {args.save_sessions}')
+        sys.exit(0)
+
+    process = None
+    if args.url:
+        url = args.url
+    else:
+        url = f'ws://localhost:{args.port}'
+        process = start_server(args.port, shlex.split(args.server_args),
+                               os.path.abspath(args.server_log))
+
+    results = {
+        'format_version': FORMAT_VERSION,
+        'environment': environment(),
+        'settings': {
+            'binary': args.binary,
+            'server_args': args.server_args,
+            'seed': args.seed,
+            'command': ' '.join(sys.argv)
+        },
+        'cases': {}
+    }
+    try:
+        for prefix, sessions, warmup_session in session_sets:
+            asyncio.run(
+                run_case(url, [warmup_session], 1, None, args.binary,
+                         args.timeout))
+            for n_clients in args.n_clients:
+                case_name = f'{prefix}_clients{n_clients}'
+                case = asyncio.run(
+                    run_case(url, sessions, n_clients,
+                             process.pid if process else None, args.binary,
+                             args.timeout))
+                results['cases'][case_name] = case
+                s = case['stages']
+                print(f"{case_name}: {case['throughput']:.1f} responses/s, "
+                      f"addNewFcs p95 {s['addNewFcs']['p95'] or float('nan'):.3f}s, "
+                      f"getHistInfo p95 {s['getHistInfo']['p95'] or float('nan'):.3f}s, "
+                      f"errors {s['addNewFcs']['n_errors'] + s['getHistInfo']['n_errors']}")
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f'results are saved in {args.output}')
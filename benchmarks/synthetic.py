@@ -0,0 +1,63 @@
+"""Synthetic third-order tensors for benchmarks.
+"""
+import numpy as np
+
+
+def make_tensor(n_time_points,
+                n_instances,
+                n_variables,
+                n_clusters=3,
+                rank=2,
+                noise=0.1,
+                seed=0):
+    """Generate a tensor of clustered multivariate time series.
+
+    Instances of each cluster follow the same temporal patterns (sums of
+    sinusoids with random frequencies and phases), which are mixed over
+    variables by cluster-specific loadings and scaled per instance. Gaussian
+    noise is added to all values. T, N, and D can be scaled independently.
+
+    Parameters
+    ----------
+    n_time_points: int
+        T, the number of time points.
+    n_instances: int
+        N, the number of instances.
+    n_variables: int
+        D, the number of variables.
+    n_clusters: int, optional, (default=3)
+        The number of instance clusters.
+    rank: int, optional, (default=2)
+        The number of temporal patterns of each cluster.
+    noise: float, optional, (default=0.1)
+        Standard deviation of the Gaussian noise.
+    seed: int, optional, (default=0)
+        Seed of the random number generator.
+    Returns
+    -------
+    X: ndarray, shape(n_time_points, n_instances, n_variables)
+        Generated tensor.
+    labels: ndarray, shape(n_instances,)
+        Cluster of each instance.
+    """
+    rng = np.random.default_rng(seed)
+
+    t = np.linspace(0, 1, n_time_points)
+    freqs = rng.uniform(1, 10, (n_clusters, rank, 1))
+    phases = rng.uniform(0, 2 * np.pi, (n_clusters, rank, 1))
+    patterns = np.sin(2 * np.pi * freqs * t + phases)
+    loadings = rng.standard_normal((n_clusters, rank, n_variables))
+    # (n_clusters, n_time_points, n_variables)
+    cluster_series = np.einsum('crt,crd->ctd', patterns, loadings)
+
+    labels = rng.integers(n_clusters, size=n_instances)
+    instance_scales = rng.lognormal(0, 0.3, n_instances)
+
+    X = np.empty((n_time_points, n_instances, n_variables))
+    for cluster in range(n_clusters):
+        members = np.flatnonzero(labels == cluster)
+        X[:, members, :] = (cluster_series[cluster][:, None, :] *
+                            instance_scales[members][None, :, None])
+    X += noise * rng.standard_normal(X.shape)
+
+    return X, labels
@@ -6,5 +6,7 @@ __URL__ = "https://github.com/takanori-fujiwara/multidr"
 import sys
 
 __all__ = [
-    'tdr', 'cl', '__author__', '__copyright__', '__license__', '__URL__'
+    'tdr', 'cl', 'cache', 'power_pca', 'instrumentation', 'export',
+    'build', 'cli',
+    '__author__', '__copyright__', '__license__', '__URL__'
 ]
@@ -0,0 +1,560 @@
+import concurrent.futures
+import copy
+import hashlib
+import json
+import os
+import time
+import types
+from collections import namedtuple
+
+import numpy as np
+from sklearn import preprocessing
+
+from multidr.cache import ResultCache, make_key
+from multidr.export import (_remove_other_client_files, cluster_feat_contribs,
+                            save_cluster_fcs, update_file_list,
+                            write_client_columnar, write_client_json,
+                            write_server_data)
+from multidr.tdr import (TDR, _Z_NAMES, _learner_signatures, _scaling_flags,
+                         _second_step_input)
+
+_Stage = namedtuple('_Stage', ['name', 'func', 'deps', 'key', 'outputs'])
+
+
+class Pipeline():
+    """Pipeline: DAG of build stages skipped when their inputs are unchanged
+
+    Each stage has a key made from its parameters and the keys of the stages
+    it depends on, so the key changes whenever any upstream input changes.
+    A computing stage stores its arrays in a ResultCache in build_dir under
+    its key and is skipped when the entry exists. A stage writing files
+    (outputs) is skipped when its stamp in build_dir records the same key and
+    all of the files exist. Stages whose dependencies are done run
+    concurrently.
+
+    Parameters
+    ----------
+    build_dir: str
+        Directory storing the results and stamps of stages.
+    n_jobs: int, optional, (default=1)
+        The number of worker processes running stages. 1 runs stages
+        sequentially in the current process and -1 uses all CPUs.
+    verbose: boolean, optional, (default=False)
+        If True, print which stages are run or skipped.
+    Attributes
+    ----------
+    build_dir: the same with the input parameter one.
+    n_jobs: the same with the input parameter one.
+    cache: multidr.cache.ResultCache
+        Cache of the results of computing stages (never evicted).
+    stages: dict
+        Stages keyed by name, in order of addition.
+    ran: list of str
+        Names of the stages run by the last run, in order of completion.
+    skipped: list of str
+        Names of the stages skipped by the last run.
+    ----------
+    Examples
+    --------
+    >>> pipeline = Pipeline('./.multidr_build', n_jobs=-1)
+    >>> pipeline.add('load', load_tensor, params=file_digest('tensor.npy'))
+    >>> pipeline.add('total', sum_tensor, deps=['load'])
+    >>> pipeline.run().ran
+    ['load', 'total']
+    >>> pipeline.run().skipped
+    ['load', 'total']
+    """
+    def __init__(self, build_dir, n_jobs=1, verbose=False):
+        self.build_dir = build_dir
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.cache = ResultCache(os.path.join(build_dir, 'results'),
+                                 max_bytes=None)
+        self.stages = {}
+        self.ran = []
+        self.skipped = []
+
+    def add(self, name, func, deps=(), params=None, outputs=None):
+        """Add a stage.
+
+        Parameters
+        ----------
+        name: str
+            Stage name.
+        func: callable
+            Called with a dict of the results of deps keyed by their names
+            (None for stages writing files). Returns a dict of ndarrays for a
+            computing stage. Must be picklable when n_jobs != 1 (e.g., a
+            module-level function or an instance of a module-level class).
+        deps: list of str, optional, (default=())
+            Names of the stages (already added) this stage depends on.
+        params: object, optional, (default=None)
+            Parameters with a deterministic repr hashed into the key (e.g.,
+            content hashes of input files and learner parameters).
+        outputs: list of str or None, optional, (default=None)
+            Paths of the files written by func. If None, the stage is a
+            computing stage.
+        Returns
+        -------
+        Key of the stage.
+        """
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f'Unknown dependency of {name}: {dep}')
+        key = make_key(name, params, *[self.stages[dep].key for dep in deps])
+        self.stages[name] = _Stage(name, func, list(deps), key, outputs)
+
+        return key
+
+    def run(self):
+        """Run the stages that are not up to date.
+
+        Returns
+        -------
+        self
+        """
+        self.ran = []
+        self.skipped = []
+        results = {}
+        done = set()
+        pending = dict(self.stages)
+        running = {}
+
+        executor = None
+        if self.n_jobs != 1:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=None if self.n_jobs < 0 else self.n_jobs)
+        try:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if not all(dep in done for dep in stage.deps):
+                        continue
+                    del pending[name]
+                    if self._is_up_to_date(stage):
+                        self._log(f'skip {name}')
+                        self.skipped.append(name)
+                        done.add(name)
+                        continue
+                    inputs = {
+                        dep: self._result(self.stages[dep], results)
+                        for dep in stage.deps
+                    }
+                    self._log(f'run {name}')
+                    if executor is None:
+                        future = concurrent.futures.Future()
+                        future.set_result(_run_stage(stage.func, inputs))
+                    else:
+                        future = executor.submit(_run_stage, stage.func,
+                                                 inputs)
+                    running[future] = stage
+                if not running:
+                    # stages skipped in this pass may have unblocked others
+                    continue
+
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    result, elapsed = future.result()
+                    self._save(stage, result)
+                    self._log(f'done {stage.name} ({elapsed:.2f}s)')
+                    results[stage.name] = result
+                    self.ran.append(stage.name)
+                    done.add(stage.name)
+        finally:
+            if executor is not None:
+                for future in running:
+                    future.cancel()
+                executor.shutdown(wait=True)
+
+        return self
+
+    def _is_up_to_date(self, stage):
+        if stage.outputs is None:
+            return stage.key in self.cache
+        try:
+            with open(self._stamp_path(stage)) as f:
+                stamp = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        return stamp.get('key') == stage.key and all(
+            os.path.exists(path) for path in stage.outputs)
+
+    def _result(self, stage, results):
+        if stage.outputs is not None:
+            return None
+        if stage.name in results:
+            return results[stage.name]
+        return self.cache.get(stage.key)
+
+    def _save(self, stage, result):
+        if stage.outputs is None:
+            self.cache.put(stage.key, result)
+            return
+        path = self._stamp_path(stage)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'key': stage.key, 'outputs': stage.outputs}, f)
+
+    def _stamp_path(self, stage):
+        return os.path.join(self.build_dir, 'stamps',
+                            make_key(stage.name) + '.json')
+
+    def _log(self, message):
+        if self.verbose:
+            print(message)
+
+
+def build_datasets(datasets,
+                   first_learner=None,
+                   second_learner=None,
+                   first_scaling=True,
+                   second_scaling=True,
+                   client_dir='ui/client/data',
+                   server_dir='ui/server/data',
+                   build_dir='./.multidr_build',
+                   client_format='json',
+                   n_clusters=8,
+                   n_jobs=1,
+                   verbose=False):
+    """Build the web UI files of datasets with a Pipeline.
+
+    For each dataset, the stages are load (checking the tensor), the first
+    DR, the six second DRs, the server .npy files, the feature contributions
+    of clusters of each embedding (server .npz files, see
+    multidr.export.write_cluster_fcs), and the client data, followed by the index (file_list.json listing all datasets in
+    client_dir). With n_jobs != 1, the second DRs of a dataset and the stages
+    of different datasets run in parallel. Stage keys are made from content
+    hashes of the input files and get_params() of the learners, so a rebuild
+    only costs the datasets (and stages) whose inputs changed. Learners
+    should have a fixed random_state so that rebuilt results are
+    reproducible.
+
+    Parameters
+    ----------
+    datasets: list of dicts
+        Each dict has name (DATANAME), tensor (path of a .npy file with shape
+        (n_time_points, n_instances, n_variables)), and optionally instances,
+        variables, and times (paths of CSV files with a row for each instance,
+        variable, and time point), instance_columns, variable_columns, and
+        time_columns ({CSV column: key in the client data}; if None, all
+        columns are used with their names), instance_aux (the same for the aux
+        object of instances), and si_view_info.
+    first_learner: Class Object for DR, optional, (default=None)
+        The same with the one of TDR.
+    second_learner: Class Object for DR, optional, (default=None)
+        The same with the one of TDR.
+    first_scaling: boolean or dict of booleans, optional, (default=True)
+        The same with the one of TDR.fit_transform.
+    second_scaling: boolean or dict of booleans, optional, (default=True)
+        The same with the one of TDR.fit_transform.
+    client_dir: str, optional, (default='ui/client/data')
+        Directory of the client files.
+    server_dir: str, optional, (default='ui/server/data')
+        Directory of the server files.
+    build_dir: str, optional, (default='./.multidr_build')
+        Directory storing the DR results and stamps of the stages.
+    client_format: 'json' or 'columnar', optional, (default='json')
+        The same with the one of multidr.export.export_ui_data.
+    n_clusters: int or None, optional, (default=8)
+        The number of clusters of each embedding whose feature contributions
+        are precomputed. If None, they are not precomputed.
+    n_jobs: int, optional, (default=1)
+        The same with the one of Pipeline.
+    verbose: boolean, optional, (default=False)
+        If True, print which stages are run or skipped.
+    Returns
+    -------
+    The Pipeline after running.
+    """
+    if client_format not in ('json', 'columnar'):
+        raise ValueError(f'Unknown client format: {client_format}')
+    # learners keyed by mode in the same way as TDR
+    learners = TDR(first_learner=first_learner, second_learner=second_learner)
+    first_scl = _scaling_flags(first_scaling)
+    second_scl = _scaling_flags(second_scaling)
+
+    pipeline = Pipeline(build_dir, n_jobs=n_jobs, verbose=verbose)
+    client_stages = []
+    for dataset in datasets:
+        name = dataset['name']
+
+        load = f'{name}/load'
+        pipeline.add(load,
+                     _LoadTensor(dataset['tensor']),
+                     params=file_digest(dataset['tensor']))
+
+        first = f'{name}/first_dr'
+        pipeline.add(first,
+                     _FirstDR(dataset['tensor'], learners.first_learner,
+                              first_scl),
+                     deps=[load],
+                     params=(first_scl,
+                             _learner_signatures(learners.first_learner)))
+
+        seconds = []
+        for Z_name in _Z_NAMES:
+            learner = learners.second_learner[Z_name[-1]]
+            scaling = second_scl[Z_name[-1]]
+            seconds.append(f'{name}/second_dr/{Z_name}')
+            pipeline.add(seconds[-1],
+                         _SecondDR(Z_name, learner, scaling),
+                         deps=[first],
+                         params=(scaling, _learner_signatures({'': learner})))
+
+        pipeline.add(f'{name}/server',
+                     _ServerData(name, server_dir),
+                     deps=[first],
+                     outputs=[
+                         os.path.join(server_dir, f'{name}_{Y_name}.npy')
+                         for Y_name in ['Y_tn', 'Y_nd', 'Y_dt']
+                     ])
+
+        if n_clusters is not None:
+            for Z_name, second in zip(_Z_NAMES, seconds):
+                path = os.path.join(server_dir, f'{name}_{Z_name}_fcs.npz')
+                pipeline.add(f'{name}/cluster_fcs/{Z_name}',
+                             _ClusterFcs(Z_name, path, n_clusters),
+                             deps=[first, second],
+                             params=n_clusters,
+                             outputs=[path])
+
+        if client_format == 'json':
+            client_outputs = [os.path.join(client_dir, name + '.json')]
+        else:
+            client_outputs = [
+                os.path.join(client_dir, name + '.bin'),
+                os.path.join(client_dir, name + '.manifest.json')
+            ]
+        client_stages.append(f'{name}/client')
+        pipeline.add(client_stages[-1],
+                     _ClientData(name, dataset, client_dir, client_format),
+                     deps=[first] + seconds,
+                     params=(_attribute_params(dataset), client_format),
+                     outputs=client_outputs)
+
+    # the index also lists datasets built by other runs, so the names of all
+    # datasets are part of its key
+    names = set(_listed_datasets(client_dir)) | {d['name'] for d in datasets}
+    pipeline.add('index',
+                 _FileList(client_dir),
+                 deps=client_stages,
+                 params=sorted(names),
+                 outputs=[os.path.join(client_dir, 'file_list.json')])
+
+    return pipeline.run()
+
+
+def file_digest(path, chunk_bytes=2**24):
+    """Return the SHA-256 hex digest of the content of a file."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def _run_stage(func, inputs):
+    """Run a stage and measure its wall time. Defined at module level so that
+    it can be sent to worker processes."""
+    start = time.perf_counter()
+    result = func(inputs)
+
+    return result, time.perf_counter() - start
+
+
+class _LoadTensor():
+    """Check the shape of a tensor file without reading its data. The result
+    is the shape (the tensor itself is read by the first DR, so that it is
+    not copied into the build directory)."""
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, inputs):
+        X = np.load(self.path, mmap_mode='r')
+        if X.ndim != 3:
+            raise ValueError(
+                f'{self.path} must be a third-order tensor, got shape '
+                f'{X.shape}')
+
+        return {'shape': np.array(X.shape)}
+
+
+class _FirstDR():
+    def __init__(self, path, first_learner, scaling):
+        self.path = path
+        self.first_learner = first_learner
+        self.scaling = scaling
+
+    def __call__(self, inputs):
+        tdr = TDR(first_learner=copy.deepcopy(self.first_learner))
+        tdr.learn_first_repr(np.load(self.path), scaling=self.scaling)
+
+        arrays = {'Y_tn': tdr.Y_tn, 'Y_nd': tdr.Y_nd, 'Y_dt': tdr.Y_dt}
+        for mode in ['n', 'd', 't']:
+            learner = tdr.first_learner[mode]
+            arrays[f'components__{mode}'] = learner.components_
+            arrays[f'explained_variance_ratio__{mode}'] = \
+                learner.explained_variance_ratio_
+
+        return arrays
+
+
+class _SecondDR():
+    def __init__(self, Z_name, second_learner, scaling):
+        self.Z_name = Z_name
+        self.second_learner = second_learner
+        self.scaling = scaling
+
+    def __call__(self, inputs):
+        first = next(iter(inputs.values()))
+        Y = _second_step_input(self.Z_name, first['Y_tn'], first['Y_nd'],
+                               first['Y_dt'])
+        if self.scaling:
+            Y = preprocessing.scale(Y)
+
+        return {'Z': copy.deepcopy(self.second_learner).fit_transform(Y)}
+
+
+class _ServerData():
+    def __init__(self, name, server_dir):
+        self.name = name
+        self.server_dir = server_dir
+
+    def __call__(self, inputs):
+        write_server_data(_fitted_tdr(inputs), self.name, self.server_dir)
+
+
+class _ClusterFcs():
+    def __init__(self, Z_name, path, n_clusters):
+        self.Z_name = Z_name
+        self.path = path
+        self.n_clusters = n_clusters
+
+    def __call__(self, inputs):
+        first, second = inputs.values()
+        X = _second_step_input(self.Z_name, first['Y_tn'], first['Y_nd'],
+                               first['Y_dt'])
+        labels, fcs = cluster_feat_contribs(X, second['Z'], self.n_clusters)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        save_cluster_fcs(self.path, X, labels, fcs)
+
+
+class _ClientData():
+    def __init__(self, name, dataset, client_dir, client_format):
+        self.name = name
+        self.dataset = dataset
+        self.client_dir = client_dir
+        self.client_format = client_format
+
+    def __call__(self, inputs):
+        tdr = _fitted_tdr(inputs)
+        kwargs = _read_attributes(self.dataset)
+        kwargs['si_view_info'] = self.dataset.get('si_view_info')
+        if self.client_format == 'json':
+            write_client_json(
+                os.path.join(self.client_dir, self.name + '.json'), tdr,
+                **kwargs)
+        else:
+            write_client_columnar(self.client_dir, self.name, tdr, **kwargs)
+        _remove_other_client_files(self.client_dir, self.name,
+                                   self.client_format)
+
+
+class _FileList():
+    def __init__(self, client_dir):
+        self.client_dir = client_dir
+
+    def __call__(self, inputs):
+        update_file_list(self.client_dir)
+
+
+def _fitted_tdr(inputs):
+    """Return an object with the attributes of a fitted TDR used by
+    multidr.export, made from the results of first and second DR stages."""
+    tdr = types.SimpleNamespace(first_learner={})
+    for stage_name, arrays in inputs.items():
+        if stage_name.endswith('/first_dr'):
+            for Y_name in ['Y_tn', 'Y_nd', 'Y_dt']:
+                setattr(tdr, Y_name, arrays[Y_name])
+            for mode in ['n', 'd', 't']:
+                tdr.first_learner[mode] = types.SimpleNamespace(
+                    components_=arrays[f'components__{mode}'],
+                    explained_variance_ratio_=arrays[
+                        f'explained_variance_ratio__{mode}'])
+        else:
+            setattr(tdr, stage_name.rsplit('/', 1)[1], arrays['Z'])
+
+    return tdr
+
+
+# (argument of multidr.export, key of the CSV path, key of the columns)
+_ATTRIBUTE_FILES = [('instances', 'instances', 'instance_columns'),
+                    ('variables', 'variables', 'variable_columns'),
+                    ('time_points', 'times', 'time_columns')]
+
+
+def _read_attributes(dataset):
+    """Read the attribute CSVs of a dataset into the arguments of
+    multidr.export (instances, variables, and time_points)."""
+    if not any(dataset.get(path_key) for _, path_key, _ in _ATTRIBUTE_FILES):
+        return {}
+    try:
+        import pandas as pd
+    except ImportError as e:
+        raise ImportError(
+            'pandas is required to read the CSV files of instances, '
+            'variables, and times. Install it with `pip3 install pandas` (or '
+            '`pip3 install ".[build]"`).') from e
+
+    attributes = {}
+    for arg, path_key, columns_key in _ATTRIBUTE_FILES:
+        if dataset.get(path_key) is None:
+            continue
+        df = pd.read_csv(dataset[path_key])
+        aux = dataset.get('instance_aux') if arg == 'instances' else None
+        columns = dataset.get(columns_key)
+        if columns is None:
+            columns = {c: c for c in df.columns if c not in (aux or {})}
+        attributes[arg] = {key: df[c].to_numpy() for c, key in columns.items()}
+        if aux:
+            attributes[arg]['aux'] = {
+                key: df[c].to_numpy()
+                for c, key in aux.items()
+            }
+
+    return attributes
+
+
+def _attribute_params(dataset):
+    """Return the parameters of the client data stage of a dataset (content
+    hashes of the attribute CSVs and the options reading them)."""
+    params = []
+    for _, path_key, columns_key in _ATTRIBUTE_FILES:
+        if dataset.get(path_key) is not None:
+            params.append((path_key, file_digest(dataset[path_key]),
+                           json.dumps(dataset.get(columns_key),
+                                      sort_keys=True)))
+    for key in ['instance_aux', 'si_view_info']:
+        params.append(json.dumps(dataset.get(key), sort_keys=True))
+
+    return params
+
+
+def _listed_datasets(client_dir):
+    """Return the names of the datasets in client_dir (the same ones as
+    update_file_list lists)."""
+    if not os.path.isdir(client_dir):
+        return []
+    names = []
+    for file_name in os.listdir(client_dir):
+        if file_name == 'file_list.json':
+            continue
+        for suffix in ['.manifest.json', '.json']:
+            if file_name.endswith(suffix):
+                names.append(file_name[:-len(suffix)])
+                break
+
+    return names
@@ -0,0 +1,190 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+
+class ResultCache():
+    """ResultCache: Content-addressed on-disk cache of DR results
+
+    Each entry is a set of named ndarrays stored as one .npz file whose name is
+    the entry key. Entries are evicted in least-recently-used order (based on
+    file modification times, which are updated on every hit) when the total
+    size of the cache directory exceeds max_bytes.
+
+    Parameters
+    ----------
+    cache_dir: str
+        Directory storing cache entries. Created if it does not exist.
+    max_bytes: int, optional, (default=2**30)
+        Upper bound of the total size of the cache entries in bytes. If None,
+        entries are never evicted.
+    Attributes
+    ----------
+    cache_dir: the same with the input parameter one.
+    max_bytes: the same with the input parameter one.
+    n_hits: int
+        The number of get calls that found an entry.
+    n_misses: int
+        The number of get calls that did not find an entry.
+    ----------
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from multidr.cache import ResultCache, make_key
+
+    >>> cache = ResultCache('./.multidr_cache', max_bytes=10 * 2**20)
+    >>> X = np.random.rand(10, 5, 3)
+    >>> key = make_key(X, {'scaling': True})
+    >>> if cache.get(key) is None:
+    ...     cache.put(key, {'X_sum': X.sum(axis=0)})
+    >>> cache.get(key)['X_sum'].shape
+    (5, 3)
+    """
+    def __init__(self, cache_dir, max_bytes=2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.n_hits = 0
+        self.n_misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """Return the entry stored with key.
+
+        Parameters
+        ----------
+        key: str
+            Entry key (e.g., produced by make_key).
+        Returns
+        -------
+        Dict of ndarrays, or None if there is no entry for key.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+        except (OSError, ValueError):
+            # missing, or broken by an interrupted write of another process
+            self.n_misses += 1
+            return None
+        # mark as recently used
+        os.utime(path)
+        self.n_hits += 1
+
+        return arrays
+
+    def __contains__(self, key):
+        """Return True if there is an entry for key (without loading it or
+        counting a hit or miss)."""
+        return os.path.exists(self._path(key))
+
+    def put(self, key, arrays):
+        """Store an entry and evict least recently used entries if needed.
+
+        Parameters
+        ----------
+        key: str
+            Entry key (e.g., produced by make_key).
+        arrays: dict of array-likes
+            Named arrays to store. Names must be valid keys of np.savez.
+        Returns
+        -------
+        self
+        """
+        # write to a temporary file first so that readers never see a
+        # partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._evict()
+
+        return self
+
+    def clear(self):
+        """Remove all entries.
+
+        Returns
+        -------
+        self
+        """
+        for path, _, _ in self._entries():
+            os.remove(path)
+
+        return self
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def _entries(self):
+        """Return (path, size, mtime) of the entries, oldest first."""
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith('.npz'):
+                continue
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:  # removed by another process
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        entries = self._entries()
+        total_bytes = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
+
+
+def make_key(*parts):
+    """Make a cache key by hashing the given parts.
+
+    Parameters
+    ----------
+    parts: ndarrays or objects with a deterministic repr (e.g., dicts of
+        parameters). ndarrays are hashed with their dtype, shape, and bytes.
+    Returns
+    -------
+    Hex digest string.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(repr((part.dtype.str, part.shape)).encode())
+            _update_with_array(h, part)
+        else:
+            h.update(repr(part).encode())
+        # separator so that different splits of the same bytes differ
+        h.update(b'\0')
+
+    return h.hexdigest()
+
+
+def _update_with_array(h, X, chunk_bytes=2**26):
+    """Feed the bytes of X into a hash object chunk by chunk along the first
+    axis, so that memory-mapped arrays are not loaded at once."""
+    if X.ndim == 0 or X.shape[0] == 0:
+        h.update(np.ascontiguousarray(X).tobytes())
+        return
+    row_bytes = max(1, X[0].nbytes)
+    step = max(1, chunk_bytes // row_bytes)
+    for start in range(0, X.shape[0], step):
+        h.update(np.ascontiguousarray(X[start:start + step]).data)
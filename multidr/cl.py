@@ -1,5 +1,9 @@
+import concurrent.futures
+import copy
+import os
+
 import numpy as np
-from scipy.stats import pearsonr
+import scipy.linalg
 
 
 class CL():
@@ -66,6 +70,14 @@ class CL():
     ...     cl.fit(cluster, others, var_thres_ratio=0.5, max_log_alpha=2)
     ...     plt.plot(cl.fcs, c=plt.get_cmap('Accent')(cluster_id))
 
+    >>> # or, for all clusters at once
+    >>> fcs = cl.fit_one_vs_rest(Y_nt,
+    ...                          clustering.labels_,
+    ...                          var_thres_ratio=0.5,
+    ...                          max_log_alpha=2)
+    >>> for cluster_id, cluster_fcs in enumerate(fcs):
+    ...     plt.plot(cluster_fcs, c=plt.get_cmap('Accent')(cluster_id))
+
     >>> plt.xlabel('time')
     >>> plt.ylabel('Feature contribution (without scaling)')
     >>> plt.title('Feature cotributions')
@@ -99,15 +111,11 @@ class CL():
         self.learner.fit(K, R, **contrast_learner_kwargs)
         self.fcs = self.learner.get_feat_contribs()
 
-        X = np.vstack((K, R))
-        selected = np.array([1] * K.shape[0] + [0] * R.shape[0])
-
         ## adjust fcs direcrtion
 
         # check pearson corr between "selected or not" and "feature values"
         # if selected rows tend to have higher values corr becomes positive
-        corr_selected_fval = np.array(
-            [pearsonr(selected, X[:, col])[0] for col in range(X.shape[1])])
+        corr_selected_fval = _selection_correlations(K, R)
 
         # compute score of agreement of correlation and fcs directions
         # (more correlated or higher absolute value of fcs will have heavier weights)
@@ -118,6 +126,89 @@ class CL():
 
         return self
 
+    def fit_one_vs_rest(self,
+                        X,
+                        labels,
+                        n_jobs=1,
+                        executor=None,
+                        exact=False,
+                        **contrast_learner_kwargs):
+        """Apply fit to each cluster (as K) against all the other rows (as R)
+        and return the feature contributions of all clusters.
+
+        When the learner is ccPCA with automatic alpha selection, the
+        clusters are fitted with one SelectionCL of X: the scatter matrix and
+        mean of X are computed once and those of the rest of each cluster are
+        derived from them by a downdate with the cluster's rows (unless
+        exact). Otherwise, copies of the learner are fitted with K and R,
+        which are built inside each job. In both cases, jobs can be run in
+        parallel. self.learner and self.fcs are not changed.
+
+        Parameters
+        ----------
+        X: array-like, shape(n_samples, n_features)
+            All rows (e.g., Y_tn.transpose() of TDR for instance clusters).
+        labels: array-like, shape(n_samples,)
+            Cluster labels of the rows (e.g., labels_ of SpectralClustering).
+        n_jobs: int, optional, default=1
+            The number of worker processes used to fit clusters
+            concurrently. 1 fits them sequentially in the current process and
+            -1 uses all CPUs.
+        executor: concurrent.futures.Executor, optional, default=None
+            If not None, this executor is used instead of a process pool
+            created from n_jobs. The executor is not shut down.
+        exact: bool, optional, default=False
+            The same as the parameter of SelectionCL (used only for ccPCA).
+            If False, the background covariances are downdated from the
+            scatter matrix of X and eigenvector signs are fixed, so the
+            chosen alpha can differ from fit for clusters where ccPCA's
+            choice depends on eigenvector signs.
+        contrast_learner_kwargs: additional keywards for input parameters.
+            e.g., for ccPCA, var_thres_ratio=0.5, max_log_alpha=2
+        Returns
+        -------
+        fcs: ndarray, shape(n_clusters, n_features)
+            Feature contributions (with the sign adjustment) of each cluster.
+            Rows correspond to np.unique(labels).
+        """
+        X = np.asarray(X, dtype=np.float64)
+        labels = np.asarray(labels)
+        cluster_ids = np.unique(labels)
+
+        if _is_auto_alpha_ccpca(self.learner, contrast_learner_kwargs):
+            learner = SelectionCL(X,
+                                  standardize=self.learner._cpca.standardize,
+                                  exact=exact)
+        else:
+            learner = self.learner
+
+        if n_jobs is None or n_jobs < 0:
+            n_jobs = os.cpu_count()
+        if executor is None and n_jobs == 1:
+            fcs = [
+                _one_vs_rest_feat_contribs(learner, X, labels, cluster_id,
+                                           contrast_learner_kwargs)
+                for cluster_id in cluster_ids
+            ]
+        else:
+            own_executor = executor is None
+            if own_executor:
+                executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=min(n_jobs, len(cluster_ids)))
+            try:
+                futures = [
+                    executor.submit(_one_vs_rest_feat_contribs, learner, X,
+                                    labels, cluster_id,
+                                    contrast_learner_kwargs)
+                    for cluster_id in cluster_ids
+                ]
+                fcs = [future.result() for future in futures]
+            finally:
+                if own_executor:
+                    executor.shutdown(wait=True)
+
+        return np.array(fcs, dtype=np.float64)
+
     def set_learner(self, learner):
         """Set a contrastive representation learning method.
 
@@ -138,3 +229,389 @@ class CL():
             self.learner = CCPCA()
         else:
             self.learner = learner
+
+        return self
+
+
+class SelectionCL():
+    """SelectionCL: Contrastive learning (ccPCA with the sign adjustment of
+    CL) of selected rows of a fixed dataset against the other rows, for
+    interactive selections
+
+    The result of feat_contribs(selected) is the same as CL with
+    CCPCA(standardize=standardize) fitted with K = X[selected] and
+    R = X[~selected] (i.e., the fcs of CL.fit(X[selected], X[~selected])).
+    The sign of an eigenvector returned by eigh is arbitrary and flips with
+    rounding-level changes of its input matrix, and the sign changes the
+    histogram intersection used to choose alpha. So, with exact=True, the
+    foreground (K stacked on R) and background (R) covariances are built
+    with exactly the same operations as in ccPCA, and only the projections
+    and histograms of all alphas are computed without Python loops over
+    rows.
+
+    With exact=False, the scatter matrix of X is computed once in the
+    constructor and the background covariance of each selection is derived
+    from it by a downdate with the selected rows (scatter of R = scatter of
+    X - scatter of K - a rank-one term of the mean difference), so the cost
+    of the covariances depends on the number of selected rows, not on the
+    number of all rows. The covariances are the same as those of ccPCA up to
+    rounding errors, so the sign of each eigenvector is fixed (the entry with
+    the largest magnitude is made positive) before the projections, which
+    makes the result independent of rounding errors. The result is the one
+    of ccPCA with these signs, so it can differ from ccPCA (whose signs are
+    those returned by eigh) for selections where the chosen alpha depends on
+    the signs. Note that the projections and the standardization of the
+    foreground still cost O(n_samples * n_features) per alpha, so the
+    downdate saves the covariance of all rows, O(n_samples * n_features^2),
+    which dominates only when n_features is larger than n_alphas.
+
+    feat_contribs does not change the object, so one SelectionCL can be
+    shared by threads (e.g., those of a websocket server).
+
+    Parameters
+    ----------
+    X: array-like, shape(n_samples, n_features)
+        All rows (e.g., Y_tn.transpose() of TDR).
+    standardize: bool, optional, (default=True)
+        The same as the parameter of ccPCA. If True, the foreground and
+        background are standardized before computing their covariances.
+    exact: bool, optional, (default=True)
+        If True, the result is the same as ccPCA's. If False, covariances are
+        derived from the scatter matrix of X and eigenvector signs are fixed
+        (faster for many features, but the result can differ from ccPCA's).
+    Attributes
+    ----------
+    X: ndarray, shape(n_samples, n_features)
+        X as a float64 array.
+    mean: ndarray, shape(n_features,)
+        Column means of X.
+    scatter: ndarray, shape(n_features, n_features)
+        Scatter matrix (centered X.T @ centered X) of X (None if exact).
+    fg_cov: ndarray, shape(n_features, n_features)
+        Covariance matrix of the (standardized) foreground used by ccPCA
+        (None if exact).
+    ----------
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from multidr.cl import SelectionCL
+
+    >>> Y_nt = np.load('./data/air_quality/tensor.npy').mean(axis=2).T
+    >>> selection_cl = SelectionCL(Y_nt)
+    >>> selected = np.zeros(Y_nt.shape[0], dtype=bool)
+    >>> selected[:10] = True
+    >>> fcs = selection_cl.feat_contribs(selected,
+    ...                                  var_thres_ratio=0.5,
+    ...                                  max_log_alpha=2)
+    """
+
+    def __init__(self, X, standardize=True, exact=True):
+        self.X = np.asarray(X, dtype=np.float64)
+        self.standardize = standardize
+        self.exact = exact
+
+        n = self.X.shape[0]
+        self.mean = self.X.mean(axis=0)
+        self.scatter = None
+        self.fg_cov = None
+        if exact:
+            return
+
+        X_c = self.X - self.mean
+        self.scatter = X_c.T @ X_c
+        self.fg_cov, self._fg_inv_std = _ccpca_covariance(
+            self.scatter, n, self.mean, standardize)
+
+        # component of alpha=0 (i.e., PCA of the foreground)
+        self._base_eigenpair = _top_eigenpair(self.fg_cov)
+
+    def feat_contribs(self,
+                      selected,
+                      var_thres_ratio=0.5,
+                      n_alphas=40,
+                      max_log_alpha=1.0):
+        """Find the best contrast parameter alpha in the same way as ccPCA
+        and return the feature contributions of the selected rows with the
+        sign adjustment of CL.
+
+        Parameters
+        ----------
+        selected: array-like, shape(n_samples,)
+            Boolean mask of the selected rows (K). The other rows are used as
+            R.
+        var_thres_ratio: float, optional, (default=0.5)
+            The same as the parameter of ccPCA's fit.
+        n_alphas: int, optional, (default=40)
+            The same as the parameter of ccPCA's fit.
+        max_log_alpha: float, optional, (default=1.0)
+            The same as the parameter of ccPCA's fit.
+        Returns
+        -------
+        fcs: ndarray, shape(n_features,)
+            Feature contributions.
+        """
+        selected = np.asarray(selected, dtype=bool)
+        n = self.X.shape[0]
+        K = self.X[selected]
+        n_k = K.shape[0]
+        n_r = n - n_k
+        if n_k == 0 or n_r == 0:
+            raise ValueError(
+                'selected must have both selected and unselected rows.')
+
+        alphas = np.logspace(-1, max_log_alpha, num=n_alphas - 1)
+        if self.exact:
+            R = self.X[~selected]
+            fg = _ccpca_standardized(np.vstack((K, R)), self.standardize)
+            bg = _ccpca_standardized(R, self.standardize)
+            fg_cov = _ccpca_scatter_cov(fg)
+            bg_cov = _ccpca_scatter_cov(bg)
+            eigenpairs = [_top_eigenpair(fg_cov)] + [
+                _top_eigenpair(fg_cov - alpha * bg_cov) for alpha in alphas
+            ]
+
+            # projections of the standardized foreground (rows of K first) by
+            # the same matrix-vector products as in ccPCA
+            proj = np.column_stack([
+                fg @ component[:, np.newaxis] for _, component in eigenpairs
+            ])
+            proj_K = proj[:n_k]
+            proj_R = proj[n_k:]
+        else:
+            # statistics of R by the downdate of those of X with K
+            mean_k = K.mean(axis=0)
+            K_c = K - mean_k
+            scatter_k = K_c.T @ K_c
+            mean_r = (n * self.mean - n_k * mean_k) / n_r
+            diff = mean_k - mean_r
+            scatter_r = (self.scatter - scatter_k -
+                         (n_k * n_r / n) * np.outer(diff, diff))
+            # rounding errors of the downdate are relative to the scatter of
+            # X (e.g., features constant only in R are not exactly 0)
+            scatter_r_diag = np.diag(scatter_r).copy()
+            scatter_r_diag[scatter_r_diag <= n * np.finfo(np.float64).eps *
+                           np.diag(self.scatter)] = 0.0
+            np.fill_diagonal(scatter_r, scatter_r_diag)
+            bg_cov, _ = _ccpca_covariance(scatter_r, n_r, mean_r,
+                                          self.standardize)
+
+            eigenpairs = [self._base_eigenpair] + [
+                _top_eigenpair(self.fg_cov - alpha * bg_cov)
+                for alpha in alphas
+            ]
+            # signs returned by eigh flip with rounding errors of the
+            # downdate, and the sign changes the histogram intersection
+            eigenpairs = [(eigenvalue, _canonical_sign(component))
+                          for eigenvalue, component in eigenpairs]
+
+            # projections of the standardized foreground for all alphas
+            W = self._fg_inv_std[:, np.newaxis] * np.column_stack(
+                [component for _, component in eigenpairs])
+            proj = self.X @ W - self.mean @ W
+            proj_K = proj[selected]
+            proj_R = proj[~selected]
+
+        base_var_K, _ = _scaled_var(proj_K[:, 0], proj_R[:, 0])
+        best_discrepancy = 1.0 / max(
+            _hist_intersect(proj_K[:, 0], proj_R[:, 0]),
+            np.finfo(np.float64).tiny)
+        best = 0
+        for i in range(1, len(eigenpairs)):
+            discrepancy = 1.0 / max(
+                _hist_intersect(proj_K[:, i], proj_R[:, i]),
+                np.finfo(np.float64).tiny)
+            var_K, _ = _scaled_var(proj_K[:, i], proj_R[:, i])
+            if (var_K >= base_var_K * var_thres_ratio
+                    and discrepancy > best_discrepancy):
+                best_discrepancy = discrepancy
+                best = i
+
+        eigenvalue, component = eigenpairs[best]
+        fcs = component * np.sqrt(np.abs(eigenvalue))
+
+        # the same sign adjustment as in CL.fit
+        if self.exact:
+            corrs = _selection_correlations(K, R)
+        else:
+            var_k = np.diag(scatter_k) / n_k
+            var_r = np.maximum(scatter_r_diag, 0.0) / n_r
+            corrs = _selection_correlations_from_moments(
+                n_k, mean_k, var_k, n_r, mean_r, var_r)
+        if np.sum(corrs * fcs) < 0:
+            fcs = -fcs
+
+        return fcs
+
+
+def _selection_correlations(K, R):
+    """Pearson correlation coefficients between the indicator of selection
+    (1 for rows of K and 0 for rows of R) and each feature of the rows of K
+    and R (i.e., point-biserial correlations).
+
+    The coefficients are computed from the means and variances of K and R
+    without stacking them. Features that are constant over the rows of K and
+    R (and all features when K or R is empty) have a correlation of 0.
+
+    Parameters
+    ----------
+    K: array-like, shape(n_samples1, n_features)
+        Selected rows.
+    R: array-like, shape(n_samples2, n_features)
+        The other rows.
+    Returns
+    -------
+    corrs: ndarray, shape(n_features,)
+    """
+    K = np.asarray(K, dtype=np.float64)
+    R = np.asarray(R, dtype=np.float64)
+
+    return _selection_correlations_from_moments(K.shape[0], K.mean(axis=0),
+                                                K.var(axis=0), R.shape[0],
+                                                R.mean(axis=0), R.var(axis=0))
+
+
+def _selection_correlations_from_moments(n_k, mean_k, var_k, n_r, mean_r,
+                                         var_r):
+    """_selection_correlations from the numbers of rows, means, and variances
+    (ddof=0) of K and R."""
+    n = n_k + n_r
+    if n_k == 0 or n_r == 0:
+        return np.zeros(len(mean_k) if n_k > 0 else len(mean_r))
+
+    diff = mean_k - mean_r
+    # variance of the stacked rows (ddof=0) from the group moments
+    var = (n_k * var_k + n_r * var_r + (n_k * n_r / n) * diff**2) / n
+
+    mean = (n_k * mean_k + n_r * mean_r) / n
+    constant = _is_constant(n, mean, var)
+
+    corrs = np.zeros_like(var)
+    nonconstant = ~constant
+    corrs[nonconstant] = (diff[nonconstant] * np.sqrt(n_k * n_r) /
+                          (n * np.sqrt(var[nonconstant])))
+    # rounding errors can push |corrs| slightly above 1
+    np.clip(corrs, -1.0, 1.0, out=corrs)
+
+    return corrs
+
+
+def _one_vs_rest_feat_contribs(learner, X, labels, cluster_id,
+                               contrast_learner_kwargs):
+    """Feature contributions (with the sign adjustment of CL.fit) of the rows
+    of X with cluster_id against the other rows, computed with SelectionCL
+    or a copy of learner. Defined at module level so that it can be sent to
+    worker processes."""
+    selected = labels == cluster_id
+    if isinstance(learner, SelectionCL):
+        return learner.feat_contribs(selected, **contrast_learner_kwargs)
+
+    K = X[selected]
+    R = X[~selected]
+    learner = copy.deepcopy(learner)
+    learner.fit(K, R, **contrast_learner_kwargs)
+    fcs = learner.get_feat_contribs()
+
+    # the same sign adjustment as in CL.fit
+    if np.sum(_selection_correlations(K, R) * fcs) < 0:
+        fcs = -fcs
+
+    return fcs
+
+
+def _is_auto_alpha_ccpca(learner, contrast_learner_kwargs):
+    """Whether learner is ccPCA fitted with automatic alpha selection by the
+    keyword arguments, which SelectionCL computes in the same way."""
+    return (type(learner).__name__ == 'CCPCA' and hasattr(learner, '_cpca')
+            and set(contrast_learner_kwargs) <=
+            {'var_thres_ratio', 'n_alphas', 'max_log_alpha'})
+
+
+def _ccpca_covariance(scatter, n, mean, standardize):
+    """Covariance matrix computed by ccPCA (cPCA) from the scatter matrix of
+    n rows with mean. Returns the covariance and the inverse of the standard
+    deviations (ddof=0) used for standardization (0 for constant features,
+    which ccPCA sets to 0; ones if not standardize)."""
+    cov = scatter / max(n - 1, np.finfo(np.float64).tiny)
+    inv_std = np.ones(len(mean))
+    if standardize:
+        var = np.maximum(np.diag(scatter), 0.0) / n
+        constant = _is_constant(n, mean, var)
+        inv_std[constant] = 0.0
+        inv_std[~constant] = 1.0 / np.sqrt(var[~constant])
+        cov = cov * np.outer(inv_std, inv_std)
+
+    return cov, inv_std
+
+
+def _ccpca_standardized(A, standardize):
+    """A centered (and standardized, setting constant features to 0) with the
+    same operations as cPCA, so that the result is bitwise the same."""
+    A = A - np.mean(A, axis=0)
+    if standardize:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            A /= np.std(A, axis=0)
+        A[np.isnan(A)] = 0.0
+
+    return A
+
+
+def _ccpca_scatter_cov(A):
+    """Covariance matrix of centered A computed in the same way as cPCA."""
+    return (A.T @ A) / max(A.shape[0] - 1, np.finfo(A.dtype).tiny)
+
+
+def _is_constant(n, mean, var):
+    """Features whose variance is 0, allowing rounding errors of the variance
+    (the same bound as scikit-learn's StandardScaler)."""
+    eps = np.finfo(np.float64).eps
+    return var <= n * eps * var + (n * mean * eps)**2
+
+
+def _top_eigenpair(C):
+    """Eigenvalue and eigenvector of symmetric C with the largest eigenvalue,
+    computed in the same way as cPCA."""
+    w, v = scipy.linalg.eigh(C)
+    top = np.argsort(-np.real(w))[:1]
+    return w[top][0], v[:, top][:, 0]
+
+
+def _canonical_sign(component):
+    """component with the sign that makes its entry with the largest
+    magnitude positive."""
+    if component[np.argmax(np.abs(component))] < 0:
+        return -component
+    return component
+
+
+def _scaled_var(a, b):
+    """Variances of a and b scaled by the range of a and b (as in ccPCA)."""
+    min_val = min(a.min(), b.min())
+    max_val = max(a.max(), b.max())
+    val_range = max(max_val - min_val, np.finfo(np.float64).tiny)
+    var_a = np.mean(((a - np.mean(a)) / val_range)**2)
+    var_b = np.mean(((b - np.mean(b)) / val_range)**2)
+
+    return var_a, var_b
+
+
+def _hist_intersect(a, b):
+    """Histogram intersection of a and b with Scott's bin width (the same
+    result as ccPCA, computed with bincount instead of Python loops)."""
+    min_val = min(a.min(), b.min())
+    max_val = max(a.max(), b.max())
+    val_range = max(max_val - min_val, np.finfo(np.float64).tiny)
+
+    ab = (np.hstack((a, b)) - min_val) / val_range
+    sd = 0.0
+    if ab.size > 1:
+        sd = np.sqrt(((ab - ab.mean())**2).sum() / float(ab.size - 1))
+    denom = max(np.power(ab.size, 1.0 / 3.0), np.finfo(np.float64).tiny)
+    bin_w = max(3.5 * sd / denom, np.finfo(np.float64).tiny)
+
+    # bins after the last occupied one are empty for both a and b
+    bin_indices = (ab / bin_w).astype(np.int64)
+    n_bins = bin_indices.max() + 1
+    counts_a = np.bincount(bin_indices[:a.size], minlength=n_bins)
+    counts_b = np.bincount(bin_indices[a.size:], minlength=n_bins)
+
+    return np.minimum(counts_a, counts_b).sum()
@@ -0,0 +1,147 @@
+"""Command-line interface of multidr.
+
+Usage:
+    multidr build air_quality --tensor data/air_quality/tensor.npy \\
+        --instances data/air_quality/instances.csv --instance_columns name \\
+        --instance_aux x y --variables data/air_quality/variables.csv \\
+        --times data/air_quality/times.csv --time_columns check_time:time \\
+        --si_view instance=map time=calendar --no_second_scaling \\
+        --n_neighbors 7 --min_dist 0.15
+    multidr build --config datasets.json --n_jobs -1
+
+The same as `python -m multidr.cli ...`. See `multidr build --help` for
+options and multidr.build.build_datasets for the stages.
+"""
+import argparse
+import json
+import sys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='multidr')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser(
+        'build',
+        help='build the web UI files of datasets, skipping the stages whose '
+        'inputs have not changed')
+    build.add_argument('name',
+                       nargs='?',
+                       help='dataset name (DATANAME of the written files)')
+    build.add_argument('--tensor', help='.npy file of a tensor (T, N, D)')
+    build.add_argument('--instances', help='CSV file with a row per instance')
+    build.add_argument('--variables', help='CSV file with a row per variable')
+    build.add_argument('--times', help='CSV file with a row per time point')
+    for key in ['instance_columns', 'variable_columns', 'time_columns']:
+        build.add_argument(
+            f'--{key}',
+            nargs='+',
+            metavar='COLUMN[:KEY]',
+            help='CSV columns included in the client data, optionally '
+            'renamed to KEY (default: all columns)')
+    build.add_argument('--instance_aux',
+                       nargs='+',
+                       metavar='COLUMN[:KEY]',
+                       help='CSV columns included in aux of instances')
+    build.add_argument('--si_view',
+                       nargs='+',
+                       metavar='KEY=VIEW',
+                       help='siViewInfo of the client data (e.g., '
+                       'instance=map time=calendar)')
+    build.add_argument(
+        '--config',
+        help='JSON file with a list of datasets, each a dict of the options '
+        'above (name, tensor, instances, variables, times, instance_columns '
+        'as {column: key}, ..., si_view_info). Used instead of the dataset '
+        'options')
+    build.add_argument('--client_dir', default='ui/client/data')
+    build.add_argument('--server_dir', default='ui/server/data')
+    build.add_argument('--build_dir', default='./.multidr_build')
+    build.add_argument('--client_format',
+                       choices=['json', 'columnar'],
+                       default='json')
+    build.add_argument(
+        '--n_clusters',
+        type=int,
+        default=8,
+        help='number of clusters of each embedding whose feature '
+        'contributions are precomputed for the server (0 disables it)')
+    build.add_argument('--n_jobs', type=int, default=1)
+    build.add_argument('--second_learner',
+                       choices=['umap', 'pca'],
+                       default='umap')
+    build.add_argument('--n_neighbors', type=int, default=15)
+    build.add_argument('--min_dist', type=float, default=0.1)
+    build.add_argument('--random_state', type=int, default=0)
+    build.add_argument('--no_first_scaling', action='store_true')
+    build.add_argument('--no_second_scaling', action='store_true')
+    build.add_argument('--verbose', action='store_true')
+
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        return _build(build, args)
+
+
+def _build(parser, args):
+    from sklearn.decomposition import PCA
+    from umap import UMAP
+
+    from multidr.build import build_datasets
+
+    if args.config is not None:
+        with open(args.config) as f:
+            datasets = json.load(f)
+    elif args.name is None or args.tensor is None:
+        parser.error('name and --tensor (or --config) are required')
+    else:
+        datasets = [_dataset_from_args(parser, args)]
+
+    if args.second_learner == 'umap':
+        second_learner = UMAP(n_components=2,
+                              n_neighbors=args.n_neighbors,
+                              min_dist=args.min_dist,
+                              random_state=args.random_state)
+    else:
+        second_learner = PCA(n_components=2)
+
+    pipeline = build_datasets(datasets,
+                              first_learner=PCA(n_components=1),
+                              second_learner=second_learner,
+                              first_scaling=not args.no_first_scaling,
+                              second_scaling=not args.no_second_scaling,
+                              client_dir=args.client_dir,
+                              server_dir=args.server_dir,
+                              build_dir=args.build_dir,
+                              client_format=args.client_format,
+                              n_clusters=args.n_clusters or None,
+                              n_jobs=args.n_jobs,
+                              verbose=args.verbose)
+    print(f'{len(pipeline.ran)} stages run, {len(pipeline.skipped)} skipped')
+
+    return 0
+
+
+def _dataset_from_args(parser, args):
+    dataset = {'name': args.name, 'tensor': args.tensor}
+    for key in ['instances', 'variables', 'times']:
+        if getattr(args, key) is not None:
+            dataset[key] = getattr(args, key)
+    for key in [
+            'instance_columns', 'variable_columns', 'time_columns',
+            'instance_aux'
+    ]:
+        if getattr(args, key) is not None:
+            dataset[key] = dict(
+                (spec.split(':', 1) + [spec])[:2] for spec in getattr(args, key))
+    if args.si_view is not None:
+        try:
+            dataset['si_view_info'] = dict(
+                spec.split('=', 1) for spec in args.si_view)
+        except ValueError:
+            parser.error('--si_view takes KEY=VIEW pairs')
+
+    return dataset
+
+
+if __name__ == '__main__':
+    sys.exit(main())
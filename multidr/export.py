@@ -0,0 +1,494 @@
+import glob
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from multidr.cl import SelectionCL
+from multidr.tdr import _Z_NAMES, _second_step_input
+
+# (key in the client data, ID key of each row, Z names) of each mode
+_CLIENT_GROUPS = [('instances', 'n', ['Z_n_dt', 'Z_n_td']),
+                  ('variables', 'd', ['Z_d_tn', 'Z_d_nt']),
+                  ('timePoints', 't', ['Z_t_dn', 'Z_t_nd'])]
+
+
+def export_ui_data(tdr,
+                   name,
+                   instances=None,
+                   variables=None,
+                   time_points=None,
+                   si_view_info=None,
+                   client_dir='ui/client/data',
+                   server_dir='ui/server/data',
+                   update_list=True,
+                   chunk_size=10000,
+                   client_format='json',
+                   n_clusters=None):
+    """Write the client and server files of the web UI for a fitted TDR (see
+    ui/doc/data_format.md).
+
+    Parameters
+    ----------
+    tdr: TDR
+        TDR after fit_transform.
+    name: str
+        Dataset name (DATANAME of the files).
+    instances: dict or None, optional, (default=None)
+        Attributes of instances included in each row of instances, as
+        {key: array-like of length N}. The value of key 'aux' can be a dict of
+        such attributes, which is written as the aux object of each row
+        (e.g., {'name': df['name'], 'aux': {'x': df['x'], 'y': df['y']}}).
+    variables: dict or None, optional, (default=None)
+        Attributes of variables (array-likes of length D), e.g., {'name':
+        names}.
+    time_points: dict or None, optional, (default=None)
+        Attributes of time points (array-likes of length T), e.g., {'time':
+        times}.
+    si_view_info: dict or None, optional, (default=None)
+        siViewInfo of the client data (e.g., {'instance': 'map'}). If None,
+        not written.
+    client_dir: str, optional, (default='ui/client/data')
+        Directory of the client files.
+    server_dir: str, optional, (default='ui/server/data')
+        Directory of the server files.
+    update_list: boolean, optional, (default=True)
+        If True, file_list.json in client_dir is rewritten to list all
+        datasets in client_dir.
+    chunk_size: int, optional, (default=10000)
+        Number of rows serialized at once. The client JSON is written to the
+        file chunk by chunk and never held in memory as a whole.
+    client_format: 'json' or 'columnar', optional, (default='json')
+        Format of the client data. 'json' writes DATANAME.json. 'columnar'
+        writes DATANAME.manifest.json and DATANAME.bin (see
+        write_client_columnar), which the web UI loads in preference to
+        DATANAME.json. Files of the other format written before are
+        removed, so the web UI loads the files just written.
+    n_clusters: int or None, optional, (default=None)
+        If not None, feature contributions of n_clusters clusters of each
+        embedding are precomputed and written to server_dir (see
+        write_cluster_fcs).
+    Returns
+    -------
+    List of the written file paths.
+    """
+    paths = write_server_data(tdr, name, server_dir)
+    if n_clusters is not None:
+        paths += write_cluster_fcs(tdr, name, server_dir, n_clusters)
+    client_kwargs = dict(instances=instances,
+                         variables=variables,
+                         time_points=time_points,
+                         si_view_info=si_view_info)
+    if client_format == 'json':
+        paths.append(
+            write_client_json(os.path.join(client_dir, name + '.json'),
+                              tdr,
+                              chunk_size=chunk_size,
+                              **client_kwargs))
+    elif client_format == 'columnar':
+        paths += write_client_columnar(client_dir, name, tdr, **client_kwargs)
+    else:
+        raise ValueError(f'Unknown client format: {client_format}')
+    _remove_other_client_files(client_dir, name, client_format)
+    if update_list:
+        paths.append(update_file_list(client_dir))
+
+    return paths
+
+
+def write_server_data(tdr, name, server_dir='ui/server/data'):
+    """Write DATANAME_Y_tn.npy, DATANAME_Y_nd.npy, and DATANAME_Y_dt.npy.
+
+    Returns
+    -------
+    List of the written file paths.
+    """
+    os.makedirs(server_dir, exist_ok=True)
+    paths = []
+    for Y_name in ['Y_tn', 'Y_nd', 'Y_dt']:
+        path = os.path.join(server_dir, f'{name}_{Y_name}.npy')
+        with _atomic_open(path, 'wb') as f:
+            np.save(f, getattr(tdr, Y_name))
+        paths.append(path)
+
+    return paths
+
+
+def write_cluster_fcs(tdr,
+                      name,
+                      server_dir='ui/server/data',
+                      n_clusters=8,
+                      random_state=0):
+    """Write DATANAME_EMBTYPE_fcs.npz for each emb type (Z name), holding
+    the feature contributions of clusters of the embedding (see
+    cluster_feat_contribs). The websocket server answers selections equal to
+    one of the clusters from these files instead of running ccPCA.
+
+    Returns
+    -------
+    List of the written file paths.
+    """
+    os.makedirs(server_dir, exist_ok=True)
+    paths = []
+    for Z_name in _Z_NAMES:
+        X = _second_step_input(Z_name, tdr.Y_tn, tdr.Y_nd, tdr.Y_dt)
+        labels, fcs = cluster_feat_contribs(X, getattr(tdr, Z_name),
+                                            n_clusters, random_state)
+        path = os.path.join(server_dir, f'{name}_{Z_name}_fcs.npz')
+        save_cluster_fcs(path, X, labels, fcs)
+        paths.append(path)
+
+    return paths
+
+
+def cluster_feat_contribs(X, Z, n_clusters=8, random_state=0):
+    """Cluster the rows of an embedding with KMeans and compute the feature
+    contributions of each cluster against the other rows, in the same way as
+    the websocket server does for a selection of the cluster (ccPCA with the
+    sign adjustment of CL, computed with SelectionCL).
+
+    Parameters
+    ----------
+    X: array-like, shape(n_samples, n_features)
+        Matrix whose rows are embedded (e.g., Y_tn.transpose() for Z_n_dt).
+    Z: array-like, shape(n_samples, n_components)
+        Embedding of the rows of X.
+    n_clusters: int, optional, (default=8)
+        The number of clusters (at most n_samples).
+    random_state: int, optional, (default=0)
+        random_state of KMeans.
+    Returns
+    -------
+    labels: ndarray, shape(n_samples,)
+        Cluster label of each row (0 to n_clusters - 1).
+    fcs: ndarray, shape(n_clusters, n_features)
+        Feature contributions of each cluster.
+    """
+    from sklearn.cluster import KMeans
+
+    X = np.asarray(X, dtype=np.float64)
+    n_clusters = min(n_clusters, X.shape[0])
+    if n_clusters < 2:
+        return np.zeros(X.shape[0], dtype=np.int32), np.empty((0, X.shape[1]))
+
+    labels = KMeans(n_clusters=n_clusters, n_init=10,
+                    random_state=random_state).fit_predict(np.asarray(Z))
+    # labels are renumbered so that empty clusters do not leave gaps
+    _, labels = np.unique(labels, return_inverse=True)
+    selection_cl = SelectionCL(X)
+    fcs = np.array([
+        selection_cl.feat_contribs(labels == label,
+                                   var_thres_ratio=0.5,
+                                   max_log_alpha=2)
+        for label in range(labels.max() + 1)
+    ])
+
+    return labels.astype(np.int32), fcs
+
+
+def save_cluster_fcs(path, X, labels, fcs):
+    """Write labels and fcs of clusters of the rows of X (returned by
+    cluster_feat_contribs) to an .npz file. Column means of X are stored
+    with them so that readers can check that the file matches X."""
+    with _atomic_open(path, 'wb') as f:
+        np.savez(f, labels=labels, fcs=fcs, mean=np.asarray(X).mean(axis=0))
+
+    return path
+
+
+def write_client_json(path,
+                      tdr,
+                      instances=None,
+                      variables=None,
+                      time_points=None,
+                      si_view_info=None,
+                      chunk_size=10000):
+    """Write the client data (DATANAME.json) by streaming it to path. Refer
+    to export_ui_data for the parameters.
+
+    Returns
+    -------
+    path
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    attributes = {
+        'instances': instances,
+        'variables': variables,
+        'timePoints': time_points
+    }
+
+    with _atomic_open(path, 'w') as f:
+        f.write('{')
+        if si_view_info is not None:
+            f.write(f'"siViewInfo": {json.dumps(si_view_info)}, ')
+        for key, id_key, Z_names in _CLIENT_GROUPS:
+            f.write(f'{json.dumps(key)}: {{')
+            for i, Z_name in enumerate(Z_names):
+                if i > 0:
+                    f.write(', ')
+                f.write(f'{json.dumps(Z_name)}: [')
+                _write_rows(f, id_key, getattr(tdr, Z_name), attributes[key],
+                            chunk_size)
+                f.write(']')
+            f.write('}, ')
+        f.write(f'"firstDrInfo": {json.dumps(first_dr_info(tdr))}')
+        f.write('}')
+
+    return path
+
+
+def write_client_columnar(client_dir,
+                          name,
+                          tdr,
+                          instances=None,
+                          variables=None,
+                          time_points=None,
+                          si_view_info=None):
+    """Write the client data in the columnar format: DATANAME.bin with
+    packed little-endian arrays and DATANAME.manifest.json describing them.
+    Refer to export_ui_data for the parameters.
+
+    The manifest has format ('multidr-columnar'), version, buffer (the file
+    name of the .bin), siViewInfo, and firstDrInfo whose components are
+    buffers. Each of instances, variables, and timePoints has ids (a buffer),
+    embeddings ({Z name: float32 buffer of shape (n, 2)} scaled in the same
+    way as the JSON format), columns, and aux. Numeric attributes are
+    buffers (int32 or float64) and the others are JSON arrays. A buffer is
+    {dtype, shape, offset, length} with offset in bytes (a multiple of 8) and
+    length in elements.
+
+    Returns
+    -------
+    List of the written file paths.
+    """
+    os.makedirs(client_dir, exist_ok=True)
+    bin_path = os.path.join(client_dir, name + '.bin')
+    manifest_path = os.path.join(client_dir, name + '.manifest.json')
+    attributes = {
+        'instances': instances,
+        'variables': variables,
+        'timePoints': time_points
+    }
+
+    manifest = {
+        'format': 'multidr-columnar',
+        'version': 1,
+        'buffer': os.path.basename(bin_path)
+    }
+    if si_view_info is not None:
+        manifest['siViewInfo'] = si_view_info
+
+    with _atomic_open(bin_path, 'wb') as f:
+        buffers = _BufferWriter(f)
+        for key, id_key, Z_names in _CLIENT_GROUPS:
+            n = getattr(tdr, Z_names[0]).shape[0]
+            attrs = dict(attributes[key] or {})
+            aux = attrs.pop('aux', None)
+            group = {
+                'idKey': id_key,
+                'ids': buffers.add(np.arange(n), '<i4'),
+                'embeddings': {
+                    Z_name: buffers.add(scale_layout(getattr(tdr, Z_name)),
+                                        '<f4')
+                    for Z_name in Z_names
+                },
+                'columns': {
+                    k: _column(buffers, values, n)
+                    for k, values in attrs.items()
+                }
+            }
+            if aux is not None:
+                group['aux'] = {
+                    k: _column(buffers, values, n)
+                    for k, values in aux.items()
+                }
+            manifest[key] = group
+
+        info = first_dr_info(tdr)
+        info['components'] = {
+            mode: buffers.add(tdr.first_learner[mode].components_[0], '<f4')
+            for mode in info['components']
+        }
+        manifest['firstDrInfo'] = info
+
+    with _atomic_open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    return [bin_path, manifest_path]
+
+
+def first_dr_info(tdr):
+    """Return firstDrInfo of the client data (explained variance ratios and
+    components of the first learners)."""
+    modes = ['n', 'd', 't']
+    return {
+        'explainedVarianceRatio': {
+            mode: float(tdr.first_learner[mode].explained_variance_ratio_[0])
+            for mode in modes
+        },
+        'components': {
+            mode: tdr.first_learner[mode].components_[0].tolist()
+            for mode in modes
+        }
+    }
+
+
+def update_file_list(client_dir='ui/client/data'):
+    """Write file_list.json listing all datasets in client_dir.
+
+    Returns
+    -------
+    Path of file_list.json.
+    """
+    path = os.path.join(client_dir, 'file_list.json')
+    # DATANAME.json and/or DATANAME.manifest.json
+    file_names = set()
+    for x in glob.glob(os.path.join(glob.escape(client_dir), '*.json')):
+        file_name = os.path.basename(x)
+        if file_name == 'file_list.json':
+            continue
+        for suffix in ['.manifest.json', '.json']:
+            if file_name.endswith(suffix):
+                file_names.add(file_name[:-len(suffix)])
+                break
+    with _atomic_open(path, 'w') as f:
+        f.write(json.dumps({'fileNames': sorted(file_names)}))
+
+    return path
+
+
+def scale_layout(points, bound=(-1, 1)):
+    """Scale 2D points into bound keeping their aspect ratio (centering the
+    shorter side)."""
+    points = np.asarray(points)
+    p_min = np.min(points, axis=0)
+    p_max = np.max(points, axis=0)
+
+    w, h = p_max[:2] - p_min[:2]
+    d = max(w, h)
+
+    s = (bound[1] - bound[0]) / d if d > 0 else 1.0
+    offset = np.array([(d - w) * .5, (d - h) * .5])
+
+    return bound[0] + (offset + points - p_min) * s
+
+
+def _write_rows(f, id_key, Z, attributes, chunk_size):
+    emb_pos = scale_layout(Z)
+    n = emb_pos.shape[0]
+
+    attributes = dict(attributes or {})
+    aux = attributes.pop('aux', None)
+    keys = [id_key, 'embPos'] + list(attributes)
+    columns = [np.asarray(values) for values in attributes.values()]
+    aux_keys = list(aux or {})
+    aux_columns = [np.asarray(values) for values in (aux or {}).values()]
+    for values in columns + aux_columns:
+        if len(values) != n:
+            raise ValueError(f'Attributes of {id_key} must have {n} values')
+    if aux is not None:
+        keys.append('aux')
+
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        # columns are converted to Python objects at once and zipped into
+        # rows
+        chunk_columns = [
+            range(start, stop), emb_pos[start:stop].tolist()
+        ] + [values[start:stop].tolist() for values in columns]
+        if aux is not None:
+            chunk_columns.append([
+                dict(zip(aux_keys, row)) for row in zip(
+                    *[values[start:stop].tolist() for values in aux_columns])
+            ] if aux_columns else [{}] * (stop - start))
+
+        if start > 0:
+            f.write(', ')
+        rows = [dict(zip(keys, row)) for row in zip(*chunk_columns)]
+        f.write(json.dumps(rows)[1:-1])
+
+
+def _column(buffers, values, n):
+    values = np.asarray(values)
+    if len(values) != n:
+        raise ValueError(f'Attributes must have {n} values')
+    if values.dtype.kind in 'iub':
+        return buffers.add(values, '<i4')
+    elif values.dtype.kind == 'f':
+        return buffers.add(values, '<f8')
+    else:
+        return values.tolist()
+
+
+class _BufferWriter():
+    """Append arrays to a binary file, aligning each to 8 bytes."""
+    def __init__(self, f):
+        self.f = f
+        self.offset = 0
+
+    def add(self, array, dtype):
+        array = np.ascontiguousarray(array, dtype=dtype)
+        padding = -self.offset % 8
+        self.f.write(b'\0' * padding)
+        self.offset += padding
+
+        desc = {
+            'dtype': {
+                'i': 'int32',
+                'f': 'float32' if array.itemsize == 4 else 'float64'
+            }[array.dtype.kind],
+            'shape': list(array.shape),
+            'offset': self.offset,
+            'length': array.size
+        }
+        self.f.write(array.tobytes())
+        self.offset += array.nbytes
+
+        return desc
+
+
+def _remove_other_client_files(client_dir, name, client_format):
+    """Remove the client data of name in the format other than client_format
+    (e.g., DATANAME.manifest.json and DATANAME.bin when writing DATANAME.json)
+    so that the web UI does not load stale files."""
+    if client_format == 'json':
+        file_names = [name + '.manifest.json', name + '.bin']
+    else:
+        file_names = [name + '.json']
+    for file_name in file_names:
+        try:
+            os.remove(os.path.join(client_dir, file_name))
+        except FileNotFoundError:
+            pass
+
+
+class _atomic_open():
+    """Open a temporary file in the directory of path and move it to path
+    when closed without errors, so readers never see a partial file. The
+    file gets the permissions of one created by open (0666 without the bits
+    of the umask) instead of mkstemp's 0600."""
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+
+    def __enter__(self):
+        fd, self.tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.path) or '.', suffix='.tmp')
+        self.f = os.fdopen(fd, self.mode)
+        return self.f
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.f.close()
+        if exc_type is None:
+            os.chmod(self.tmp_path, 0o666 & ~_umask())
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+
+def _umask():
+    # the umask can only be read by setting it
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
@@ -0,0 +1,260 @@
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+
+# only kind, stage, name, input_shape, and learner are given to start events
+_STAGE_EVENT_FIELDS = [
+    'kind', 'stage', 'name', 'input_shape', 'learner', 'wall_time', 'cpu_time',
+    'peak_bytes', 'error'
+]
+StageEvent = namedtuple('StageEvent', _STAGE_EVENT_FIELDS, defaults=[None] * 4)
+StageEvent.__doc__ = """Event passed to listeners at the start and end of a stage
+
+Attributes
+----------
+kind: str
+    'start' or 'end'.
+stage: str
+    Stage name. TDR emits 'first_repr' (enclosing 'unfold', 'scale', and
+    'first_dr' of each mode, 'sign_flip', and 'fold'), 'second_repr'
+    (enclosing 'second_dr' of each Z), 'cache_load', and for out-of-core
+    first DRs, 'moments', 'partial_fit', and 'transform'. update emits
+    'update_first_repr' and 'update_second_dr'.
+name: str or None
+    Name within the stage (e.g., mode 't' for 'first_dr' and 'Z_n_dt' for
+    'second_dr').
+input_shape: tuple or None
+    Shape of the input of the stage.
+learner: str or None
+    Class name of the learner used in the stage.
+wall_time: float or None
+    Wall time in seconds (end events only).
+cpu_time: float or None
+    CPU time in seconds of the process running the stage (end events only).
+    For stages run in worker threads, this includes other threads.
+peak_bytes: int or None
+    Peak of the memory allocated during the stage, traced by tracemalloc
+    (end events only, None if memory is not traced). Allocations are
+    traced process-wide, so peaks of stages run concurrently in threads are
+    not separated.
+error: Exception or None
+    Exception raised in the stage (end events only).
+"""
+
+
+class EventRecorder():
+    """EventRecorder: Listener keeping the end events of stages
+
+    Attributes
+    ----------
+    events: list of StageEvent
+        Recorded end events.
+    ----------
+    Examples
+    --------
+    >>> import json
+    >>> import numpy as np
+    >>> from multidr.tdr import TDR
+    >>> from multidr.instrumentation import EventRecorder
+
+    >>> X = np.load('./data/air_quality/tensor.npy')
+    >>> recorder = EventRecorder()
+    >>> tdr = TDR(listeners=[recorder])
+    >>> results = tdr.fit_transform(X)
+    >>> print(json.dumps(recorder.to_records()[:2], indent=2))
+    """
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        if event.kind == 'end':
+            self.events.append(event)
+
+    def to_records(self):
+        """Return the recorded events as a list of JSON-serializable dicts.
+
+        Returns
+        -------
+        List of dicts.
+        """
+        records = []
+        for event in self.events:
+            record = event._asdict()
+            del record['kind']
+            if record['input_shape'] is not None:
+                record['input_shape'] = list(record['input_shape'])
+            if record['error'] is not None:
+                record['error'] = repr(record['error'])
+            records.append(record)
+
+        return records
+
+    def clear(self):
+        """Remove the recorded events.
+
+        Returns
+        -------
+        self
+        """
+        self.events = []
+
+        return self
+
+
+class VerboseListener():
+    """VerboseListener: Listener printing the progress of TDR (used for
+    verbose=True)
+
+    Parameters
+    ----------
+    tdr: TDR
+        TDR whose first learners are reported (explained variance ratios).
+    """
+    def __init__(self, tdr):
+        self.tdr = tdr
+
+    def __call__(self, event):
+        if event.kind == 'start':
+            if event.stage == 'sign_flip':
+                self._print_explained_variance_ratios()
+            return
+
+        elapsed = ('' if event.wall_time is None else
+                   f' ({event.wall_time:.3f}s)')
+        if event.stage == 'first_dr':
+            print(f"first DR along {event.name} mode done{elapsed}")
+        elif event.stage == 'second_dr':
+            print(f"{event.name} done{elapsed}")
+        elif event.stage in ['first_repr', 'second_repr']:
+            print(f"{event.stage.replace('_', ' ')} done")
+        elif event.stage == 'cache_load':
+            print(f"{event.name.replace('_', ' ')} loaded from cache")
+        elif event.stage in ['moments', 'partial_fit', 'transform']:
+            print(f"{event.stage.replace('_', ' ')} done{elapsed}")
+        elif event.stage == 'update_first_repr':
+            print("first repr update done")
+        elif event.stage == 'update_second_dr':
+            print(f"{event.name} update done")
+
+    def _print_explained_variance_ratios(self):
+        first_learner = self.tdr.first_learner
+        if 'explained_variance_ratio_' in first_learner['t'].__dict__:
+            print("exp var ratio for compression of time ponts:",
+                  first_learner['t'].explained_variance_ratio_)
+        if 'explained_variance_ratio_' in first_learner['n'].__dict__:
+            print("exp var ratio for compression of instances",
+                  first_learner['n'].explained_variance_ratio_)
+        if 'explained_variance_ratio_' in first_learner['d'].__dict__:
+            print("exp var ratio for compression of variables:",
+                  first_learner['d'].explained_variance_ratio_)
+
+
+class Measurement():
+    """Measurement of wall time, CPU time, and (optionally) the peak of
+    traced memory from construction to stop. Measurements can be nested."""
+    def __init__(self, trace_memory=False):
+        self._memory_frame = _push_memory_frame() if trace_memory else None
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def stop(self):
+        """Return (wall_time, cpu_time, peak_bytes). peak_bytes is None if
+        memory is not traced."""
+        wall_time = time.perf_counter() - self._wall_start
+        cpu_time = time.process_time() - self._cpu_start
+        peak_bytes = None
+        if self._memory_frame is not None:
+            peak_bytes = _pop_memory_frame(self._memory_frame)
+
+        return wall_time, cpu_time, peak_bytes
+
+
+class Stage():
+    """Context manager emitting the start and end events of a stage to
+    listeners."""
+    def __init__(self,
+                 listeners,
+                 stage,
+                 name=None,
+                 input_shape=None,
+                 learner=None,
+                 trace_memory=False):
+        self.listeners = listeners
+        self.stage = stage
+        self.name = name
+        self.input_shape = None if input_shape is None else tuple(input_shape)
+        self.learner = None if learner is None else type(learner).__name__
+        self.trace_memory = trace_memory
+        self._measurement = None
+
+    def __enter__(self):
+        emit(
+            self.listeners,
+            StageEvent('start', self.stage, self.name, self.input_shape,
+                       self.learner))
+        self._measurement = Measurement(self.trace_memory)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_time, cpu_time, peak_bytes = self._measurement.stop()
+        emit(
+            self.listeners,
+            StageEvent('end', self.stage, self.name, self.input_shape,
+                       self.learner, wall_time, cpu_time, peak_bytes,
+                       exc_value))
+
+        return False
+
+
+def emit(listeners, event):
+    """Pass event to each of listeners."""
+    for listener in listeners:
+        listener(event)
+
+
+class _MemoryFrame():
+    __slots__ = ['start', 'peak']
+
+    def __init__(self, start):
+        self.start = start
+        self.peak = start
+
+
+# tracemalloc has a single peak per process, so the peaks of nested
+# measurements are kept in frames and updated whenever the peak is reset
+_memory_lock = threading.Lock()
+_memory_frames = []
+_tracing_started = False
+
+
+def _push_memory_frame():
+    global _tracing_started
+    with _memory_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        current, peak = tracemalloc.get_traced_memory()
+        for frame in _memory_frames:
+            frame.peak = max(frame.peak, peak)
+        tracemalloc.reset_peak()
+        frame = _MemoryFrame(current)
+        _memory_frames.append(frame)
+
+        return frame
+
+
+def _pop_memory_frame(frame):
+    global _tracing_started
+    with _memory_lock:
+        _, peak = tracemalloc.get_traced_memory()
+        peak = max(frame.peak, peak)
+        _memory_frames.remove(frame)
+        for other in _memory_frames:
+            other.peak = max(other.peak, peak)
+        if not _memory_frames and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+        return peak - frame.start
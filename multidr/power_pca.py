@@ -0,0 +1,230 @@
+import numpy as np
+from sklearn.utils import check_random_state
+
+
+class PowerPCA():
+    """PowerPCA: PCA for a small number of components (e.g., the first DR of
+    TDR, which uses only one component) without a full SVD
+
+    Depending on the number of features, components are obtained with the
+    eigendecomposition of the (n_features, n_features) covariance matrix or
+    with subspace (power) iteration on the data matrix. In both cases, the
+    input is centered implicitly, so no centered copy of the input is made
+    (unlike sklearn's PCA with copy=True). The results match sklearn's PCA up
+    to the convergence tolerance, including the sign convention of
+    components_ (the largest absolute value of each component is positive).
+    Because of the implicit centering, the results can lose precision when
+    feature means are several orders of magnitude larger than the standard
+    deviations; standardized inputs (TDR's default scaling) do not have this
+    issue.
+
+    Parameters
+    ----------
+    n_components: int, optional, (default=1)
+        Number of components to keep.
+    solver: {'auto', 'covariance', 'power'}, optional, (default='auto')
+        'covariance' uses the eigendecomposition of the covariance matrix.
+        'power' uses subspace iteration, whose iterations cost
+        O(n_samples * n_features * (n_components + n_oversamples)). 'auto' uses 'covariance'
+        when n_features <= covariance_max_features, 'power' otherwise.
+    covariance_max_features: int, optional, (default=500)
+        Threshold of n_features used by solver='auto'.
+    n_oversamples: int, optional, (default=10)
+        Number of additional vectors iterated by the power solver. Larger
+        values speed up convergence when leading eigenvalues are close.
+    max_iter: int, optional, (default=200)
+        The maximum number of iterations of the power solver (at least 1).
+    tol: float, optional, (default=1e-10)
+        Tolerance of the power solver. Iterations stop when the cosine between
+        the current and previous subspaces is larger than 1 - tol.
+    random_state: int, RandomState instance or None, optional, (default=None)
+        Seed of the initial vectors of the power solver.
+    Attributes
+    ----------
+    components_: ndarray, shape (n_components, n_features)
+        Principal axes.
+    explained_variance_: ndarray, shape (n_components,)
+        Variance explained by each component.
+    explained_variance_ratio_: ndarray, shape (n_components,)
+        Ratio of variance explained by each component.
+    singular_values_: ndarray, shape (n_components,)
+        Singular values of the centered data corresponding to components.
+    mean_: ndarray, shape (n_features,)
+        Per-feature mean of the training data.
+    n_components_: int
+        The number of components.
+    n_iter_: int
+        The number of iterations run by the power solver (0 for the
+        covariance solver).
+    ----------
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from multidr.tdr import TDR
+    >>> from multidr.power_pca import PowerPCA
+
+    >>> X = np.load('./data/air_quality/tensor.npy')
+    >>> tdr = TDR(first_learner=PowerPCA(n_components=1))
+    >>> results = tdr.fit_transform(X)
+    >>> tdr.first_learner['t'].explained_variance_ratio_
+    """
+    def __init__(self,
+                 n_components=1,
+                 solver='auto',
+                 covariance_max_features=500,
+                 n_oversamples=10,
+                 max_iter=200,
+                 tol=1e-10,
+                 random_state=None):
+        self.n_components = n_components
+        self.solver = solver
+        self.covariance_max_features = covariance_max_features
+        self.n_oversamples = n_oversamples
+        self.max_iter = max_iter
+        self.tol = tol
+        self.random_state = random_state
+
+    def get_params(self, deep=True):
+        """Get parameters of this learner.
+
+        Returns
+        -------
+        Dict of parameters.
+        """
+        return {
+            'n_components': self.n_components,
+            'solver': self.solver,
+            'covariance_max_features': self.covariance_max_features,
+            'n_oversamples': self.n_oversamples,
+            'max_iter': self.max_iter,
+            'tol': self.tol,
+            'random_state': self.random_state
+        }
+
+    def fit(self, X, y=None):
+        """Fit the model with X.
+
+        Parameters
+        ----------
+        X: array-like, shape(n_samples, n_features)
+            Training data.
+        y: ignored
+        Returns
+        -------
+        self.
+        """
+        if self.max_iter < 1:
+            raise ValueError(
+                f'max_iter must be at least 1, got {self.max_iter!r}')
+        if self.tol < 0:
+            raise ValueError(f'tol must be non-negative, got {self.tol!r}')
+
+        X = np.asarray(X)
+        if not np.issubdtype(X.dtype, np.floating):
+            X = X.astype(np.float64)
+        n_samples, n_features = X.shape
+        k = self.n_components
+
+        self.mean_ = X.mean(axis=0)
+        # total variance without making a centered copy of X
+        total_var = (np.einsum('ij,ij->', X, X) -
+                     n_samples * self.mean_ @ self.mean_) / (n_samples - 1)
+
+        solver = self.solver
+        if solver == 'auto':
+            solver = ('covariance' if n_features
+                      <= self.covariance_max_features else 'power')
+        if solver == 'covariance':
+            V, eigvals = self._fit_covariance(X)
+            self.n_iter_ = 0
+        elif solver == 'power':
+            V, eigvals = self._fit_power(X)
+        else:
+            raise ValueError(
+                f"solver must be 'auto', 'covariance', or 'power', got "
+                f"{self.solver!r}")
+
+        # sign convention of sklearn's PCA (svd_flip with v-based decision)
+        signs = np.sign(V[np.argmax(np.abs(V), axis=0), np.arange(k)])
+        signs[signs == 0] = 1.0
+        V *= signs
+
+        eigvals = np.maximum(eigvals, 0.0)
+        self.components_ = V.T
+        self.explained_variance_ = eigvals / (n_samples - 1)
+        self.explained_variance_ratio_ = (self.explained_variance_ /
+                                          total_var if total_var > 0 else
+                                          np.zeros_like(eigvals))
+        self.singular_values_ = np.sqrt(eigvals)
+        self.n_components_ = k
+
+        return self
+
+    def transform(self, X):
+        """Apply dimensionality reduction to X.
+
+        Parameters
+        ----------
+        X: array-like, shape(n_samples, n_features)
+            Data to transform.
+        Returns
+        -------
+        X_new: ndarray, shape(n_samples, n_components)
+        """
+        X = np.asarray(X)
+        return X @ self.components_.T - self.mean_ @ self.components_.T
+
+    def fit_transform(self, X, y=None):
+        """Fit the model with X and apply dimensionality reduction to X.
+
+        Parameters
+        ----------
+        X: array-like, shape(n_samples, n_features)
+            Training data.
+        y: ignored
+        Returns
+        -------
+        X_new: ndarray, shape(n_samples, n_components)
+        """
+        return self.fit(X).transform(X)
+
+    def _fit_covariance(self, X):
+        n_samples = X.shape[0]
+        # scatter matrix of the centered data
+        C = X.T @ X - n_samples * np.outer(self.mean_, self.mean_)
+        eigvals, eigvecs = np.linalg.eigh(C)
+        order = np.argsort(eigvals)[::-1][:self.n_components]
+
+        return eigvecs[:, order], eigvals[order]
+
+    def _fit_power(self, X):
+        n_samples, n_features = X.shape
+        random_state = check_random_state(self.random_state)
+
+        def scatter_dot(V):
+            # (X - mean)^T (X - mean) V without centering X
+            U = X @ V - self.mean_ @ V
+            return X.T @ U - np.outer(self.mean_, U.sum(axis=0))
+
+        k = self.n_components
+        n_vectors = min(n_features, k + self.n_oversamples)
+        V, _ = np.linalg.qr(
+            random_state.standard_normal((n_features, n_vectors)))
+        V_k = None
+        self.n_iter_ = self.max_iter
+        for i in range(self.max_iter):
+            S = scatter_dot(V)
+            # Rayleigh-Ritz on the current subspace
+            eigvals, W = np.linalg.eigh(V.T @ S)
+            order = np.argsort(eigvals)[::-1][:k]
+            V_k_prev, V_k = V_k, V @ W[:, order]
+            # cosines of principal angles between the previous and current
+            # leading subspaces
+            if V_k_prev is not None and np.min(
+                    np.linalg.svd(V_k_prev.T @ V_k,
+                                  compute_uv=False)) > 1.0 - self.tol:
+                self.n_iter_ = i + 1
+                break
+            V, _ = np.linalg.qr(S)
+
+        return V_k, eigvals[order]
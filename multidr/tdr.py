@@ -1,9 +1,21 @@
-import numpy as np
+import concurrent.futures
+import contextlib
 import copy
+import functools
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
 from sklearn.decomposition import PCA
+from sklearn.model_selection import ParameterGrid
 from sklearn import preprocessing
 from umap import UMAP
 
+from multidr.cache import ResultCache, make_key
+from multidr.instrumentation import (Measurement, Stage, StageEvent,
+                                     VerboseListener, emit)
+
 
 class TDR():
     """TDR: Two-step dimensionality reduction (DR) to project a third-order
@@ -27,10 +39,81 @@ class TDR():
         Also, to set a different DR for individual modes, you can input as a
         dict. e.g., {'t': UMAP(n_components=2), 'n': PCA(n_components=2), 'd':
         TSNE(n_components=2)}
+    n_jobs: int, optional, (default=1)
+        The number of worker processes used to run the three first DRs and the
+        six second DRs concurrently. 1 runs them sequentially in the current
+        process and -1 uses all CPUs. Each job works on its own copy of the
+        learner, and results are collected by job name (not by completion
+        order), so they are deterministic as long as the learners are (e.g.,
+        UMAP with random_state set). With a process pool, scripts should be
+        guarded by if __name__ == '__main__' on platforms using "spawn".
+    executor: concurrent.futures.Executor, optional, (default=None)
+        Executor used instead of a process pool created from n_jobs (e.g., a
+        shared ProcessPoolExecutor). The executor is not shut down by TDR.
+    cache_dir: str, optional, (default=None)
+        If not None, fit_transform caches its results in this directory.
+        Results of the first DR are keyed by a hash of the input tensor, the
+        first scaling flags, and get_params() of the first learners; results
+        of the second DR are additionally keyed by the second scaling flags
+        and get_params() of the second learners. Thus, changing only the
+        second learner reuses the cached first DR. Learners with
+        random_state=None are not deterministic, so cached results can differ
+        from rerun ones.
+    cache_max_bytes: int, optional, (default=2**30)
+        Size limit of the cache directory in bytes. Least recently used
+        results are evicted when the limit is exceeded.
+    cache_knn: boolean, optional, (default=False)
+        If True, the k-nearest neighbor graph of each (scaled) second DR input
+        is computed by TDR, kept in knn_graphs (and in the cache directory if
+        cache_dir is set), and passed to second learners accepting
+        precomputed_knn (e.g., UMAP). Reruns that change only layout
+        parameters (e.g., min_dist of UMAP) then skip the neighbor search.
+        The graph is keyed by the input and n_neighbors, metric, metric_kwds,
+        and random_state of the learner. Inputs with fewer than 4,096 rows
+        get exact neighbors as in UMAP. Note that transform of UMAP (used
+        by update) requires the search index, which is not stored in the
+        cache directory.
+    listeners: list of callables, optional, (default=None)
+        Callables taking a multidr.instrumentation.StageEvent, which are
+        called at the start and end of each stage (unfolding, scaling, the
+        first DR of each mode, sign flip, folding, each second DR, etc.).
+        End events carry the wall time, CPU time, peak memory allocation,
+        input shape, and learner class of the stage (e.g., collected with
+        multidr.instrumentation.EventRecorder). Without listeners (and
+        verbose=False), no events are created.
+    trace_memory: boolean, optional, (default=True)
+        If True and listeners are set, peak memory allocations of stages are
+        measured with tracemalloc, which slows down Python-level
+        allocations. If False, peak_bytes of events is None.
     Attributes
     ----------
     first_learner: the same with the input parameter one.
-    second_learner: the same with the input parameter one.
+    second_learner: the same with the input parameter one. The learners are
+        not fitted; copies of them are fitted (see second_models).
+    n_jobs: the same with the input parameter one.
+    executor: the same with the input parameter one.
+    cache: multidr.cache.ResultCache or None
+        Cache used by fit_transform (None if cache_dir is None).
+    cache_knn: the same with the input parameter one.
+    listeners: list of callables
+        The listeners set with the input parameter (can be modified).
+    trace_memory: the same with the input parameter one.
+    knn_graphs: dict
+        The k-nearest neighbor graphs used in the last second DR, keyed by
+        the produced Z matrix (only when cache_knn is True).
+    elapsed_times: dict
+        Wall time (in seconds) of each job in the last run, keyed by the
+        produced matrix (e.g., 'Y_tn', 'Z_n_dt').
+    first_moments: dict
+        Column means and standard deviations used to standardize the
+        unfoldings in the first DR, keyed by mode (only for scaled modes).
+    second_models: dict
+        Fitted second learners keyed by the produced Z matrix (e.g.,
+        'Z_t_dn'). Used by update to transform new time points.
+    second_moments: dict
+        Column means and standard deviations used to standardize the inputs
+        of the second DR, keyed by the produced Z matrix (only for scaled
+        ones).
     Y_tn: ndarray, shape (n_time_points, n_instances)
         The matrix Y obtained by applying the first DR along a variable mode.
         Rows and columns correspond to time points and intances, repectively.
@@ -105,9 +188,32 @@ class TDR():
 
     >>> plot_results(results)
     """
-    def __init__(self, first_learner=None, second_learner=None):
+    def __init__(self,
+                 first_learner=None,
+                 second_learner=None,
+                 n_jobs=1,
+                 executor=None,
+                 cache_dir=None,
+                 cache_max_bytes=2**30,
+                 cache_knn=False,
+                 listeners=None,
+                 trace_memory=True):
         self.first_learner = None
         self.second_learner = None
+        self.n_jobs = n_jobs
+        self.executor = executor
+        self.cache_knn = cache_knn
+        self.knn_graphs = {}
+        self.listeners = [] if listeners is None else list(listeners)
+        self.trace_memory = trace_memory
+        self._verbose_listener = None
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = ResultCache(cache_dir, max_bytes=cache_max_bytes)
+        self.elapsed_times = {}
+        self.first_moments = {}
+        self.second_models = {}
+        self.second_moments = {}
         self.Y_tn = None
         self.Y_nd = None
         self.Y_dt = None
@@ -125,7 +231,10 @@ class TDR():
                       X,
                       first_scaling=True,
                       second_scaling=True,
-                      verbose=False):
+                      verbose=False,
+                      n_jobs=None,
+                      executor=None,
+                      chunk_size=None):
         """Apply the first and second DR and then return all DR results of 6
         patterns.
 
@@ -142,7 +251,16 @@ class TDR():
             To set scaling for individual modes, you can input as a dict. e.g.,
             {'t': False, 'n': False, 'd': True}
         verbose: boolean, optional, default=False
-            If True, print the progress of two-step DR, etc.
+            If True, print the progress of two-step DR, etc. (with
+            multidr.instrumentation.VerboseListener).
+        n_jobs: int, optional, default=None
+            If not None, overwrite n_jobs set in the constructor for this call.
+        executor: concurrent.futures.Executor, optional, default=None
+            If not None, overwrite executor set in the constructor for this
+            call.
+        chunk_size: int, optional, default=None
+            If not None, apply the first DR out of core with chunks of
+            chunk_size time points (see learn_first_repr).
         Returns
         -------
         Dict of {"Z_n_dt", "Z_n_td", "Z_d_nt", "Z_d_tn", "Z_t_dn", "Z_t_nd"}.
@@ -165,23 +283,352 @@ class TDR():
                 The matrix Z obtained by applying the first DR along an instance mode
                 and then the second DR along a variable mode (1st DR: n, 2nd DR: d).
         """
-        self.learn_first_repr(X, scaling=first_scaling, verbose=verbose)
-        self.learn_second_repr(self.Y_tn,
-                               self.Y_nd,
-                               self.Y_dt,
-                               scaling=second_scaling,
-                               verbose=verbose)
-
-        return {
-            "Z_n_dt": self.Z_n_dt,
-            "Z_n_td": self.Z_n_td,
-            "Z_d_nt": self.Z_d_nt,
-            "Z_d_tn": self.Z_d_tn,
-            "Z_t_dn": self.Z_t_dn,
-            "Z_t_nd": self.Z_t_nd
-        }
-
-    def learn_first_repr(self, X, scaling=True, verbose=False):
+        with self._verbosity(verbose):
+            first_key = self._learn_first_repr_cached(X,
+                                                      scaling=first_scaling,
+                                                      n_jobs=n_jobs,
+                                                      executor=executor,
+                                                      chunk_size=chunk_size)
+            second_key = None
+            if first_key is not None:
+                second_key = make_key(first_key, 'second',
+                                      _scaling_flags(second_scaling),
+                                      _learner_signatures(self.second_learner))
+
+            cached = None if second_key is None else self.cache.get(second_key)
+            if cached is None:
+                self.learn_second_repr(self.Y_tn,
+                                       self.Y_nd,
+                                       self.Y_dt,
+                                       scaling=second_scaling,
+                                       n_jobs=n_jobs,
+                                       executor=executor)
+                if second_key is not None:
+                    self.cache.put(second_key, self._second_repr_arrays())
+            else:
+                with self._stage('cache_load', 'second_repr'):
+                    self._set_second_repr_arrays(cached)
+
+            return {
+                "Z_n_dt": self.Z_n_dt,
+                "Z_n_td": self.Z_n_td,
+                "Z_d_nt": self.Z_d_nt,
+                "Z_d_tn": self.Z_d_tn,
+                "Z_t_dn": self.Z_t_dn,
+                "Z_t_nd": self.Z_t_nd
+            }
+
+    def sweep(self,
+              X,
+              second_learner_grid,
+              first_scaling=True,
+              second_scaling=True,
+              verbose=False,
+              n_jobs=None,
+              executor=None,
+              chunk_size=None):
+        """Apply the first DR once and then the second DR with each setting of
+        second_learner_grid, yielding the results of each setting as soon as
+        its 6 second DRs finish.
+
+        The second DRs of all settings are submitted to the worker pool at
+        once, so early layouts can be inspected while the rest are still
+        computing. Y_tn, Y_nd, and Y_dt are kept as in fit_transform, while
+        second_learner, second_models, and the Z matrices of self are not
+        changed by the sweep. If cache_dir is set, settings with cached
+        results are yielded first without refitting, and new results are
+        cached in the same way as fit_transform. If cache_knn is True,
+        settings sharing the neighbor-search parameters share kNN graphs.
+
+        Parameters
+        ----------
+        X: array-like, shape(n_time_points, n_instances, n_variables)
+            Input third-order tensor.
+        second_learner_grid: dict or list
+            If dict of lists of parameters (e.g., {'n_neighbors': [7, 15],
+            'min_dist': [0.1, 0.5]}), each combination of the parameters
+            (enumerated by sklearn's ParameterGrid) is set to copies of the
+            current second learners with set_params. If list, each element
+            is a dict of parameters (a single combination), a second
+            learner, or a dict of second learners for individual modes (as in
+            set_second_learner).
+        first_scaling: boolean or dict of booleans, optional, default=True
+            The same with the one of fit_transform.
+        second_scaling: boolean or dict of booleans, optional, default=True
+            The same with the one of fit_transform.
+        verbose: boolean, optional, default=False
+            If True, print the progress of two-step DR, etc. (with
+            multidr.instrumentation.VerboseListener).
+        n_jobs: int, optional, default=None
+            If not None, overwrite n_jobs set in the constructor for this call.
+        executor: concurrent.futures.Executor, optional, default=None
+            If not None, overwrite executor set in the constructor for this
+            call.
+        chunk_size: int, optional, default=None
+            The same with the one of fit_transform.
+        Yields
+        ------
+        Tuple of (index, setting, results) in order of completion.
+            index: int
+                Position of the setting in the enumerated settings.
+            setting: dict of parameters or learner
+                The setting of the second learner.
+            results: dict
+                DR results of 6 patterns as returned by fit_transform.
+        Examples
+        --------
+        >>> tdr = TDR(second_learner=UMAP(n_components=2, random_state=0),
+        ...           n_jobs=-1)
+        >>> grid = {'n_neighbors': [7, 15, 30], 'min_dist': [0.05, 0.15]}
+        >>> for i, params, results in tdr.sweep(X, grid):
+        ...     print(params)
+        ...     plot_results(results)
+        """
+        with self._verbosity(verbose):
+            if isinstance(second_learner_grid, dict):
+                settings = list(ParameterGrid(second_learner_grid))
+            else:
+                settings = list(second_learner_grid)
+
+            first_key = self._learn_first_repr_cached(X,
+                                                      scaling=first_scaling,
+                                                      n_jobs=n_jobs,
+                                                      executor=executor,
+                                                      chunk_size=chunk_size)
+
+            # the second DR inputs do not depend on the settings
+            scl = _scaling_flags(second_scaling)
+            inputs = {}
+            moments = {}
+            for name in _Z_NAMES:
+                Y = _second_step_input(name, self.Y_tn, self.Y_nd, self.Y_dt)
+                if scl[name[-1]]:
+                    moments[name] = _column_moments(Y)
+                    Y = preprocessing.scale(Y)
+                inputs[name] = Y
+
+            keys = {}
+            jobs = []
+            knn_graphs = {}
+            for i, setting in enumerate(settings):
+                learners = self._sweep_learners(setting)
+                if first_key is not None:
+                    keys[i] = make_key(first_key, 'second', scl,
+                                       _learner_signatures(learners))
+                    cached = self.cache.get(keys[i])
+                    if cached is not None:
+                        with self._stage('cache_load', f'setting_{i}'):
+                            Zs = {name: cached[name] for name in _Z_NAMES}
+                        yield i, setting, Zs
+                        continue
+                for name in _Z_NAMES:
+                    learner = copy.deepcopy(learners[name[-1]])
+                    if self.cache_knn and _accepts_precomputed_knn(learner):
+                        learner.set_params(precomputed_knn=self._knn_graph(
+                            name, learner, inputs[name], knn_graphs))
+                    jobs.append(((i, name), learner,
+                                 functools.partial(np.asarray, inputs[name])))
+
+            results = {}
+            event_names = {
+                (i, name): f'{name} of setting {i}'
+                for (i, name), _, _ in jobs
+            }
+            job_results = self._iter_jobs(jobs,
+                                          n_jobs,
+                                          executor,
+                                          stage='second_dr',
+                                          event_names=event_names)
+            for (i, name), job_result in job_results:
+                if job_result.error is None:
+                    Z = job_result.result
+                else:
+                    print('Second learner had errors. Assign random positions')
+                    Z = np.random.rand(inputs[name].shape[0],
+                                       job_result.learner.n_components)
+                results.setdefault(i, {})[name] = Z
+                if len(results[i]) == len(_Z_NAMES):
+                    Zs = {name: results[i][name] for name in _Z_NAMES}
+                    del results[i]
+                    if i in keys:
+                        self.cache.put(keys[i], _pack_second_repr(Zs, moments))
+                    yield i, settings[i], Zs
+
+    def _sweep_learners(self, setting):
+        """Return a dict of second learners (keyed by mode) for a setting of
+        sweep."""
+        # an empty dict (e.g., ParameterGrid({})) is an empty set of
+        # parameters, not of learners
+        if isinstance(setting, dict) and not (setting and all(
+                hasattr(value, 'fit_transform')
+                for value in setting.values())):
+            learners = copy.deepcopy(self.second_learner)
+            for learner in learners.values():
+                learner.set_params(**setting)
+        elif isinstance(setting, dict):
+            learners = copy.deepcopy(setting)
+        else:
+            learners = {mode: copy.deepcopy(setting) for mode in 'ndt'}
+
+        return learners
+
+    def _learn_first_repr_cached(self,
+                                 X,
+                                 scaling=True,
+                                 n_jobs=None,
+                                 executor=None,
+                                 chunk_size=None):
+        """Apply learn_first_repr or load its results from self.cache. Return
+        the cache key of the results (None if cache is not used)."""
+        first_key = None
+        if self.cache is not None:
+            # results of the out-of-core first DR (partial_fit) depend on
+            # the chunk size. Batch sizes of the learners (e.g., that of
+            # IncrementalPCA) are in their signatures
+            first_key = make_key(np.asarray(X), 'first',
+                                 _scaling_flags(scaling), chunk_size,
+                                 _learner_signatures(self.first_learner))
+
+        cached = None if first_key is None else self.cache.get(first_key)
+        if cached is None:
+            self.learn_first_repr(X,
+                                  scaling=scaling,
+                                  n_jobs=n_jobs,
+                                  executor=executor,
+                                  chunk_size=chunk_size)
+            if first_key is not None:
+                self.cache.put(first_key, self._first_repr_arrays())
+        else:
+            with self._stage('cache_load', 'first_repr'):
+                self._set_first_repr_arrays(cached)
+
+        return first_key
+
+    def update(self,
+               X_new,
+               refit=False,
+               verbose=False,
+               n_jobs=None,
+               executor=None):
+        """Update the DR results with new time points appended to the tensor
+        used by fit_transform, without refitting on the whole history.
+
+        The first learners of the variable and instance modes are updated with
+        partial_fit when they have it (e.g., IncrementalPCA); otherwise, they
+        are kept as is. Y_tn and Y_dt are extended with the new time points,
+        and Z_t_dn and Z_t_nd are extended by applying transform of the
+        second learners fitted for them to the new time points (when transform
+        is not available, these Z are refitted). Existing rows/columns of Y
+        and Z are not recomputed, and the standardization uses the means and
+        standard deviations obtained at fitting. Y_nd, Z_n_td, and Z_d_tn do
+        not depend on the new time points once the time mode is compressed
+        with the fitted first learner, so they are kept as is.
+
+        Parameters
+        ----------
+        X_new: array-like, shape(n_new_time_points, n_instances, n_variables)
+            New time slices. A single slice of shape (n_instances,
+            n_variables) is also accepted.
+        refit: boolean, optional, default=False
+            Z_n_dt and Z_d_nt have time points as features, so new time
+            points cannot be transformed into them. If False, they are kept as
+            is (i.e., they do not reflect the new time points), and the cost
+            of update depends only on the number of new time points. If True,
+            they are refitted with the extended Y_tn and Y_dt, which costs as
+            much as their second DR in fit_transform with all time points so
+            far (use it explicitly, e.g., once after many updates).
+        verbose: boolean, optional, default=False
+            If True, print the progress of the update.
+        n_jobs: int, optional, default=None
+            If not None, overwrite n_jobs set in the constructor for this call.
+        executor: concurrent.futures.Executor, optional, default=None
+            If not None, overwrite executor set in the constructor for this
+            call.
+        Returns
+        -------
+        Dict of {"Z_n_dt", "Z_n_td", "Z_d_nt", "Z_d_tn", "Z_t_dn", "Z_t_nd"}.
+            The same with the one returned by fit_transform.
+        """
+        with self._verbosity(verbose):
+            if self.Y_tn is None or self.Z_t_dn is None:
+                raise ValueError(
+                    'update requires fit_transform to be called first')
+
+            X_new = _as_float_array(X_new)
+            if X_new.ndim == 2:
+                X_new = X_new[np.newaxis, :, :]
+            T_new, N, D = X_new.shape
+
+            # first DR
+            with self._stage('update_first_repr', input_shape=X_new.shape):
+                y = {}
+                for mode in ['n', 'd']:
+                    learner = self.first_learner[mode]
+                    X_unfolded = _unfold(X_new, mode)
+                    if mode in self.first_moments:
+                        mean, std = self.first_moments[mode]
+                        X_unfolded = (X_unfolded - mean) / std
+                    if hasattr(learner, 'partial_fit'):
+                        learner.partial_fit(X_unfolded)
+                        # keep the sign convention applied in learn_first_repr
+                        if 'components_' in learner.__dict__:
+                            if np.sum(learner.components_) < 0:
+                                learner.components_ *= -1
+                    y[mode] = learner.transform(X_unfolded)
+                self.Y_tn = np.vstack((self.Y_tn, y['d'].reshape((T_new, N))))
+                self.Y_dt = np.hstack((self.Y_dt, y['n'].reshape((D, T_new))))
+
+            # second DR
+            to_refit = []
+            for name, Y_new in [('Z_t_dn', self.Y_tn[-T_new:]),
+                                ('Z_t_nd', self.Y_dt[:, -T_new:].T)]:
+                model = self.second_models.get(name)
+                if model is None or not hasattr(model, 'transform'):
+                    to_refit.append(name)
+                    continue
+                if name in self.second_moments:
+                    mean, std = self.second_moments[name]
+                    Y_new = (Y_new - mean) / std
+                try:
+                    with self._stage('update_second_dr', name, Y_new.shape,
+                                     model):
+                        Z_new = model.transform(Y_new)
+                except Exception:
+                    # e.g., UMAP fitted with a kNN graph without a search index
+                    to_refit.append(name)
+                    continue
+                setattr(self, name, np.vstack((getattr(self, name), Z_new)))
+            if refit:
+                to_refit += ['Z_n_dt', 'Z_d_nt']
+            if to_refit:
+                scl = {
+                    name[-1]: name in self.second_moments
+                    for name in ['Z_n_dt', 'Z_t_dn', 'Z_t_nd']
+                }
+                self._fit_second_repr(to_refit,
+                                      self.Y_tn,
+                                      self.Y_nd,
+                                      self.Y_dt,
+                                      scl,
+                                      n_jobs=n_jobs,
+                                      executor=executor)
+
+            return {
+                "Z_n_dt": self.Z_n_dt,
+                "Z_n_td": self.Z_n_td,
+                "Z_d_nt": self.Z_d_nt,
+                "Z_d_tn": self.Z_d_tn,
+                "Z_t_dn": self.Z_t_dn,
+                "Z_t_nd": self.Z_t_nd
+            }
+
+    def learn_first_repr(self,
+                         X,
+                         scaling=True,
+                         verbose=False,
+                         n_jobs=None,
+                         executor=None,
+                         chunk_size=None):
         """Apply the first DR to learn Y_tn, Y_nd, Y_dt.
 
         Parameters
@@ -193,79 +640,194 @@ class TDR():
             To set scaling for individual modes, you can input as a dict. e.g.,
             {'t': False, 'n': False, 'd': True}
         verbose: boolean, optional, default=False
-            If True, print the progress of two-step DR, etc.
+            If True, print the progress of two-step DR, etc. (with
+            multidr.instrumentation.VerboseListener).
+        n_jobs: int, optional, default=None
+            If not None, overwrite n_jobs set in the constructor for this call.
+        executor: concurrent.futures.Executor, optional, default=None
+            If not None, overwrite executor set in the constructor for this
+            call.
+        chunk_size: int, optional, default=None
+            If not None, X is processed out of core: X is read chunk_size time
+            points at a time (or a chunk with the same number of elements along
+            the instance axis for the time mode) and never fully unfolded.
+            This is meant for X larger than memory, such as
+            np.load(path, mmap_mode='r') or np.memmap. All first learners must
+            have partial_fit and transform (e.g., IncrementalPCA in
+            scikit-learn). n_jobs and executor are not used in this mode.
         Returns
         -------
         self
+        Notes
+        -----
+        Memory usage: the unfoldings X_tn_d, X_nd_t, X_dt_n are built with
+        reshape/transpose (X_tn_d is a view of a C-contiguous X) and
+        standardized in place. The unfoldings are processed one at a time, so
+        TDR itself holds at most 2x the memory of X (X plus one unfolding).
+        This bound holds for sequential runs (n_jobs=1 and no executor); with
+        parallel runs, all three unfoldings are created at once. With
+        chunk_size, TDR holds a few chunks of about chunk_size * n_instances *
+        n_variables elements in addition to the outputs and the learners'
+        states.
+        Floating-point X is used as is; other dtypes are first converted to
+        float64. Working copies made inside the learners (e.g., PCA with
+        copy=True) come on top of this bound.
         """
+        with self._verbosity(verbose), self._stage('first_repr',
+                                                   input_shape=np.shape(X)):
+            scl = _scaling_flags(scaling)
+            self.first_moments = {}
+
+            if chunk_size is not None:
+                T, N, D = X.shape
+                y_nd_t, y_dt_n, y_tn_d = self._learn_first_repr_out_of_core(
+                    X, scl, chunk_size)
+            else:
+                X = _as_float_array(X)
+                T, N, D = X.shape
+
+                # unfolding, scaling, and first DR. When running sequentially,
+                # each unfolding is created right before its learner and released
+                # right after so that at most one unfolding coexists with X.
+                outputs = {'t': 'Y_nd', 'n': 'Y_dt', 'd': 'Y_tn'}
+                jobs = [(outputs[mode], self.first_learner[mode],
+                         functools.partial(self._first_step_input, X, mode,
+                                           scl[mode]))
+                        for mode in ['t', 'n', 'd']]
+                job_results = self._run_jobs(
+                    jobs,
+                    n_jobs,
+                    executor,
+                    stage='first_dr',
+                    event_names={
+                        name: mode
+                        for mode, name in outputs.items()
+                    })
+
+                y = {}
+                for (name, _, _), mode in zip(jobs, ['t', 'n', 'd']):
+                    job_result = job_results[name]
+                    if job_result.error is not None:
+                        raise job_result.error
+                    self.first_learner[mode] = job_result.learner
+                    y[mode] = job_result.result
+                y_nd_t, y_dt_n, y_tn_d = y['t'], y['n'], y['d']
+
+            # sign flip if the weights tend to be negative
+            with self._stage('sign_flip'):
+                if 'components_' in self.first_learner['t'].__dict__:
+                    if np.sum(self.first_learner['t'].components_) < 0:
+                        self.first_learner['t'].components_ *= -1
+                        y_nd_t *= -1
+                if 'components_' in self.first_learner['n'].__dict__:
+                    if np.sum(self.first_learner['n'].components_) < 0:
+                        self.first_learner['n'].components_ *= -1
+                        y_dt_n *= -1
+                if 'components_' in self.first_learner['d'].__dict__:
+                    if np.sum(self.first_learner['d'].components_) < 0:
+                        self.first_learner['d'].components_ *= -1
+                        y_tn_d *= -1
+
+            # folding
+            with self._stage('fold'):
+                self.Y_tn = y_tn_d.reshape((T, N))
+                self.Y_nd = y_nd_t.reshape((N, D))
+                self.Y_dt = y_dt_n.reshape((D, T))
+
+            return self
+
+    def _first_step_input(self, X, mode, scaling):
+        """Return the (standardized if scaling) unfolding of X along a mode.
+        The moments used for the standardization are stored in
+        self.first_moments[mode]."""
+        with self._stage('unfold', mode, X.shape):
+            X_unfolded = _unfold(X, mode)
+        if scaling:
+            with self._stage('scale', mode, X_unfolded.shape):
+                X_unfolded, mean, std = _scale(X_unfolded, X)
+            self.first_moments[mode] = (mean, std)
+        return X_unfolded
+
+    def _learn_first_repr_out_of_core(self, X, scl, chunk_size):
+        """Apply the first DR by streaming chunks of X through partial_fit and
+        transform of the first learners. Returns y_nd_t, y_dt_n, y_tn_d
+        (before sign flip and folding) in the same layouts as the in-memory
+        first DR.
+        """
+        for mode in ['t', 'n', 'd']:
+            learner = self.first_learner[mode]
+            if not (hasattr(learner, 'partial_fit')
+                    and hasattr(learner, 'transform')):
+                raise ValueError(
+                    'Out-of-core first DR requires first learners with '
+                    'partial_fit and transform (e.g., IncrementalPCA), got '
+                    f'{type(learner).__name__} for mode {mode}')
 
         T, N, D = X.shape
-        X_tn_d = np.zeros((T * N, D))
-        X_nd_t = np.zeros((N * D, T))
-        X_dt_n = np.zeros((D * T, N))
-
-        # unfolding
-        for t in range(T):
-            X_tn_d[t * N:(t + 1) * N, :] = X[t, :, :]
-        for n in range(N):
-            X_nd_t[n * D:(n + 1) * D, :] = X[:, n, :].T
-        for d in range(D):
-            X_dt_n[d * T:(d + 1) * T, :] = X[:, :, d]
-
-        if verbose:
-            print("reshape done")
-
-        # set scaler
-        scl = {'t': lambda a: a, 'n': lambda a: a, 'd': lambda a: a}
-        if type(scaling) is dict:
-            scl['t'] = preprocessing.scale if scaling['t'] else lambda a: a
-            scl['n'] = preprocessing.scale if scaling['n'] else lambda a: a
-            scl['d'] = preprocessing.scale if scaling['d'] else lambda a: a
-        elif scaling:
-            scl['d'] = preprocessing.scale
-            scl['t'] = preprocessing.scale
-            scl['n'] = preprocessing.scale
-
-        # first DR
-        y_nd_t = self.first_learner['t'].fit_transform(scl['t'](X_nd_t))
-        y_dt_n = self.first_learner['n'].fit_transform(scl['n'](X_dt_n))
-        y_tn_d = self.first_learner['d'].fit_transform(scl['d'](X_tn_d))
-        if verbose:
-            if 'explained_variance_ratio_' in self.first_learner['t'].__dict__:
-                print("exp var ratio for compression of time ponts:",
-                      self.first_learner['t'].explained_variance_ratio_)
-            if 'explained_variance_ratio_' in self.first_learner['n'].__dict__:
-                print("exp var ratio for compression of instances",
-                      self.first_learner['n'].explained_variance_ratio_)
-            if 'explained_variance_ratio_' in self.first_learner['d'].__dict__:
-                print("exp var ratio for compression of variables:",
-                      self.first_learner['d'].explained_variance_ratio_)
-
-        # sign flip if the weights tend to be negative
-        if 'components_' in self.first_learner['t'].__dict__:
-            if np.sum(self.first_learner['t'].components_) < 0:
-                self.first_learner['t'].components_ *= -1
-                y_nd_t *= -1
-        if 'components_' in self.first_learner['n'].__dict__:
-            if np.sum(self.first_learner['n'].components_) < 0:
-                self.first_learner['n'].components_ *= -1
-                y_dt_n *= -1
-        if 'components_' in self.first_learner['d'].__dict__:
-            if np.sum(self.first_learner['d'].components_) < 0:
-                self.first_learner['d'].components_ *= -1
-                y_tn_d *= -1
-
-        # folding
-        self.Y_tn = y_tn_d.reshape((T, N))
-        self.Y_nd = y_nd_t.reshape((N, D))
-        self.Y_dt = y_dt_n.reshape((D, T))
-
-        if verbose:
-            print("first repr done")
+        # instance-axis chunks have about as many elements as time-axis ones
+        instance_chunk_size = max(1, chunk_size * N // T)
 
-        return self
+        moments = None
+        if any(scl.values()):
+            with self._stage('moments', input_shape=X.shape):
+                moments = _chunk_moments(X, chunk_size)
+            self.first_moments.update(
+                {mode: moments[mode]
+                 for mode in moments if scl[mode]})
+
+        def chunk_input(chunk, mode):
+            X_unfolded = _unfold(chunk, mode)
+            if scl[mode]:
+                mean, std = moments[mode]
+                X_unfolded -= mean
+                X_unfolded /= std
+            return X_unfolded
+
+        # first DR (fit)
+        with self._stage('partial_fit', input_shape=X.shape):
+            for _, chunk in _iter_chunks(X, chunk_size, axis=0):
+                for mode in ['n', 'd']:
+                    self.first_learner[mode].partial_fit(
+                        chunk_input(chunk, mode))
+            for _, chunk in _iter_chunks(X, instance_chunk_size, axis=1):
+                self.first_learner['t'].partial_fit(chunk_input(chunk, 't'))
 
-    def learn_second_repr(self, Y_tn, Y_nd, Y_dt, scaling=True, verbose=False):
+        # first DR (transform)
+        with self._stage('transform', input_shape=X.shape):
+            y_nd_t = y_dt_n = y_tn_d = None
+            for t0, chunk in _iter_chunks(X, chunk_size, axis=0):
+                c = chunk.shape[0]
+                y_chunk = self.first_learner['n'].transform(
+                    chunk_input(chunk, 'n'))
+                k = y_chunk.shape[1]
+                if y_dt_n is None:
+                    y_dt_n = np.empty((D * T, k))
+                y_dt_n.reshape((D, T, k))[:, t0:t0 + c] = y_chunk.reshape(
+                    (D, c, k))
+
+                y_chunk = self.first_learner['d'].transform(
+                    chunk_input(chunk, 'd'))
+                if y_tn_d is None:
+                    y_tn_d = np.empty((T * N, y_chunk.shape[1]))
+                y_tn_d[t0 * N:(t0 + c) * N] = y_chunk
+            for n0, chunk in _iter_chunks(X, instance_chunk_size, axis=1):
+                m = chunk.shape[1]
+                y_chunk = self.first_learner['t'].transform(
+                    chunk_input(chunk, 't'))
+                if y_nd_t is None:
+                    y_nd_t = np.empty((N * D, y_chunk.shape[1]))
+                y_nd_t[n0 * D:(n0 + m) * D] = y_chunk
+
+        return y_nd_t, y_dt_n, y_tn_d
+
+    def learn_second_repr(self,
+                          Y_tn,
+                          Y_nd,
+                          Y_dt,
+                          scaling=True,
+                          verbose=False,
+                          n_jobs=None,
+                          executor=None):
         """Apply the first DR to learn Y_tn, Y_nd, Y_dt.
 
         Parameters
@@ -284,95 +846,322 @@ class TDR():
             To set scaling for individual modes, you can input as a dict. e.g.,
             {'t': False, 'n': False, 'd': True}
         verbose: boolean, optional, default=False
-            If True, print the progress of two-step DR, etc.
+            If True, print the progress of two-step DR, etc. (with
+            multidr.instrumentation.VerboseListener).
+        n_jobs: int, optional, default=None
+            If not None, overwrite n_jobs set in the constructor for this call.
+        executor: concurrent.futures.Executor, optional, default=None
+            If not None, overwrite executor set in the constructor for this
+            call.
         Returns
         -------
         self
         """
+        with self._verbosity(verbose):
+            with self._stage('second_repr'):
+                self.second_models = {}
+                self.second_moments = {}
+                self._fit_second_repr(_Z_NAMES,
+                                      Y_tn,
+                                      Y_nd,
+                                      Y_dt,
+                                      _scaling_flags(scaling),
+                                      n_jobs=n_jobs,
+                                      executor=executor)
 
-        # set scaler
-        scl = {'t': lambda a: a, 'n': lambda a: a, 'd': lambda a: a}
-        if type(scaling) is dict:
-            scl['t'] = preprocessing.scale if scaling['t'] else lambda a: a
-            scl['n'] = preprocessing.scale if scaling['n'] else lambda a: a
-            scl['d'] = preprocessing.scale if scaling['d'] else lambda a: a
-        elif scaling:
-            scl['d'] = preprocessing.scale
-            scl['t'] = preprocessing.scale
-            scl['n'] = preprocessing.scale
-
-        # second DR
-        ### Z_n_dt ###
-        try:
-            self.Z_n_dt = self.second_learner['t'].fit_transform(scl['t'](
-                Y_tn.T))
-        except:
-            print('Second learner had errors. Assign random positions')
-            self.Z_n_dt = np.random.rand(Y_tn.T.shape[0],
-                                         self.second_learner['t'].n_components)
-        if verbose:
-            print("Z_n_dt done")
-
-        ### Z_d_nt ###
-        try:
-            self.Z_d_nt = self.second_learner['t'].fit_transform(
-                scl['t'](Y_dt))
-        except:
-            print('Second learner had errors. Assign random positions')
-            self.Z_d_nt = np.random.rand(Y_dt.shape[0],
-                                         self.second_learner['t'].n_components)
-        if verbose:
-            print("Z_d_nt done")
-
-        ### Z_t_dn ###
-        try:
-            self.Z_t_dn = self.second_learner['n'].fit_transform(
-                scl['n'](Y_tn))
-        except:
-            print('Second learner had errors. Assign random positions')
-            self.Z_t_dn = np.random.rand(Y_tn.shape[0],
-                                         self.second_learner['n'].n_components)
-        if verbose:
-            print("Z_t_dn done")
-
-        ### Z_d_tn ###
-        try:
-            self.Z_d_tn = self.second_learner['n'].fit_transform(scl['n'](
-                Y_nd.T))
-        except:
-            print('Second learner had errors. Assign random positions')
-            self.Z_d_tn = np.random.rand(Y_nd.T.shape[0],
-                                         self.second_learner['n'].n_components)
-        if verbose:
-            print("Z_d_tn done")
-
-        ### Z_t_nd ###
-        try:
-            self.Z_t_nd = self.second_learner['d'].fit_transform(scl['d'](
-                Y_dt.T))
-        except:
-            print('Second learner had errors. Assign random positions')
-            self.Z_t_nd = np.random.rand(Y_dt.T.shape[0],
-                                         self.second_learner['d'].n_components)
-        if verbose:
-            print("Z_t_nd done")
-
-        ### Z_n_td ###
-        try:
-            self.Z_n_td = self.second_learner['d'].fit_transform(
-                scl['d'](Y_nd))
-        except:
-            print('Second learner had errors. Assign random positions')
-            self.Z_n_td = np.random.rand(Y_nd.shape[0],
-                                         self.second_learner['d'].n_components)
-        if verbose:
-            print("Z_n_td done")
-
-        if verbose:
-            print("second repr done")
+            return self
+
+    def _fit_second_repr(self,
+                         names,
+                         Y_tn,
+                         Y_nd,
+                         Y_dt,
+                         scl,
+                         n_jobs=None,
+                         executor=None):
+        """Apply the second DR to produce the Z matrices listed in names. Each
+        Z is fitted with its own copy of the second learner, which is kept in
+        self.second_models together with the scaling moments in
+        self.second_moments (used by update).
+        """
+        jobs = []
+        with_knn = set()
+        for name in names:
+            mode = name[-1]
+            learner = copy.deepcopy(self.second_learner[mode])
+            Y = _second_step_input(name, Y_tn, Y_nd, Y_dt)
+            if scl[mode]:
+                self.second_moments[name] = _column_moments(Y)
+                make_input = functools.partial(preprocessing.scale, Y)
+            else:
+                self.second_moments.pop(name, None)
+                make_input = functools.partial(np.asarray, Y)
+            if self.cache_knn and _accepts_precomputed_knn(learner):
+                Y = make_input()
+                make_input = functools.partial(np.asarray, Y)
+                learner.set_params(
+                    precomputed_knn=self._knn_graph(name, learner, Y))
+                with_knn.add(name)
+            jobs.append((name, learner, make_input))
+        job_results = self._run_jobs(jobs, n_jobs, executor, stage='second_dr')
+
+        for name in names:
+            mode = name[-1]
+            job_result = job_results[name]
+            if name in with_knn:
+                # the graph is already consumed by fit. Not keeping it as a
+                # parameter avoids using it for different inputs later.
+                job_result.learner.set_params(precomputed_knn=(None, None,
+                                                               None))
+            # self.second_learner is not fitted (the fitted copies are kept
+            # in second_models), so its parameters stay those given by the
+            # user (e.g., UMAP changes n_jobs in fit) and so do the cache keys
+            if job_result.error is None:
+                self.second_models[name] = job_result.learner
+                setattr(self, name, job_result.result)
+            else:
+                print('Second learner had errors. Assign random positions')
+                self.second_models.pop(name, None)
+                n_rows = _second_step_input(name, Y_tn, Y_nd, Y_dt).shape[0]
+                setattr(
+                    self, name,
+                    np.random.rand(n_rows,
+                                   self.second_learner[mode].n_components))
+
+        return self
+
+    def _knn_graph(self, name, learner, Y, graphs=None):
+        """Return the kNN graph (knn_indices, knn_dists, knn_search_index) of
+        the second DR input Y for a learner accepting precomputed_knn (e.g.,
+        UMAP). Graphs are reused from self.knn_graphs, graphs (a dict keyed by
+        graph keys, if given), or self.cache when the input and the
+        neighbor-search parameters are unchanged.
+        """
+        random_state = learner.random_state
+        if not isinstance(random_state, (int, np.integer)):
+            random_state = None
+        key = make_key(Y, 'knn', learner.n_neighbors, learner.metric,
+                       learner.metric_kwds, random_state)
+
+        if name in self.knn_graphs and self.knn_graphs[name][0] == key:
+            return self.knn_graphs[name][1]
+        if graphs is not None and key in graphs:
+            return graphs[key]
+
+        cached = None if self.cache is None else self.cache.get(key)
+        if cached is not None:
+            # search indices are not cached on disk
+            graph = (cached['knn_indices'], cached['knn_dists'], None)
+        else:
+            graph = _compute_knn_graph(learner, Y)
+            if self.cache is not None:
+                self.cache.put(key, {
+                    'knn_indices': graph[0],
+                    'knn_dists': graph[1]
+                })
+        self.knn_graphs[name] = (key, graph)
+        if graphs is not None:
+            graphs[key] = graph
+
+        return graph
+
+    def _first_repr_arrays(self):
+        """Pack the first DR results into named arrays for caching."""
+        arrays = {'Y_tn': self.Y_tn, 'Y_nd': self.Y_nd, 'Y_dt': self.Y_dt}
+        for mode, (mean, std) in self.first_moments.items():
+            arrays[f'first_moments__{mode}__mean'] = mean
+            arrays[f'first_moments__{mode}__std'] = std
+        for mode, learner in self.first_learner.items():
+            for attr, value in _fitted_attributes(learner).items():
+                arrays[f'first_learner__{mode}__{attr}'] = value
+
+        return arrays
+
+    def _set_first_repr_arrays(self, arrays):
+        """Restore the first DR results packed by _first_repr_arrays."""
+        self.Y_tn = arrays['Y_tn']
+        self.Y_nd = arrays['Y_nd']
+        self.Y_dt = arrays['Y_dt']
+        self.first_moments = {}
+        for name, value in arrays.items():
+            if name.startswith('first_moments__') and name.endswith('mean'):
+                mode = name.split('__')[1]
+                self.first_moments[mode] = (
+                    value, arrays[f'first_moments__{mode}__std'])
+            elif name.startswith('first_learner__'):
+                _, mode, attr = name.split('__', 2)
+                setattr(self.first_learner[mode], attr,
+                        value.item() if value.ndim == 0 else value)
+
+        return self
+
+    def _second_repr_arrays(self):
+        """Pack the second DR results into named arrays for caching."""
+        return _pack_second_repr(
+            {name: getattr(self, name)
+             for name in _Z_NAMES}, self.second_moments)
+
+    def _set_second_repr_arrays(self, arrays):
+        """Restore the second DR results packed by _second_repr_arrays. Fitted
+        second learners are not cached, so update refits Z_t_dn and Z_t_nd
+        after results are loaded from the cache."""
+        for name in _Z_NAMES:
+            setattr(self, name, arrays[name])
+        self.second_models = {}
+        self.second_moments = {}
+        for name in _Z_NAMES:
+            if f'second_moments__{name}__mean' in arrays:
+                self.second_moments[name] = (
+                    arrays[f'second_moments__{name}__mean'],
+                    arrays[f'second_moments__{name}__std'])
 
         return self
 
+    def _run_jobs(self,
+                  jobs,
+                  n_jobs=None,
+                  executor=None,
+                  stage=None,
+                  event_names=None):
+        """Run fit_transform jobs and record their wall times.
+
+        Parameters
+        ----------
+        jobs: list of tuples (name, learner, make_input)
+            make_input is a callable without arguments returning the learner
+            input. It is called right before the job is run or submitted.
+        n_jobs: int, optional, default=None
+            If None, self.n_jobs is used.
+        executor: concurrent.futures.Executor, optional, default=None
+            If None, self.executor is used.
+        stage: str, optional, default=None
+            If not None, start and end events of this stage are emitted for
+            each job.
+        event_names: dict, optional, default=None
+            Names of the events keyed by job names. If None, job names are
+            used.
+        Returns
+        -------
+        Dict of _JobResult keyed by job names.
+        """
+        results = dict(
+            self._iter_jobs(jobs, n_jobs, executor, stage, event_names))
+        for name, job_result in results.items():
+            self.elapsed_times[name] = job_result.elapsed
+
+        return results
+
+    def _iter_jobs(self,
+                   jobs,
+                   n_jobs=None,
+                   executor=None,
+                   stage=None,
+                   event_names=None):
+        """Run fit_transform jobs (see _run_jobs) and yield tuples of (name,
+        _JobResult) in order of completion. Jobs not started yet are
+        cancelled when the generator is closed early.
+        """
+        if n_jobs is None:
+            n_jobs = self.n_jobs
+        if executor is None:
+            executor = self.executor
+        if n_jobs is None or n_jobs < 0:
+            n_jobs = os.cpu_count()
+
+        listeners = self._listeners() if stage is not None else []
+        trace_memory = bool(listeners) and self._tracing_memory()
+
+        def emit_event(kind, name, input_shape, learner, job_result=None):
+            if not listeners:
+                return
+            event_name = name if event_names is None else event_names[name]
+            if kind == 'start':
+                event = StageEvent('start', stage, event_name, input_shape,
+                                   type(learner).__name__)
+            else:
+                event = StageEvent('end', stage, event_name, input_shape,
+                                   type(learner).__name__, job_result.elapsed,
+                                   job_result.cpu_time, job_result.peak_bytes,
+                                   job_result.error)
+            emit(listeners, event)
+
+        if executor is None and n_jobs == 1:
+            for name, learner, make_input in jobs:
+                X = make_input()
+                emit_event('start', name, X.shape, learner)
+                job_result = _fit_transform_job(learner, X, trace_memory)
+                emit_event('end', name, X.shape, learner, job_result)
+                yield name, job_result
+            return
+        if not jobs:
+            return
+
+        own_executor = executor is None
+        if own_executor:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(n_jobs, len(jobs)))
+        futures = {}
+        try:
+            for name, learner, make_input in jobs:
+                X = make_input()
+                emit_event('start', name, X.shape, learner)
+                future = executor.submit(_fit_transform_job,
+                                         copy.deepcopy(learner), X,
+                                         trace_memory)
+                futures[future] = (name, learner, X.shape,
+                                   time.perf_counter())
+            for future in concurrent.futures.as_completed(futures):
+                name, learner, input_shape, submitted = futures[future]
+                try:
+                    job_result = future.result()
+                except Exception as e:  # e.g., a worker process died
+                    # the time until the failure seen from this process
+                    job_result = _JobResult(None, learner,
+                                            time.perf_counter() - submitted,
+                                            e)
+                emit_event('end', name, input_shape, learner, job_result)
+                yield name, job_result
+        finally:
+            for future in futures:
+                future.cancel()
+            if own_executor:
+                executor.shutdown(wait=True)
+
+    def _listeners(self):
+        """Return the listeners of events including the one for verbose."""
+        if self._verbose_listener is None:
+            return self.listeners
+        return self.listeners + [self._verbose_listener]
+
+    def _tracing_memory(self):
+        # the listener for verbose does not use memory
+        return self.trace_memory and bool(self.listeners)
+
+    def _stage(self, stage, name=None, input_shape=None, learner=None):
+        """Return a context manager emitting the start and end events of a
+        stage (a no-op one when there are no listeners)."""
+        listeners = self._listeners()
+        if not listeners:
+            return contextlib.nullcontext()
+        return Stage(listeners,
+                     stage,
+                     name=name,
+                     input_shape=input_shape,
+                     learner=learner,
+                     trace_memory=self._tracing_memory())
+
+    @contextlib.contextmanager
+    def _verbosity(self, verbose):
+        """Print the progress with VerboseListener during the with block if
+        verbose (and not printed by an outer block yet)."""
+        previous = self._verbose_listener
+        if verbose and previous is None:
+            self._verbose_listener = VerboseListener(self)
+        try:
+            yield
+        finally:
+            self._verbose_listener = previous
+
     def set_first_learner(self, first_learner):
         """Set a method for the first DR.
 
@@ -436,3 +1225,241 @@ class TDR():
             self.second_learner = second_learner
 
         return self
+
+
+_Z_NAMES = ['Z_n_dt', 'Z_d_nt', 'Z_t_dn', 'Z_d_tn', 'Z_t_nd', 'Z_n_td']
+
+_JobResult = namedtuple(
+    '_JobResult',
+    ['result', 'learner', 'elapsed', 'error', 'cpu_time', 'peak_bytes'],
+    defaults=[None, None])
+
+
+def _fit_transform_job(learner, X, trace_memory=False):
+    """Apply learner.fit_transform to X. Defined at module level so that it
+    can be sent to worker processes. Errors are returned, not raised, so
+    that the caller can decide how to handle them."""
+    measurement = Measurement(trace_memory)
+    try:
+        result = learner.fit_transform(X)
+        error = None
+    except Exception as e:
+        result = None
+        error = e
+    elapsed, cpu_time, peak_bytes = measurement.stop()
+    return _JobResult(result, learner, elapsed, error, cpu_time, peak_bytes)
+
+
+def _pack_second_repr(Zs, moments):
+    """Pack the second DR results into named arrays for caching."""
+    arrays = dict(Zs)
+    for name, (mean, std) in moments.items():
+        arrays[f'second_moments__{name}__mean'] = mean
+        arrays[f'second_moments__{name}__std'] = std
+
+    return arrays
+
+
+def _second_step_input(name, Y_tn, Y_nd, Y_dt):
+    """Return the (unscaled) input of the second DR producing the Z matrix
+    named name (e.g., Y_tn.T for 'Z_n_dt')."""
+    return {
+        'Z_n_dt': Y_tn.T,
+        'Z_d_nt': Y_dt,
+        'Z_t_dn': Y_tn,
+        'Z_d_tn': Y_nd.T,
+        'Z_t_nd': Y_dt.T,
+        'Z_n_td': Y_nd
+    }[name]
+
+
+def _learner_signatures(learners):
+    """Return a deterministic description of the learners' classes and
+    parameters (get_params() when available) keyed by mode."""
+    signatures = {}
+    for mode in sorted(learners):
+        learner = learners[mode]
+        if hasattr(learner, 'get_params'):
+            params = learner.get_params(deep=False)
+            # graphs are data, not parameters (see TDR.cache_knn)
+            params.pop('precomputed_knn', None)
+        else:
+            params = {
+                k: v
+                for k, v in vars(learner).items() if not k.endswith('_')
+            }
+        signatures[mode] = (type(learner).__module__,
+                            type(learner).__qualname__, sorted(params.items()))
+
+    return signatures
+
+
+def _accepts_precomputed_knn(learner):
+    """Return True if the learner takes precomputed_knn like UMAP."""
+    return hasattr(learner, 'get_params') and all(
+        param in learner.get_params(deep=False)
+        for param in ['precomputed_knn', 'n_neighbors', 'metric'])
+
+
+def _compute_knn_graph(learner, Y):
+    """Compute the kNN graph of Y in the same way as UMAP: exact neighbors
+    for fewer than 4,096 rows (if the metric is supported by sklearn's
+    pairwise_distances) and NN-descent otherwise."""
+    from sklearn.metrics import pairwise_distances
+    from sklearn.metrics.pairwise import PAIRWISE_DISTANCE_FUNCTIONS
+    from sklearn.utils import check_random_state
+    from umap.umap_ import nearest_neighbors
+
+    metric_kwds = learner.metric_kwds or {}
+    if (Y.shape[0] < 4096 and isinstance(learner.metric, str)
+            and learner.metric in PAIRWISE_DISTANCE_FUNCTIONS):
+        dmat = pairwise_distances(Y, metric=learner.metric, **metric_kwds)
+        knn_indices = np.argsort(dmat, axis=1)[:, :learner.n_neighbors]
+        knn_dists = np.take_along_axis(dmat, knn_indices, axis=1)
+        return knn_indices, knn_dists, None
+
+    return nearest_neighbors(Y,
+                             learner.n_neighbors,
+                             learner.metric,
+                             metric_kwds,
+                             learner.angular_rp_forest,
+                             check_random_state(learner.random_state),
+                             low_memory=learner.low_memory,
+                             n_jobs=learner.n_jobs)
+
+
+def _fitted_attributes(learner):
+    """Return public fitted attributes (names ending with '_') of a learner
+    that can be stored in an npz file without pickling."""
+    attributes = {}
+    for attr, value in vars(learner).items():
+        if not attr.endswith('_') or attr.startswith('_'):
+            continue
+        if isinstance(value, (bool, int, float, np.number, np.bool_)):
+            attributes[attr] = np.asarray(value)
+        elif isinstance(value, np.ndarray) and value.dtype != object:
+            attributes[attr] = value
+
+    return attributes
+
+
+def _as_float_array(X):
+    """Return X as a floating-point ndarray without copying when X already
+    is one (float32 inputs stay float32; other dtypes become float64)."""
+    X = np.asarray(X)
+    if not np.issubdtype(X.dtype, np.floating):
+        X = X.astype(np.float64)
+    return X
+
+
+def _unfold(X, mode):
+    """Unfold a tensor X of shape (T, N, D) along a mode.
+
+    mode 'd' returns X_tn_d (T*N, D), mode 't' returns X_nd_t (N*D, T), and
+    mode 'n' returns X_dt_n (D*T, N). The result is a reshape view of X
+    whenever the memory layout allows it (e.g., mode 'd' for a C-contiguous
+    X); otherwise, numpy makes exactly one copy.
+    """
+    T, N, D = X.shape
+    if mode == 'd':
+        return X.reshape((T * N, D))
+    elif mode == 't':
+        return X.transpose((1, 2, 0)).reshape((N * D, T))
+    elif mode == 'n':
+        return X.transpose((2, 0, 1)).reshape((D * T, N))
+    raise ValueError(f"mode must be one of 't', 'n', 'd', got {mode!r}")
+
+
+def _scale(X_unfolded, X):
+    """Standardize the columns of an unfolding in the same way as
+    sklearn.preprocessing.scale. Standardization is done in place unless the
+    unfolding is a view of the input tensor X, which must not be modified.
+    Returns the standardized unfolding, column means, and column standard
+    deviations.
+    """
+    mean = X_unfolded.mean(axis=0)
+    if np.may_share_memory(X_unfolded, X):
+        X_unfolded = X_unfolded - mean
+    else:
+        X_unfolded -= mean
+    # einsum avoids a temporary array of the unfolding size
+    std = _handle_zeros_in_std(
+        np.sqrt(
+            np.einsum('ij,ij->j', X_unfolded, X_unfolded) /
+            X_unfolded.shape[0]))
+    X_unfolded /= std
+
+    return X_unfolded, mean, std
+
+
+def _column_moments(A):
+    """Return column means and standard deviations used to standardize A."""
+    return A.mean(axis=0), _handle_zeros_in_std(A.std(axis=0))
+
+
+def _handle_zeros_in_std(std):
+    """Replace (nearly) zero standard deviations with one to keep constant
+    columns unchanged, as sklearn.preprocessing.scale does."""
+    std[std < 10 * np.finfo(std.dtype).eps] = 1.0
+    return std
+
+
+def _iter_chunks(X, chunk_size, axis=0):
+    """Yield (start index, chunk) along the time (axis=0) or instance (axis=1)
+    axis of X. Each chunk is copied into memory, so it can be modified in place
+    even when X is a read-only np.memmap."""
+    for start in range(0, X.shape[axis], chunk_size):
+        if axis == 0:
+            chunk = X[start:start + chunk_size]
+        else:
+            chunk = X[:, start:start + chunk_size]
+        yield start, _as_float_array(np.array(chunk))
+
+
+def _chunk_moments(X, chunk_size):
+    """Compute column means and standard deviations of the unfoldings X_nd_t
+    ('t'), X_dt_n ('n'), and X_tn_d ('d') in one pass over time-axis chunks of
+    X. As in sklearn.preprocessing.scale, standard deviations of zero are
+    replaced with one.
+    """
+    T, N, D = X.shape
+    mean_t = np.empty(T)
+    std_t = np.empty(T)
+    # count, mean, and sum of squared deviations, merged chunk by chunk with
+    # the pairwise update of Chan et al.
+    stats = {
+        'n': (0, np.zeros(N), np.zeros(N)),
+        'd': (0, np.zeros(D), np.zeros(D))
+    }
+    for t0, chunk in _iter_chunks(X, chunk_size, axis=0):
+        c = chunk.shape[0]
+        # a time-axis chunk holds whole columns of X_nd_t
+        mean_t[t0:t0 + c] = chunk.mean(axis=(1, 2))
+        std_t[t0:t0 + c] = chunk.std(axis=(1, 2))
+
+        for mode, axes in [('n', (0, 2)), ('d', (0, 1))]:
+            count_b = c * chunk.shape[axes[1]]
+            mean_b = chunk.mean(axis=axes)
+            m2_b = chunk.var(axis=axes) * count_b
+            count_a, mean_a, m2_a = stats[mode]
+            count = count_a + count_b
+            delta = mean_b - mean_a
+            stats[mode] = (count, mean_a + delta * count_b / count,
+                           m2_a + m2_b + delta**2 * count_a * count_b / count)
+
+    moments = {'t': (mean_t, std_t)}
+    for mode in ['n', 'd']:
+        count, mean, m2 = stats[mode]
+        moments[mode] = (mean, np.sqrt(m2 / count))
+    for _, std in moments.values():
+        _handle_zeros_in_std(std)
+
+    return moments
+
+
+def _scaling_flags(scaling):
+    """Convert a boolean or a dict of booleans into a dict of booleans keyed
+    by mode ('t', 'n', 'd')."""
+    if type(scaling) is dict:
+        return {mode: bool(scaling[mode]) for mode in ['t', 'n', 'd']}
+    return {mode: bool(scaling) for mode in ['t', 'n', 'd']}
@@ -1,6 +1,6 @@
 import sys
 import os
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name="multidr",
@@ -8,5 +8,7 @@ setup(
     packages=[""],
     package_dir={"": "."},
     install_requires=["scipy", "numpy", "scikit-learn", "umap-learn", "matplotlib"],
-    py_modules=["multidr", "multidr.tdr", "multidr.cl"],
+    extras_require={"build": ["pandas"]},
+    py_modules=["multidr", "multidr.tdr", "multidr.cl", "multidr.cache", "multidr.power_pca", "multidr.instrumentation", "multidr.export", "multidr.build", "multidr.cli"],
+    entry_points={"console_scripts": ["multidr=multidr.cli:main"]},
 )
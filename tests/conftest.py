@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules of the websocket server are imported with flat imports (as
+# ws_server does)
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ui', 'server'))
@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from dataset_cache import DatasetCache
+
+
+def _write(data_dir, data_key, value=1.0):
+    for suffix in ['Y_tn', 'Y_nd', 'Y_dt']:
+        np.save(os.path.join(data_dir, f'{data_key}_{suffix}.npy'),
+                np.full((5, 4), value))
+
+
+class _SlowCache(DatasetCache):
+    def __init__(self, data_dir, slow_path):
+        super().__init__(data_dir)
+        self.slow_path = slow_path
+        self.loads = 0
+
+    def _load_entry(self, path, transpose, mtime_ns):
+        self.loads += 1
+        if path == self.slow_path:
+            time.sleep(0.5)
+        return super()._load_entry(path, transpose, mtime_ns)
+
+
+def test_reload_when_file_changes(tmp_path):
+    _write(tmp_path, 'a')
+    cache = DatasetCache(str(tmp_path))
+    assert cache.get('a', 'Z_n_dt')[0, 0] == 1.0
+    assert cache.derived('a', 'Z_n_dt', 'sum', np.sum) == 20.0
+
+    _write(tmp_path, 'a', 2.0)
+    path = os.path.join(tmp_path, 'a_Y_tn.npy')
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    assert cache.get('a', 'Z_n_dt')[0, 0] == 2.0
+    assert cache.derived('a', 'Z_n_dt', 'sum', np.sum) == 40.0
+
+
+def test_loads_do_not_block_other_entries(tmp_path):
+    _write(tmp_path, 'a')
+    _write(tmp_path, 'b')
+    cache = _SlowCache(str(tmp_path), os.path.join(tmp_path, 'a_Y_tn.npy'))
+    cache.get('b', 'Z_n_dt')
+
+    threads = [
+        threading.Thread(target=cache.get, args=('a', 'Z_n_dt'))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    start = time.perf_counter()
+    cache.get('b', 'Z_n_dt')
+    assert time.perf_counter() - start < 0.2
+    for thread in threads:
+        thread.join()
+
+    # the slow file is loaded once by the concurrent requests
+    assert cache.loads == 2
+
+
+def test_derived_runs_factory_once_without_blocking(tmp_path):
+    _write(tmp_path, 'a')
+    _write(tmp_path, 'b')
+    cache = DatasetCache(str(tmp_path))
+    calls = []
+
+    def slow(X):
+        calls.append(1)
+        time.sleep(0.5)
+        return X.sum()
+
+    threads = [
+        threading.Thread(target=cache.derived,
+                         args=('a', 'Z_n_dt', 'slow', slow))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    start = time.perf_counter()
+    cache.derived('b', 'Z_n_dt', 'sum', np.sum)
+    assert time.perf_counter() - start < 0.2
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+
+
+def test_derived_is_replaced_when_stamp_changes(tmp_path):
+    _write(tmp_path, 'a')
+    cache = DatasetCache(str(tmp_path))
+    cache.get('a', 'Z_n_dt')
+    nbytes = cache.nbytes
+
+    for stamp in range(3):
+        obj = cache.derived('a', 'Z_n_dt', 'zeros',
+                            lambda X, stamp=stamp: np.full(100, stamp),
+                            stamp=stamp)
+        assert obj[0] == stamp
+    assert cache.derived('a', 'Z_n_dt', 'zeros', None, stamp=2)[0] == 2
+
+    # only the last object is kept and counted
+    assert cache.nbytes == nbytes + 800
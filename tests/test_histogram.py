@@ -0,0 +1,32 @@
+import numpy as np
+
+from histogram import ColumnBins
+
+
+def test_counts_are_the_same_as_np_histogram():
+    rng = np.random.default_rng(0)
+    X = np.column_stack([
+        rng.standard_normal(200),
+        rng.integers(0, 5, 200).astype(float),
+        np.full(200, 3.0),  # constant column
+    ])
+    column_bins = ColumnBins(X, n_bins=20)
+    for col in range(X.shape[1]):
+        expected, _ = np.histogram(X[:, col], bins=20)
+        np.testing.assert_array_equal(column_bins.counts[col], expected)
+
+
+def test_rel_freqs_of_groups_and_background():
+    rng = np.random.default_rng(1)
+    X = rng.standard_normal((100, 3))
+    column_bins = ColumnBins(X, n_bins=10)
+    groups = [np.arange(0, 30), np.arange(20, 50)]
+
+    target_freqs, background_freq = column_bins.rel_freqs(1, groups)
+
+    value_range = (X[:, 1].min(), X[:, 1].max())
+    for rows, freq in zip(groups, target_freqs):
+        counts, _ = np.histogram(X[rows, 1], bins=10, range=value_range)
+        np.testing.assert_allclose(freq, counts / counts.sum())
+    counts, _ = np.histogram(X[50:, 1], bins=10, range=value_range)
+    np.testing.assert_allclose(background_freq, counts / counts.sum())
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+websockets = pytest.importorskip('websockets')
+
+from protocol import (BINARY, BINARY_SUBPROTOCOL, JSON, JSON_SUBPROTOCOL,
+                      message_format, select_subprotocol)
+
+
+def test_select_subprotocol():
+    assert select_subprotocol(None, []) is None
+    assert select_subprotocol(None, ['other']) is None
+    assert select_subprotocol(None, [JSON_SUBPROTOCOL]) == JSON_SUBPROTOCOL
+    assert select_subprotocol(
+        None, [JSON_SUBPROTOCOL, BINARY_SUBPROTOCOL]) == BINARY_SUBPROTOCOL
+
+
+@pytest.mark.parametrize('subprotocols, expected', [
+    (None, JSON),
+    ([JSON_SUBPROTOCOL], JSON),
+    ([BINARY_SUBPROTOCOL], BINARY),
+])
+def test_handshake(subprotocols, expected):
+    # the server options of ws_server._serve
+    async def handler(ws):
+        await ws.send(message_format(ws.subprotocol))
+
+    async def run():
+        async with websockets.serve(handler,
+                                    'localhost',
+                                    0,
+                                    select_subprotocol=select_subprotocol) as server:
+            port = server.sockets[0].getsockname()[1]
+            async with websockets.connect(
+                    f'ws://localhost:{port}',
+                    subprotocols=subprotocols) as ws:
+                return await ws.recv()
+
+    assert asyncio.run(run()) == expected
@@ -0,0 +1,78 @@
+import base64
+
+import numpy as np
+import pytest
+
+from selection import decode_selection
+
+
+def _mask(n=37, seed=0):
+    return np.random.default_rng(seed).random(n) < 0.4
+
+
+def _runs(mask):
+    # lengths of alternating unselected and selected runs
+    changes = np.flatnonzero(np.diff(mask.astype(np.int8))) + 1
+    bounds = np.concatenate(([0], changes, [mask.size]))
+    runs = list(np.diff(bounds))
+    if mask[0]:
+        runs.insert(0, 0)
+    return [int(run) for run in runs]
+
+
+def _ranges(mask):
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    changes = np.flatnonzero(np.diff(padded))
+    return changes.reshape(-1, 2).tolist()
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_encodings(seed):
+    mask = _mask(seed=seed)
+    n = mask.size
+    encoded = [
+        mask.tolist(),
+        {
+            'encoding': 'bitmask',
+            'n': n,
+            'data': base64.b64encode(np.packbits(mask).tobytes()).decode()
+        },
+        {
+            'encoding': 'ranges',
+            'n': n,
+            'ranges': _ranges(mask)
+        },
+        {
+            'encoding': 'runs',
+            'n': n,
+            'runs': _runs(mask)
+        },
+    ]
+    for selected in encoded:
+        decoded = decode_selection(selected)
+        assert decoded.dtype == bool
+        np.testing.assert_array_equal(decoded, mask)
+
+
+def test_overlapping_ranges_and_trailing_unselected_rows():
+    decoded = decode_selection({
+        'encoding': 'ranges',
+        'n': 10,
+        'ranges': [[1, 4], [2, 6]]
+    })
+    np.testing.assert_array_equal(decoded, np.isin(np.arange(10), range(1, 6)))
+
+    decoded = decode_selection({'encoding': 'runs', 'n': 6, 'runs': [0, 2, 1]})
+    np.testing.assert_array_equal(decoded, [1, 1, 0, 0, 0, 0])
+
+
+@pytest.mark.parametrize('selected', [
+    {'encoding': 'bitmask', 'n': 9, 'data': base64.b64encode(b'\xff').decode()},
+    {'encoding': 'ranges', 'n': 5, 'ranges': [[3, 6]]},
+    {'encoding': 'ranges', 'n': 5, 'ranges': [[3, 2]]},
+    {'encoding': 'runs', 'n': 5, 'runs': [2, 4]},
+    {'encoding': 'unknown', 'n': 5},
+])
+def test_invalid_encodings(selected):
+    with pytest.raises(ValueError):
+        decode_selection(selected)
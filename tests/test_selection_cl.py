@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('ccpca')
+from ccpca import CCPCA
+
+from multidr.cl import CL, SelectionCL
+
+KWARGS = {'var_thres_ratio': 0.5, 'max_log_alpha': 2}
+
+
+def _data(seed=0, constant=True):
+    rng = np.random.default_rng(seed)
+    X = rng.standard_normal((120, 15))
+    X[:40] += rng.standard_normal(15)
+    if constant:
+        X[:, 3] = 1.0
+    return X
+
+
+def _selections(n, n_selections=10, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(n_selections):
+        selected = np.zeros(n, dtype=bool)
+        selected[rng.choice(n, rng.integers(2, n - 2), replace=False)] = True
+        yield selected
+
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+@pytest.mark.parametrize('standardize', [True, False])
+def test_exact_is_the_same_as_cl_fit(standardize):
+    X = _data()
+    selection_cl = SelectionCL(X, standardize=standardize)
+    for selected in _selections(X.shape[0]):
+        cl = CL(CCPCA(n_components=1, standardize=standardize))
+        cl.fit(X[selected], X[~selected], **KWARGS)
+        np.testing.assert_array_equal(
+            selection_cl.feat_contribs(selected, **KWARGS), cl.fcs)
+
+
+def test_downdate_does_not_depend_on_row_order():
+    # eigenvector signs are fixed, so rounding errors of the downdate do not
+    # change the chosen alpha. Without constant features (whose eigenvalue 0
+    # is the largest one for large alphas and projects rows to rounding
+    # errors, also in ccPCA)
+    X = _data(1, constant=False)
+    order = np.random.default_rng(1).permutation(X.shape[0])
+    selection_cl = SelectionCL(X, exact=False)
+    permuted = SelectionCL(X[order], exact=False)
+    for selected in _selections(X.shape[0], seed=1):
+        np.testing.assert_allclose(
+            permuted.feat_contribs(selected[order], **KWARGS),
+            selection_cl.feat_contribs(selected, **KWARGS),
+            atol=1e-10)
+
+
+def test_empty_selection():
+    selection_cl = SelectionCL(_data())
+    with pytest.raises(ValueError):
+        selection_cl.feat_contribs(np.zeros(120, dtype=bool))
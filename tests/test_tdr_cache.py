@@ -0,0 +1,57 @@
+import warnings
+
+import numpy as np
+import pytest
+from sklearn.decomposition import PCA, IncrementalPCA
+
+from multidr.instrumentation import EventRecorder
+from multidr.tdr import TDR
+
+
+def _tensor(seed=0):
+    return np.random.default_rng(seed).standard_normal((30, 25, 4))
+
+
+def _cache_loads(recorder, name):
+    return sum(event.stage == 'cache_load' and event.name == name
+               for event in recorder.events)
+
+
+def test_second_repr_cache_hits(tmp_path):
+    umap = pytest.importorskip('umap')
+    recorder = EventRecorder()
+    # UMAP changes its n_jobs (-1 to 1) in fit when random_state is given
+    tdr = TDR(first_learner=PCA(n_components=1),
+              second_learner=umap.UMAP(n_components=2,
+                                       n_neighbors=5,
+                                       random_state=0),
+              cache_dir=str(tmp_path),
+              listeners=[recorder])
+    X = _tensor()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        first = tdr.fit_transform(X)
+        for _ in range(2):
+            results = tdr.fit_transform(X)
+
+    assert _cache_loads(recorder, 'second_repr') == 2
+    for name, Z in first.items():
+        np.testing.assert_array_equal(results[name], Z)
+
+
+def test_first_repr_cache_depends_on_chunk_size(tmp_path):
+    recorder = EventRecorder()
+    X = _tensor()
+
+    def fit(chunk_size):
+        tdr = TDR(first_learner=IncrementalPCA(n_components=1),
+                  second_learner=PCA(n_components=2),
+                  cache_dir=str(tmp_path),
+                  listeners=[recorder])
+        tdr.fit_transform(X, chunk_size=chunk_size)
+
+    fit(10)
+    fit(10)
+    assert _cache_loads(recorder, 'first_repr') == 1
+    fit(5)
+    assert _cache_loads(recorder, 'first_repr') == 1
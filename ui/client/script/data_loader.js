@@ -0,0 +1,80 @@
+// Load DATANAME.manifest.json and DATANAME.bin (the columnar format written by
+// multidr.export.write_client_columnar) if they exist, otherwise
+// DATANAME.json. Both are returned in the structure of DATANAME.json.
+export const loadData = dataKey => {
+  return fetch(`../data/${dataKey}.manifest.json`)
+    .then(response => {
+      if (!response.ok) {
+        return fetch(`../data/${dataKey}.json`).then(response => response.json());
+      }
+      return response.json().then(manifest =>
+        fetch(`../data/${manifest.buffer}`)
+        .then(response => response.arrayBuffer())
+        .then(buf => columnarToData(manifest, buf)));
+    });
+};
+
+const typedArrays = {
+  int32: Int32Array,
+  float32: Float32Array,
+  float64: Float64Array
+};
+
+const toArray = (buf, desc) => {
+  return new typedArrays[desc.dtype](buf, desc.offset, desc.length);
+};
+
+// a JSON array or a buffer
+const toColumn = (buf, column) => {
+  return Array.isArray(column) ? column : toArray(buf, column);
+};
+
+export const columnarToData = (manifest, buf) => {
+  const data = {
+    firstDrInfo: {
+      explainedVarianceRatio: manifest.firstDrInfo.explainedVarianceRatio,
+      components: {}
+    }
+  };
+  if (manifest.siViewInfo) {
+    data.siViewInfo = manifest.siViewInfo;
+  }
+  for (const [mode, desc] of Object.entries(manifest.firstDrInfo.components)) {
+    data.firstDrInfo.components[mode] = Array.from(toArray(buf, desc));
+  }
+
+  for (const key of ['instances', 'variables', 'timePoints']) {
+    const group = manifest[key];
+    const ids = toArray(buf, group.ids);
+    const columns = Object.entries(group.columns).map(([k, column]) => [k, toColumn(buf, column)]);
+    const aux = group.aux ?
+      Object.entries(group.aux).map(([k, column]) => [k, toColumn(buf, column)]) : null;
+
+    data[key] = {};
+    for (const [embType, desc] of Object.entries(group.embeddings)) {
+      const embPos = toArray(buf, desc);
+      // rows of the JSON format (each embedding has its own row objects as
+      // the views add properties to them)
+      const rows = new Array(ids.length);
+      for (let i = 0; i < ids.length; i++) {
+        const row = {
+          [group.idKey]: ids[i],
+          embPos: [embPos[i * 2], embPos[i * 2 + 1]]
+        };
+        for (const [k, column] of columns) {
+          row[k] = column[i];
+        }
+        if (aux) {
+          row.aux = {};
+          for (const [k, column] of aux) {
+            row.aux[k] = column[i];
+          }
+        }
+        rows[i] = row;
+      }
+      data[key][embType] = rows;
+    }
+  }
+
+  return data;
+};
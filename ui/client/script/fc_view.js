@@ -12,6 +12,10 @@ import {
   setCategoryLegend
 } from './d3_utils.js';
 
+import {
+  sendWsMessage
+} from './model.js';
+
 export const chart = (svgData, embType, groupIndices, wsInfo, modelData, nClusters) => {
   svgData.svg.selectAll('*').remove();
   const svgArea = svgData.svgArea;
@@ -138,16 +142,13 @@ export const chart = (svgData, embType, groupIndices, wsInfo, modelData, nCluste
               .style('pointer-events', 'none');
             // handle websockets actions
             const bdRect = this.getBoundingClientRect();
-            wsInfo.ws.send(JSON.stringify({
-              action: wsInfo.messageActions.getHistInfo,
-              content: {
-                'dataKey': wsInfo.dataKey,
-                'embType': embType,
-                'groupRows': groupIndices,
-                'selectedCol': d.x,
-                'pos': [x(xData[i]) + d3.select(`#${svgData.domId}`).node().getBoundingClientRect().x - 10, y(1.5) + bdRect.y]
-              }
-            }));
+            sendWsMessage(wsInfo, wsInfo.messageActions.getHistInfo, {
+              'dataKey': wsInfo.dataKey,
+              'embType': embType,
+              'groupRows': groupIndices,
+              'selectedCol': d.x,
+              'pos': [x(xData[i]) + d3.select(`#${svgData.domId}`).node().getBoundingClientRect().x - 10, y(1.5) + bdRect.y]
+            });
           }
         })
         .on('mouseout', function() {
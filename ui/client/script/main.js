@@ -3,6 +3,9 @@ import * as m from './model.js';
 
 /* UPDATE */
 import * as u from './update.js';
+import {
+  loadData
+} from './data_loader.js';
 
 /* VIEW */
 import * as drView from './dr_view.js';
@@ -45,8 +48,7 @@ const init = (dataKey, drType) => {
   const drKey1 = drType === 'instance' ? 'Z_n_dt' : (drType === 'variable' ? 'Z_d_nt' : 'Z_t_dn');
   const drKey2 = drType === 'instance' ? 'Z_n_td' : (drType === 'variable' ? 'Z_d_tn' : 'Z_t_nd');
 
-  fetch(`../data/${dataKey}.json`)
-    .then(response => response.json())
+  loadData(dataKey)
     .then(d => {
       u.initModel(m, d.instances, d.variables, d.timePoints, d.siViewInfo, d.firstDrInfo, websocketUrl, dataKey);
 
@@ -52,7 +52,96 @@ export const wsInfo = {
   messageActions: {
     addNewFcs: 0,
     getHistInfo: 1
+  },
+  // the server sends binary messages (see decodeWsMessage) if it accepts the
+  // first subprotocol, otherwise JSON messages
+  subprotocols: ['multidr.binary.v1', 'multidr.json'],
+  // sequence id of the next message and of the latest message of each action
+  // (the server returns it with the response)
+  seq: 0,
+  latestSeqs: {}
+};
+
+// compact encoding of a boolean array of selected rows (decoded by
+// ui/server/selection.py): half-open index ranges if the selection consists of
+// a few ranges, otherwise a base64 bitmask (most significant bit first)
+export const encodeSelection = selected => {
+  const n = selected.length;
+  const ranges = [];
+  for (let i = 0; i < n; i++) {
+    if (selected[i] && (i === 0 || !selected[i - 1])) {
+      ranges.push([i, i + 1]);
+    } else if (selected[i]) {
+      ranges[ranges.length - 1][1] = i + 1;
+    }
+  }
+
+  // about 2 numbers per range vs 4/3 characters per 8 rows
+  if (ranges.length * 16 < n / 6) {
+    return {
+      encoding: 'ranges',
+      n: n,
+      ranges: ranges
+    };
+  }
+
+  const bytes = new Uint8Array(Math.ceil(n / 8));
+  for (let i = 0; i < n; i++) {
+    if (selected[i]) {
+      bytes[i >> 3] |= 0x80 >> (i & 7);
+    }
+  }
+  let binary = '';
+  for (let i = 0; i < bytes.length; i += 0x8000) {
+    binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+  }
+
+  return {
+    encoding: 'bitmask',
+    n: n,
+    data: btoa(binary)
+  };
+};
+
+// message of ws_server.py: JSON, or a uint32 header length, a JSON header,
+// and packed little-endian buffers placed into the content as typed arrays
+// (2D buffers become arrays of typed arrays)
+export const decodeWsMessage = buf => {
+  if (typeof buf === 'string') {
+    return JSON.parse(buf);
   }
+
+  const headerLength = new DataView(buf).getUint32(0, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, 4, headerLength)));
+  const payloadOffset = 4 + headerLength;
+  for (const b of header.buffers) {
+    const TypedArray = b.dtype === 'float32' ? Float32Array : Int32Array;
+    let value = new TypedArray(buf, payloadOffset + b.offset, b.length);
+    if (b.shape.length === 2) {
+      const rowLength = b.shape[1];
+      value = Array.from({
+        length: b.shape[0]
+      }, (_, i) => value.subarray(i * rowLength, (i + 1) * rowLength));
+    }
+
+    let parent = header.content;
+    for (const key of b.path.slice(0, -1)) {
+      parent = parent[key];
+    }
+    parent[b.path[b.path.length - 1]] = value;
+  }
+
+  return header;
+};
+
+export const sendWsMessage = (wsInfo, action, content) => {
+  const seq = wsInfo.seq++;
+  wsInfo.latestSeqs[action] = seq;
+  wsInfo.ws.send(JSON.stringify({
+    action: action,
+    seq: seq,
+    content: content
+  }));
 };
 
 //
@@ -31,6 +31,12 @@ import {
   calcContainerHeight
 } from './d3_utils.js';
 
+import {
+  decodeWsMessage,
+  encodeSelection,
+  sendWsMessage
+} from './model.js';
+
 import * as fcView from './fc_view.js';
 import * as pcView from './pc_view.js';
 import * as histView from './hist_view.js';
@@ -66,7 +72,8 @@ export const initModel = (model, instances, variables, timePoints, siViewInfo, f
   model.data.variables = variables;
   model.data.timePoints = timePoints;
   model.data.firstDrInfo = firstDrInfo;
-  model.wsInfo.ws = new WebSocket(websocketUrl);
+  model.wsInfo.ws = new WebSocket(websocketUrl, model.wsInfo.subprotocols);
+  model.wsInfo.ws.binaryType = 'arraybuffer';
   model.wsInfo.dataKey = dataKey;
 
   model.state.instanceView = siViews.instance.default;
@@ -231,15 +238,12 @@ export const initRendererInfo = (targetView, linkedViews, wsInfo, infoSvgData,
 
       if (selectedIndices.length > 0) {
         // handle websockets actions
-        wsInfo.ws.send(JSON.stringify({
-          action: wsInfo.messageActions.addNewFcs,
-          content: {
-            'dataKey': wsInfo.dataKey,
-            'embType': targetView.embTypes[0],
-            'embType2': targetView.embTypes[1],
-            'selected': selected
-          }
-        }));
+        sendWsMessage(wsInfo, wsInfo.messageActions.addNewFcs, {
+          'dataKey': wsInfo.dataKey,
+          'embType': targetView.embTypes[0],
+          'embType2': targetView.embTypes[1],
+          'selected': encodeSelection(selected)
+        });
 
         for (const selectedIndex of selectedIndices) {
           infoSvgData.data[selectedIndex].group = state.nGroups;
@@ -297,22 +301,24 @@ export const initRendererInfo = (targetView, linkedViews, wsInfo, infoSvgData,
 
   // handle message from ws
   wsInfo.ws.onmessage = function(wsEvent) {
-    const data = JSON.parse(wsEvent.data);
+    const data = decodeWsMessage(wsEvent.data);
 
     if (data.action === wsInfo.messageActions.addNewFcs) {
-      fcSvgData.data.push(data.content.fcs.map((elm, idx) => {
+      // Array.from also maps typed arrays of binary messages
+      fcSvgData.data.push(Array.from(data.content.fcs, (elm, idx) => {
         return {
           x: idx,
           fc: elm
         }
       }));
-      fcSvgData2.data.push(data.content.fcs2.map((elm, idx) => {
+      fcSvgData2.data.push(Array.from(data.content.fcs2, (elm, idx) => {
         return {
           x: idx,
           fc: elm
         }
       }));
-      state.groupIndices.push(data.content.indices);
+      // sent back in getHistInfo as JSON
+      state.groupIndices.push(Array.from(data.content.indices));
 
       const firstDrType = state.embType.substring(state.embType.length - 2, state.embType.length - 1);
       const firstDrType2 = state.embType2.substring(state.embType2.length - 2, state.embType2.length - 1);
@@ -334,6 +340,10 @@ export const initRendererInfo = (targetView, linkedViews, wsInfo, infoSvgData,
       pcView.chart(pcSvgData, firstDrType, modelData);
       pcView.chart(pcSvgData2, firstDrType2, modelData);
     } else if (data.action === wsInfo.messageActions.getHistInfo) {
+      // the histogram of a column that is no longer hovered
+      if (data.seq < wsInfo.latestSeqs[data.action]) {
+        return;
+      }
       histSvgData.data.length = 0;
 
       histSvgData.data.push({
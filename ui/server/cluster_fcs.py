@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+
+from response_cache import selection_digest
+
+
+class ClusterFcs:
+    """Feature contributions precomputed offline for clusters of the rows of
+    a matrix (DATANAME_EMBTYPE_fcs.npz written by
+    multidr.export.write_cluster_fcs).
+
+    A selection equal to one of the clusters is looked up by its digest (and
+    then compared with the cluster), so answering it costs a hash of the
+    selection instead of ccPCA.
+
+    Parameters
+    ----------
+    labels: ndarray, shape(n_samples,)
+        Cluster label of each row (0 to n_clusters - 1).
+    fcs: ndarray, shape(n_clusters, n_features)
+        Feature contributions of each cluster.
+    """
+
+    def __init__(self, labels, fcs):
+        self.labels = np.asarray(labels)
+        self.fcs = np.asarray(fcs)
+        self._clusters = {
+            selection_digest(self.labels == label): label
+            for label in range(self.fcs.shape[0])
+        }
+
+    def lookup(self, selected):
+        """Return the feature contributions of the cluster equal to the
+        boolean selection mask, or None if no cluster is equal to it."""
+        label = self._clusters.get(selection_digest(selected))
+        if label is None or not np.array_equal(self.labels == label, selected):
+            return None
+        return self.fcs[label]
+
+
+def cluster_fcs_path(data_dir, data_key, emb_type):
+    return os.path.join(data_dir, f"{data_key}_{emb_type}_fcs.npz")
+
+
+def load_cluster_fcs(path, X):
+    """Return ClusterFcs of the file at path if it exists and was computed
+    from X (checked with the shape and column means of X), otherwise None."""
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            labels, fcs, mean = npz["labels"], npz["fcs"], npz["mean"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+    if (
+        labels.shape != (X.shape[0],)
+        or fcs.shape[1:] != (X.shape[1],)
+        or not np.allclose(mean, X.mean(axis=0))
+    ):
+        return None
+
+    return ClusterFcs(labels, fcs)
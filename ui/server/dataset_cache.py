@@ -0,0 +1,249 @@
+import collections
+import glob
+import os
+import threading
+
+import numpy as np
+
+# (file suffix, whether rows and columns are swapped) for each emb type
+EMB_TYPE_FILES = {
+    "Z_n_dt": ("Y_tn", True),
+    "Z_n_td": ("Y_nd", False),
+    "Z_d_nt": ("Y_dt", False),
+    "Z_d_tn": ("Y_nd", True),
+    "Z_t_dn": ("Y_tn", False),
+    "Z_t_nd": ("Y_dt", True),
+}
+
+
+class DatasetEntry:
+    """Cached matrix of a dataset oriented for an emb type (rows are the
+    embedded items) and objects derived from it (e.g., SelectionCL)."""
+
+    def __init__(self, X, mtime_ns):
+        self.X = X
+        self.mtime_ns = mtime_ns
+        # (stamp, object, size counted in nbytes) keyed by name
+        self.derived = {}
+        # a lock per derived name, so that a factory runs once per entry
+        # without blocking requests for other entries and names
+        self.derived_locks = collections.defaultdict(threading.Lock)
+        self.nbytes = X.nbytes
+
+
+class DatasetCache:
+    """Per-process LRU cache of the matrices used by the websocket server,
+    keyed by (data_key, emb_type).
+
+    .npy files are read with mmap_mode and each emb type keeps a
+    C-contiguous, read-only copy already transposed for the emb type, so
+    requests neither read the files nor copy the matrices. Entries are
+    reloaded when the mtime of the file changes, and the least recently used
+    entries are evicted when the total size exceeds max_bytes (the most
+    recent entry is kept even if it alone exceeds max_bytes).
+
+    Parameters
+    ----------
+    data_dir: str, optional, (default="./data")
+        Directory containing DATANAME_Y_dt.npy, DATANAME_Y_nd.npy, and
+        DATANAME_Y_tn.npy.
+    max_bytes: int, optional, (default=2**30)
+        Memory budget of the cached matrices and derived objects.
+    """
+
+    def __init__(self, data_dir="./data", max_bytes=2**30):
+        self.data_dir = data_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        # a lock per (data_key, emb_type), so that a file is loaded once
+        # without blocking requests for other entries
+        self._load_locks = collections.defaultdict(threading.Lock)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, data_key, emb_type):
+        """Return the matrix of data_key oriented for emb_type."""
+        return self._entry(data_key, emb_type).X
+
+    def derived(self, data_key, emb_type, name, factory, stamp=None):
+        """Return factory(X) for the matrix X of data_key and emb_type. The
+        result is cached with the matrix under name (and dropped with it).
+        It is replaced when stamp differs from the one given when it was
+        computed (e.g., the mtime of a file read by factory).
+
+        The cache-wide lock is held only to look up and insert the result.
+        factory runs under a lock of the entry and name, so concurrent
+        requests for the same object wait for one factory call while the
+        other requests proceed."""
+        key = (data_key, emb_type)
+        entry = self._entry(data_key, emb_type)
+        with self._lock:
+            cached = entry.derived.get(name)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            derived_lock = entry.derived_locks[name]
+
+        with derived_lock:
+            with self._lock:
+                cached = entry.derived.get(name)
+                if cached is not None and cached[0] == stamp:
+                    return cached[1]
+
+            obj = factory(entry.X)
+
+            with self._lock:
+                # the entry may have been reloaded or evicted meanwhile
+                counted = self._entries.get(key) is entry
+                nbytes = _nbytes(obj, entry.X) if counted else 0
+                previous = entry.derived.get(name)
+                entry.derived[name] = (stamp, obj, nbytes)
+                if counted:
+                    # a replaced object is no longer counted
+                    if previous is not None:
+                        nbytes -= previous[2]
+                    entry.nbytes += nbytes
+                    self._nbytes += nbytes
+                    self._evict()
+
+            return obj
+
+    def preload(self, data_keys=None, emb_types=None):
+        """Load matrices in advance (e.g., at startup).
+
+        Parameters
+        ----------
+        data_keys: list of str or None, optional, (default=None)
+            Datasets to load. If None, all datasets found in data_dir.
+        emb_types: list of str or None, optional, (default=None)
+            Emb types to load. If None, all emb types.
+        Returns
+        -------
+        List of (data_key, emb_type) loaded.
+        """
+        if data_keys is None:
+            data_keys = self.data_keys()
+        if emb_types is None:
+            emb_types = list(EMB_TYPE_FILES)
+
+        loaded = []
+        for data_key in data_keys:
+            for emb_type in emb_types:
+                self._entry(data_key, emb_type)
+                loaded.append((data_key, emb_type))
+
+        return loaded
+
+    def mtime_ns(self, data_key, emb_type):
+        """Return the mtime of the file of data_key and emb_type (which
+        changes when the matrix is reloaded)."""
+        return os.stat(self._path(data_key, emb_type)).st_mtime_ns
+
+    def data_keys(self):
+        """Return the keys of the datasets found in data_dir."""
+        suffix = "_Y_tn.npy"
+        paths = glob.glob(os.path.join(glob.escape(self.data_dir), "*" + suffix))
+        return sorted(os.path.basename(path)[: -len(suffix)] for path in paths)
+
+    def clear(self):
+        with self._lock:
+            while self._entries:
+                self._remove(next(iter(self._entries)))
+
+    def _path(self, data_key, emb_type):
+        if emb_type not in EMB_TYPE_FILES:
+            raise ValueError(f"Unknown emb type: {emb_type}")
+        suffix, _ = EMB_TYPE_FILES[emb_type]
+        return os.path.join(self.data_dir, data_key + "_" + suffix + ".npy")
+
+    def _entry(self, data_key, emb_type):
+        key = (data_key, emb_type)
+        path = self._path(data_key, emb_type)
+        mtime_ns = self.mtime_ns(data_key, emb_type)
+
+        with self._lock:
+            entry = self._cached_entry(key, mtime_ns)
+            if entry is not None:
+                return entry
+            load_lock = self._load_locks[key]
+
+        # the cache-wide lock is held only to look up and insert entries
+        with load_lock:
+            with self._lock:
+                entry = self._cached_entry(key, mtime_ns)
+                if entry is not None:
+                    return entry
+                self.misses += 1
+
+            entry = self._load_entry(path, EMB_TYPE_FILES[emb_type][1], mtime_ns)
+
+            with self._lock:
+                if key in self._entries:
+                    self._remove(key)
+                self._entries[key] = entry
+                self._nbytes += entry.nbytes
+                self._evict()
+
+            return entry
+
+    def _cached_entry(self, key, mtime_ns):
+        entry = self._entries.get(key)
+        if entry is None or entry.mtime_ns != mtime_ns:
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def _load_entry(self, path, transpose, mtime_ns):
+        return DatasetEntry(_load(path, transpose), mtime_ns)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._nbytes -= entry.nbytes
+        self._release(entry)
+
+    def _release(self, entry):
+        pass
+
+    def _evict(self):
+        while self._nbytes > self.max_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+
+
+def _load(path, transpose, out=None):
+    X = np.load(path, mmap_mode="r")
+    if transpose:
+        X = X.T
+    # copy from the memory map in the orientation used by requests
+    if out is None:
+        X = np.array(X, dtype=np.float64, order="C")
+    else:
+        out[...] = X
+        X = out
+    X.setflags(write=False)
+
+    return X
+
+
+def _oriented_shape(path, transpose):
+    shape = np.load(path, mmap_mode="r").shape
+    return shape[::-1] if transpose else shape
+
+
+def _nbytes(obj, X):
+    """Approximate size of an object derived from matrix X (the total size of
+    its ndarray attributes, excluding X itself)."""
+    if isinstance(obj, np.ndarray):
+        values = [obj]
+    else:
+        values = getattr(obj, "__dict__", {}).values()
+    return sum(
+        value.nbytes
+        for value in values
+        if isinstance(value, np.ndarray) and not np.shares_memory(value, X)
+    )
@@ -0,0 +1,98 @@
+import numpy as np
+
+
+class ColumnBins:
+    """Histograms of the columns of a fixed matrix for any groups of rows.
+
+    Each column is binned once into n_bins equal-width bins between its
+    minimum and maximum (the same bins as np.histogram with
+    range=(min, max)), and the bin index of each row and the counts of all
+    rows are kept. The histograms of groups of rows and of the other rows
+    (the background) are then counted with one bincount over the rows of the
+    groups, and the background is the counts of all rows minus the counts of
+    the union of the groups. The cost does not depend on the number of rows
+    that are not in any group.
+
+    Parameters
+    ----------
+    X: array-like, shape(n_samples, n_features)
+        Matrix of which columns are binned.
+    n_bins: int, optional, (default=20)
+        Number of bins (at most 256).
+    Attributes
+    ----------
+    mins: ndarray, shape(n_features,)
+        Minimum of each column.
+    maxs: ndarray, shape(n_features,)
+        Maximum of each column.
+    bins: ndarray, shape(n_features, n_samples), dtype uint8
+        Bin index of each row in each column.
+    counts: ndarray, shape(n_features, n_bins)
+        Number of rows in each bin of each column.
+    """
+
+    def __init__(self, X, n_bins=20):
+        if n_bins > 256:
+            raise ValueError("n_bins must be at most 256")
+
+        X = np.asarray(X)
+        self.n_bins = n_bins
+        self.mins = X.min(axis=0)
+        self.maxs = X.max(axis=0)
+        self.bins = np.empty((X.shape[1], X.shape[0]), dtype=np.uint8)
+        for col in range(X.shape[1]):
+            self.bins[col] = _bin_indices(X[:, col], self.mins[col], self.maxs[col], n_bins)
+        self.counts = np.stack(
+            [np.bincount(b, minlength=n_bins) for b in self.bins]
+        ).reshape(X.shape[1], n_bins)
+
+    def rel_freqs(self, col, groups):
+        """Return the relative frequencies of column col for each group of
+        rows and for the rows in no group.
+
+        Parameters
+        ----------
+        col: int
+            Column index.
+        groups: list of array-like
+            Row indices of each group. Groups can overlap.
+        Returns
+        -------
+        target_freqs: ndarray, shape(len(groups), n_bins)
+        background_freq: ndarray, shape(n_bins,)
+        """
+        n_bins = self.n_bins
+        groups = [np.asarray(rows, dtype=np.intp).ravel() for rows in groups]
+        n_groups = len(groups)
+        rows = np.concatenate(groups) if groups else np.empty(0, dtype=np.intp)
+        group_ids = np.repeat(np.arange(n_groups), [len(g) for g in groups])
+        union = np.unique(rows)
+
+        # the union of the groups is counted as the last group
+        col_bins = self.bins[col]
+        keys = np.concatenate(
+            [group_ids * n_bins + col_bins[rows], n_groups * n_bins + col_bins[union]]
+        )
+        counts = np.bincount(keys, minlength=(n_groups + 1) * n_bins).reshape(
+            n_groups + 1, n_bins
+        )
+
+        tg_counts = counts[:n_groups]
+        bg_counts = self.counts[col] - counts[n_groups]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            target_freqs = tg_counts / tg_counts.sum(axis=1, keepdims=True)
+            background_freq = bg_counts / bg_counts.sum()
+
+        return target_freqs, background_freq
+
+
+def _bin_indices(x, x_min, x_max, n_bins):
+    # the same edges as np.histogram (which widens an empty range)
+    if x_min == x_max:
+        x_min, x_max = x_min - 0.5, x_max + 0.5
+    edges = np.linspace(x_min, x_max, n_bins + 1)
+    # bins are [edges[i], edges[i + 1]) except the last one, which includes
+    # the maximum
+    indices = np.searchsorted(edges, x, side="right") - 1
+
+    return np.clip(indices, 0, n_bins - 1).astype(np.uint8)
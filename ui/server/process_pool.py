@@ -0,0 +1,70 @@
+import concurrent.futures
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+from logger import logger
+
+
+class RecyclingProcessPool:
+    """ProcessPoolExecutor that is replaced with a new one when a worker
+    crashes.
+
+    When a worker process dies (e.g., killed by the OOM killer),
+    ProcessPoolExecutor fails all of its pending jobs with BrokenProcessPool
+    and cannot be used anymore. run recreates the pool and resubmits such
+    jobs up to max_retries times, so one crash does not take down the jobs
+    of the other connections.
+
+    Parameters
+    ----------
+    max_workers: int or None, optional, (default=None)
+        Number of worker processes. If None, os.cpu_count().
+    initializer: callable or None, optional, (default=None)
+        The same as the parameter of ProcessPoolExecutor.
+    mp_context: multiprocessing context or None, optional, (default=None)
+        The same as the parameter of ProcessPoolExecutor.
+    max_retries: int, optional, (default=1)
+        Number of times a job failed by a crash is resubmitted.
+    """
+
+    def __init__(
+        self, max_workers=None, initializer=None, mp_context=None, max_retries=1
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.initializer = initializer
+        self.mp_context = mp_context
+        self.max_retries = max_retries
+        self.n_recycles = 0
+        self._lock = threading.Lock()
+        self._pool = self._new_pool()
+
+    async def run(self, event_loop, func, *args):
+        for i in range(self.max_retries + 1):
+            pool = self._pool
+            try:
+                return await event_loop.run_in_executor(pool, func, *args)
+            except BrokenProcessPool:
+                self._recycle(pool)
+                if i == self.max_retries:
+                    raise
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def _new_pool(self):
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=self.mp_context,
+            initializer=self.initializer,
+        )
+
+    def _recycle(self, broken_pool):
+        with self._lock:
+            # jobs failed by the same crash recycle the pool only once
+            if self._pool is not broken_pool:
+                return
+            logger.warning("A worker process crashed. Recycling the process pool")
+            broken_pool.shutdown(wait=False)
+            self._pool = self._new_pool()
+            self.n_recycles += 1
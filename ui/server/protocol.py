@@ -0,0 +1,111 @@
+import json
+import struct
+
+import numpy as np
+
+# formats of response messages. Clients negotiate the binary format with the
+# websocket subprotocol BINARY_SUBPROTOCOL; otherwise, responses are JSON
+JSON = "json"
+BINARY = "binary"
+
+BINARY_SUBPROTOCOL = "multidr.binary.v1"
+JSON_SUBPROTOCOL = "multidr.json"
+SUBPROTOCOLS = [BINARY_SUBPROTOCOL, JSON_SUBPROTOCOL]
+
+# dtypes of the packed buffers of the binary format
+_BINARY_DTYPES = {"f": ("float32", "<f4"), "i": ("int32", "<i4"), "u": ("int32", "<i4")}
+
+
+def select_subprotocol(connection, subprotocols):
+    """Pick the first of SUBPROTOCOLS offered by a client (select_subprotocol
+    of websockets.serve). Clients offering none of them (e.g., clients older
+    than the binary format) are accepted without a subprotocol and get JSON
+    responses, whereas websockets rejects them by default."""
+    for subprotocol in SUBPROTOCOLS:
+        if subprotocol in subprotocols:
+            return subprotocol
+    return None
+
+
+def message_format(subprotocol):
+    """Return the format of responses for the subprotocol of a connection
+    (None if the client offered no subprotocol)."""
+    return BINARY if subprotocol == BINARY_SUBPROTOCOL else JSON
+
+
+def encode_content(content, fmt):
+    """Serialize the content of a response (a dict possibly containing nested
+    dicts and numeric ndarrays) in the format fmt. It is done by the worker
+    running the handler, and write_message only frames the result.
+
+    For JSON, the result is a JSON string of the content (ndarrays are
+    converted to lists). For the binary format, the result is a tuple of the
+    JSON string of the content without ndarrays, the descriptions of the
+    ndarrays, and their packed data.
+    """
+    if fmt == JSON:
+        return json.dumps(_to_json(content))
+
+    buffers = []
+    chunks = []
+    offset = 0
+
+    def strip(value, path):
+        nonlocal offset
+        if isinstance(value, dict):
+            return {k: strip(v, path + [k]) for k, v in value.items()}
+        if not isinstance(value, np.ndarray):
+            return value
+
+        dtype, dtype_str = _BINARY_DTYPES[value.dtype.kind]
+        data = np.ascontiguousarray(value, dtype=dtype_str).tobytes()
+        buffers.append(
+            {
+                "path": path,
+                "dtype": dtype,
+                "shape": list(value.shape),
+                "offset": offset,
+                "length": value.size,
+            }
+        )
+        chunks.append(data)
+        offset += len(data)
+        # the client puts the typed array here
+        return None
+
+    meta = strip(content, [])
+
+    return (json.dumps(meta), buffers, b"".join(chunks))
+
+
+def write_message(action, seq, encoded, fmt):
+    """Frame content encoded by encode_content as a message of action with
+    sequence id seq.
+
+    A binary message consists of the byte length of a JSON header (uint32,
+    little-endian), the header padded with spaces to a multiple of 4 bytes,
+    and the packed little-endian buffers. The header has action, seq,
+    content (with null in place of ndarrays), and buffers (path in content,
+    dtype, shape, and byte offset in the packed buffers of each ndarray).
+    Every buffer starts at a multiple of 4 bytes, so the client can wrap it as
+    a typed array without copying.
+    """
+    if fmt == JSON:
+        return f'{{"action": {int(action)}, "seq": {json.dumps(seq)}, "content": {encoded}}}'
+
+    meta, buffers, payload = encoded
+    header = (
+        f'{{"action": {int(action)}, "seq": {json.dumps(seq)}, '
+        f'"content": {meta}, "buffers": {json.dumps(buffers)}}}'
+    ).encode("utf-8")
+    header += b" " * (-len(header) % 4)
+
+    return struct.pack("<I", len(header)) + header + payload
+
+
+def _to_json(value):
+    if isinstance(value, dict):
+        return {k: _to_json(v) for k, v in value.items()}
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
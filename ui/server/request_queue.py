@@ -0,0 +1,80 @@
+import asyncio
+import collections
+
+from logger import logger
+
+
+class RequestQueue:
+    """Queue of the requests received from one websocket connection.
+
+    Requests of each action are handled one at a time in the order they are
+    received, so responses of an action are sent in order. For coalesced
+    actions (e.g., hovering), a new request supersedes the pending (not yet
+    started) request of the same action, so only the latest one is
+    computed. At most max_pending requests wait in the queue; put blocks
+    when it is full, which stops reading from the connection (backpressure).
+    close cancels the pending and running requests (e.g., when the
+    connection is closed).
+
+    Parameters
+    ----------
+    handle: coroutine function
+        Called with (action, seq, content) of each request.
+    coalesced_actions: iterable, optional, (default=())
+        Actions whose pending request is replaced by a newer one.
+    max_pending: int, optional, (default=8)
+        Maximum number of pending requests.
+    Attributes
+    ----------
+    n_superseded: int
+        Number of requests dropped because a newer request superseded them.
+    """
+
+    def __init__(self, handle, coalesced_actions=(), max_pending=8):
+        self.handle = handle
+        self.coalesced_actions = set(coalesced_actions)
+        self.max_pending = max_pending
+        self.n_superseded = 0
+        self._slots = asyncio.Semaphore(max_pending)
+        self._pending = {}
+        self._ready = {}
+        self._workers = {}
+
+    async def put(self, action, seq, content):
+        if action not in self._workers:
+            self._pending[action] = collections.deque()
+            self._ready[action] = asyncio.Event()
+            self._workers[action] = asyncio.ensure_future(self._work(action))
+
+        pending = self._pending[action]
+        if action in self.coalesced_actions and pending:
+            pending[-1] = (seq, content)
+            self.n_superseded += 1
+            return
+
+        await self._slots.acquire()
+        pending.append((seq, content))
+        self._ready[action].set()
+
+    def close(self):
+        for worker in self._workers.values():
+            worker.cancel()
+        for pending in self._pending.values():
+            pending.clear()
+
+    async def _work(self, action):
+        pending = self._pending[action]
+        ready = self._ready[action]
+        while True:
+            await ready.wait()
+            seq, content = pending.popleft()
+            if not pending:
+                ready.clear()
+            self._slots.release()
+
+            try:
+                await self.handle(action, seq, content)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to handle request {action} {seq}: {e!r}")
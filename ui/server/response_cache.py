@@ -0,0 +1,94 @@
+import asyncio
+import collections
+import functools
+import hashlib
+
+import numpy as np
+
+
+def selection_digest(selected):
+    """Return a hash of a boolean selection mask (packed into bits)."""
+    selected = np.asarray(selected, dtype=bool)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(selected.size.to_bytes(8, "little"))
+    h.update(np.packbits(selected).tobytes())
+
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """LRU cache of responses for the asyncio event loop of the websocket
+    server, deduplicating identical requests in flight.
+
+    get_or_compute returns the cached response of a key if any. Otherwise,
+    if the same key is already being computed, the caller awaits the same
+    task instead of starting another computation. The computation runs as
+    its own task, so cancelling one of the callers does not cancel it for the
+    others. Failed computations are not cached.
+
+    Parameters
+    ----------
+    max_entries: int, optional, (default=256)
+        Maximum number of cached responses. If 0, responses are not cached
+        (but requests in flight are still deduplicated).
+    Attributes
+    ----------
+    hits: int
+        Number of requests answered from the cache.
+    joins: int
+        Number of requests that awaited an identical request in flight.
+    misses: int
+        Number of requests that started a computation.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.joins = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._in_flight = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "joins": self.joins,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
+
+    async def get_or_compute(self, key, compute):
+        """Return the response of key. compute is a coroutine function
+        called without arguments when the response has to be computed."""
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.joins += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(compute())
+            self._in_flight[key] = task
+            task.add_done_callback(functools.partial(self._on_done, key))
+
+        return await asyncio.shield(task)
+
+    def clear(self):
+        self._entries.clear()
+
+    def _on_done(self, key, task):
+        del self._in_flight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+
+        if self.max_entries > 0:
+            self._entries[key] = task.result()
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
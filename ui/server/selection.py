@@ -0,0 +1,65 @@
+import base64
+
+import numpy as np
+
+
+def decode_selection(selected):
+    """Decode the selection of a request into a boolean mask.
+
+    Parameters
+    ----------
+    selected: list of bool or dict
+        One of the following encodings of a selection of n rows:
+        - list of bool: one boolean per row (the original format).
+        - {"encoding": "bitmask", "n": n, "data": str}: base64 of the mask
+          packed into bits, most significant bit first (the format of
+          numpy.packbits).
+        - {"encoding": "ranges", "n": n, "ranges": [[start, stop], ...]}:
+          half-open ranges of the selected rows.
+        - {"encoding": "runs", "n": n, "runs": [len, len, ...]}: lengths of
+          alternating runs of unselected and selected rows, starting with
+          unselected rows (the first length is 0 if row 0 is selected). Rows
+          after the last run are unselected.
+    Returns
+    -------
+    selected: ndarray, shape(n,), dtype bool
+    """
+    if isinstance(selected, np.ndarray):
+        return selected.astype(bool, copy=False)
+    if not isinstance(selected, dict):
+        return np.array(selected, dtype=bool)
+
+    encoding = selected["encoding"]
+    n = selected["n"]
+    if encoding == "bitmask":
+        bits = np.frombuffer(base64.b64decode(selected["data"]), dtype=np.uint8)
+        if bits.size * 8 < n:
+            raise ValueError(f"Bitmask of {bits.size} bytes is too short for {n} rows")
+        mask = np.unpackbits(bits, count=n).astype(bool)
+    elif encoding == "ranges":
+        ranges = np.asarray(selected["ranges"], dtype=np.int64).reshape(-1, 2)
+        mask = _mask_from_ranges(ranges[:, 0], ranges[:, 1], n)
+    elif encoding == "runs":
+        bounds = np.cumsum(selected["runs"], dtype=np.int64)
+        if bounds.size > 0 and bounds[-1] > n:
+            raise ValueError(f"Runs cover {bounds[-1]} rows but n is {n}")
+        # selected runs are [bounds[0], bounds[1]), [bounds[2], bounds[3]), ...
+        bounds = bounds[: bounds.size // 2 * 2]
+        mask = _mask_from_ranges(bounds[0::2], bounds[1::2], n)
+    else:
+        raise ValueError(f"Unknown selection encoding: {encoding}")
+
+    return mask
+
+
+def _mask_from_ranges(starts, stops, n):
+    if np.any(starts < 0) or np.any(stops > n) or np.any(starts > stops):
+        raise ValueError(f"Ranges are out of [0, {n})")
+
+    # +1 at each start and -1 at each stop, so the cumulative sum is positive
+    # inside the ranges (also for overlapping ranges)
+    delta = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(delta, starts, 1)
+    np.add.at(delta, stops, -1)
+
+    return np.cumsum(delta[:-1]) > 0
@@ -0,0 +1,136 @@
+import collections
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from dataset_cache import DatasetCache, DatasetEntry, _load, _oriented_shape
+
+# description of a matrix published in shared memory. name is unique for each
+# load of a file, so workers can tell when a matrix has been reloaded
+SharedArrayInfo = collections.namedtuple("SharedArrayInfo", ["name", "shape", "dtype"])
+
+
+class SharedDatasetCache(DatasetCache):
+    """DatasetCache whose matrices are stored in shared memory
+    (multiprocessing.shared_memory) so that worker processes can attach to
+    them without copying or pickling them.
+
+    Matrices are loaded, evicted, and reloaded in the same way as
+    DatasetCache. A shared memory block is unlinked when its entry is
+    removed; workers that have already attached to it keep a valid mapping
+    until they detach.
+
+    Parameters
+    ----------
+    data_dir: str, optional, (default="./data")
+        The same as the parameter of DatasetCache.
+    max_bytes: int, optional, (default=2**30)
+        The same as the parameter of DatasetCache.
+    """
+
+    def publish(self, data_key, emb_type):
+        """Return SharedArrayInfo of the matrix of data_key oriented for
+        emb_type (loading it if needed)."""
+        return self._entry(data_key, emb_type).info
+
+    def _load_entry(self, path, transpose, mtime_ns):
+        shape = _oriented_shape(path, transpose)
+        dtype = np.dtype(np.float64)
+        shm = shared_memory.SharedMemory(
+            create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1)
+        )
+        try:
+            X = _load(path, transpose, out=np.ndarray(shape, dtype, buffer=shm.buf))
+        except BaseException:
+            _unlink(shm)
+            raise
+
+        entry = DatasetEntry(X, mtime_ns)
+        entry.shm = shm
+        entry.info = SharedArrayInfo(shm.name, shape, dtype.str)
+
+        return entry
+
+    def _release(self, entry):
+        # the array is a view of the block, so only drop the reference of the
+        # block here. mmap is closed when the last view is garbage collected
+        entry.X = None
+        entry.derived.clear()
+        _unlink(entry.shm)
+
+
+class AttachedDatasets:
+    """Matrices published by SharedDatasetCache, seen from a worker process.
+
+    It has the same get and derived methods as DatasetCache, so the request
+    handlers can use either. The matrices of a request are registered with
+    attach before the handler runs. At most max_entries matrices (and their
+    derived objects) are kept attached, in LRU order.
+
+    Parameters
+    ----------
+    max_entries: int, optional, (default=16)
+        Maximum number of matrices kept attached.
+    data_dir: str, optional, (default="./data")
+        data_dir of the SharedDatasetCache (where files precomputed for the
+        datasets are found).
+    """
+
+    def __init__(self, max_entries=16, data_dir="./data"):
+        self.max_entries = max_entries
+        self.data_dir = data_dir
+        self._entries = collections.OrderedDict()
+
+    def attach(self, data_key, emb_type, info):
+        key = (data_key, emb_type)
+        entry = self._entries.get(key)
+        if entry is not None and entry.info.name == info.name:
+            self._entries.move_to_end(key)
+            return
+
+        if entry is not None:
+            self._detach(key)
+
+        shm = shared_memory.SharedMemory(name=info.name)
+        X = np.ndarray(info.shape, np.dtype(info.dtype), buffer=shm.buf)
+        X.setflags(write=False)
+        entry = DatasetEntry(X, None)
+        entry.shm = shm
+        entry.info = info
+        self._entries[key] = entry
+
+        while len(self._entries) > self.max_entries:
+            self._detach(next(iter(self._entries)))
+
+    def get(self, data_key, emb_type):
+        return self._entries[(data_key, emb_type)].X
+
+    def derived(self, data_key, emb_type, name, factory, stamp=None):
+        entry = self._entries[(data_key, emb_type)]
+        cached = entry.derived.get(name)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, factory(entry.X), None)
+            entry.derived[name] = cached
+        return cached[1]
+
+    def _detach(self, key):
+        entry = self._entries.pop(key)
+        entry.X = None
+        entry.derived.clear()
+        try:
+            entry.shm.close()
+        except BufferError:
+            # a view of the block is still referenced (e.g., by a running
+            # handler); mmap is closed when it is garbage collected
+            pass
+
+
+def _unlink(shm):
+    try:
+        shm.close()
+    except BufferError:
+        pass
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
@@ -1,8 +1,12 @@
 # Standard Library
+import argparse
 import asyncio
 import concurrent.futures
 import functools
+import itertools
 import json
+import multiprocessing
+import os
 import signal
 import sys
 from enum import IntEnum
@@ -13,9 +17,22 @@ from scipy.stats import pearsonr
 from scipy.spatial.distance import cosine
 import websockets
 
-from multidr.cl import CL
-from ccpca import CCPCA
+from multidr.cl import SelectionCL
+from cluster_fcs import cluster_fcs_path, load_cluster_fcs
+from dataset_cache import DatasetCache
+from histogram import ColumnBins
 from logger import logger
+from process_pool import RecyclingProcessPool
+from protocol import (
+    encode_content,
+    message_format,
+    select_subprotocol,
+    write_message,
+)
+from request_queue import RequestQueue
+from response_cache import ResponseCache, selection_digest
+from selection import decode_selection
+from shared_datasets import AttachedDatasets, SharedDatasetCache
 
 
 class Message(IntEnum):
@@ -37,127 +54,236 @@ class Message(IntEnum):
             return "getHistInfo"
 
 
-def _load_data_by_emb_type(emb_type, data_key):
-    X = None
-    if emb_type == "Z_n_dt":
-        X = np.load("./data/" + data_key + "_Y_tn.npy").transpose()
-    elif emb_type == "Z_n_td":
-        X = np.load("./data/" + data_key + "_Y_nd.npy")
-    elif emb_type == "Z_d_nt":
-        X = np.load("./data/" + data_key + "_Y_dt.npy")
-    elif emb_type == "Z_d_tn":
-        X = np.load("./data/" + data_key + "_Y_nd.npy").transpose()
-    elif emb_type == "Z_t_dn":
-        X = np.load("./data/" + data_key + "_Y_tn.npy")
-    elif emb_type == "Z_t_nd":
-        X = np.load("./data/" + data_key + "_Y_dt.npy").transpose()
-    return X
+# matrices of datasets shared by all requests of this process (replaced with
+# SharedDatasetCache in the server process and AttachedDatasets in worker
+# processes when handlers run in a process pool)
+_dataset_cache = DatasetCache(data_dir="./data")
 
 
-def _get_fc_info(args, emb_type):
-    X = _load_data_by_emb_type(args[emb_type], args["dataKey"])
+# responses of addNewFcs shared by all connections
+_fcs_response_cache = ResponseCache(max_entries=256)
 
-    selected = np.array(args["selected"], dtype=bool)
+# runs the fit of embType2 while the handler runs the one of embType (eigh and
+# matrix products of the fits release the GIL)
+_fit_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
 
-    # ccpca with sign adjustment
-    cl = CL(learner=CCPCA(n_components=1))
-    cl.fit(
-        X[selected, :],
-        X[np.logical_not(selected), :],
-        var_thres_ratio=0.5,
-        max_log_alpha=2,
-    )
 
-    fcs = cl.fcs
+def _init_worker(data_dir):
+    global _dataset_cache
+    _dataset_cache = AttachedDatasets(data_dir=data_dir)
 
-    return (fcs, selected)
+
+def _run_with_shared_datasets(func, args, infos):
+    for (data_key, emb_type), info in infos.items():
+        _dataset_cache.attach(data_key, emb_type, info)
+    return func(args)
 
 
-def _write_new_fcs_response(args):
-    fcs, selected = _get_fc_info(args, "embType")
-    fcs2, _ = _get_fc_info(args, "embType2")
+def _dataset_keys(args):
+    return [
+        (args["dataKey"], args[emb_type])
+        for emb_type in ("embType", "embType2")
+        if emb_type in args
+    ]
 
-    return json.dumps(
-        {
-            "action": Message.addNewFcs,
-            "content": {
-                "fcs": fcs.tolist(),
-                "fcs2": fcs2.tolist(),
-                "indices": np.where(selected)[0].tolist(),
-            },
-        }
+
+def _load_data_by_emb_type(emb_type, data_key):
+    return _dataset_cache.get(data_key, emb_type)
+
+
+def _get_fc_info(args, emb_type):
+    data_key = args["dataKey"]
+    selected = decode_selection(args["selected"])
+
+    # selections of clusters precomputed offline (by multidr build) are
+    # answered from the files next to the matrices. The file is reloaded
+    # when its mtime changes
+    path = cluster_fcs_path(_dataset_cache.data_dir, data_key, args[emb_type])
+    cluster_fcs = _dataset_cache.derived(
+        data_key,
+        args[emb_type],
+        "cluster_fcs",
+        functools.partial(load_cluster_fcs, path),
+        stamp=_mtime_ns_or_missing(path),
+    )
+    fcs = None if cluster_fcs is None else cluster_fcs.lookup(selected)
+    if fcs is not None:
+        return (fcs, selected)
+
+    # SelectionCL is created once per dataset and emb type and shared by all
+    # requests. The exact path is used, so responses are the same as ccPCA
+    # with CL's sign adjustment (each selection costs the covariance of all
+    # rows; the downdate of exact=False can choose another alpha)
+    selection_cl = _dataset_cache.derived(
+        data_key, args[emb_type], "selection_cl", SelectionCL
     )
 
+    # ccpca with sign adjustment
+    fcs = selection_cl.feat_contribs(selected, var_thres_ratio=0.5, max_log_alpha=2)
 
-def _write_hist_info_response(args):
-    X = _load_data_by_emb_type(args["embType"], args["dataKey"])
+    return (fcs, selected)
 
-    col = args["selectedCol"]
-    group_rows = np.array(args["groupRows"])
 
-    n_bins = 20
-    maxVal = np.max(X[:, col])
-    minVal = np.min(X[:, col])
+def _encode_response(func, fmt, args):
+    # content is serialized by the workers running the handlers
+    return encode_content(func(args), fmt)
+
+
+def _new_fcs_content(args):
+    if args["embType2"] == args["embType"]:
+        fcs, selected = _get_fc_info(args, "embType")
+        fcs2 = fcs
+    else:
+        future = _fit_executor.submit(_get_fc_info, args, "embType2")
+        fcs, selected = _get_fc_info(args, "embType")
+        fcs2, _ = future.result()
+
+    return {
+        "fcs": fcs,
+        "fcs2": fcs2,
+        "indices": np.flatnonzero(selected),
+    }
 
-    unselected_rows = np.array([True] * X.shape[0])
-    for rows in group_rows:
-        unselected_rows[rows] = False
 
-    bg_freq, _ = np.histogram(
-        X[unselected_rows, col], bins=n_bins, range=(minVal, maxVal)
+def _hist_info_content(args):
+    # bin indices of all columns are computed once per dataset and emb type
+    column_bins = _dataset_cache.derived(
+        args["dataKey"], args["embType"], "column_bins", ColumnBins
     )
-    bg_freq = (bg_freq / np.sum(bg_freq)).tolist()
-
-    rel_freqs = {"targets": [], "background": bg_freq}
-    for rows in group_rows:
-        tg_freq, _ = np.histogram(X[rows, col], bins=n_bins, range=(minVal, maxVal))
-        rel_freqs["targets"].append((tg_freq / np.sum(tg_freq)).tolist())
-
-    return json.dumps(
-        {
-            "action": Message.getHistInfo,
-            "content": {
-                "relFreqs": rel_freqs,
-                "freqMax": max(
-                    np.max(rel_freqs["targets"]), np.max(rel_freqs["background"])
-                ),
-                "nBins": n_bins,
-                "valMin": int(minVal),
-                "valMax": int(maxVal),
-                "pos": args["pos"],
-                "embType": args["embType"],
-            },
-        }
+
+    col = args["selectedCol"]
+    tg_freqs, bg_freq = column_bins.rel_freqs(col, args["groupRows"])
+
+    return {
+        "relFreqs": {"targets": tg_freqs, "background": bg_freq},
+        "freqMax": float(max(np.max(tg_freqs), np.max(bg_freq))),
+        "nBins": column_bins.n_bins,
+        "valMin": int(column_bins.mins[col]),
+        "valMax": int(column_bins.maxs[col]),
+        "pos": args["pos"],
+        "embType": args["embType"],
+    }
+
+
+async def _run(event_loop, executor, func, args):
+    if not isinstance(executor, RecyclingProcessPool):
+        return await event_loop.run_in_executor(executor, func, args)
+
+    # workers attach to the matrices published in shared memory. A matrix
+    # can be evicted (and its block unlinked) before a worker attaches to it,
+    # in which case it is published again
+    for i in range(2):
+        infos = {key: _dataset_cache.publish(*key) for key in _dataset_keys(args)}
+        try:
+            return await executor.run(
+                event_loop, _run_with_shared_datasets, func, args, infos
+            )
+        except FileNotFoundError:
+            if i == 1:
+                raise
+
+
+def _fcs_response_key(args, fmt):
+    # mtimes make responses of reloaded datasets (and of rewritten, added, or
+    # removed precomputed feature contributions) miss the cache
+    data_key = args["dataKey"]
+    return (
+        fmt,
+        data_key,
+        args["embType"],
+        args["embType2"],
+        _dataset_cache.mtime_ns(data_key, args["embType"]),
+        _dataset_cache.mtime_ns(data_key, args["embType2"]),
+        _mtime_ns_or_missing(
+            cluster_fcs_path(_dataset_cache.data_dir, data_key, args["embType"])
+        ),
+        _mtime_ns_or_missing(
+            cluster_fcs_path(_dataset_cache.data_dir, data_key, args["embType2"])
+        ),
+        selection_digest(args["selected"]),
     )
 
 
-async def _send(event_loop, executor, ws, args, func):
+def _mtime_ns_or_missing(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return "missing"
+
+
+async def _send(event_loop, executor, ws, fmt, action, seq, args, func):
     # logger.info(f"_send_something: {args}")
-    buf = await event_loop.run_in_executor(executor, func, args)
-    await ws.send(buf)
+    encoded = await _run(
+        event_loop, executor, functools.partial(_encode_response, func, fmt), args
+    )
+    await ws.send(write_message(action, seq, encoded, fmt))
+
+
+async def _send_cached(
+    event_loop, executor, ws, fmt, action, seq, args, func, cache, key
+):
+    encoded = await cache.get_or_compute(
+        key,
+        functools.partial(
+            _run,
+            event_loop,
+            executor,
+            functools.partial(_encode_response, func, fmt),
+            args,
+        ),
+    )
+    await ws.send(write_message(action, seq, encoded, fmt))
 
 
-async def _serve(event_loop, executor, stop, host="0.0.0.0", port=9000):
+async def _serve(
+    event_loop, executor, stop, host="0.0.0.0", port=9000, max_pending=8
+):
     logger.info(f"Server started host={host} port={port}")
 
     bound_handler = functools.partial(
-        _handler, event_loop=event_loop, executor=executor
+        _handler, event_loop=event_loop, executor=executor, max_pending=max_pending
     )
 
-    async with websockets.serve(bound_handler, host, port):
+    async with websockets.serve(
+        bound_handler, host, port, select_subprotocol=select_subprotocol
+    ):
         await stop
 
 
-async def _handler(ws, event_loop, executor):
+async def _handler(ws, event_loop, executor, max_pending=8):
     logger.info(f"New connection: {ws.remote_address}")
 
+    # clients without the binary subprotocol get JSON responses
+    fmt = message_format(ws.subprotocol)
+
+    # hovering over feature contributions supersedes the pending histogram
+    # request. Each addNewFcs request adds a group, so all of them are
+    # handled (in order)
+    requests = RequestQueue(
+        functools.partial(_handle_request, event_loop, executor, ws, fmt),
+        coalesced_actions=[Message.getHistInfo],
+        max_pending=max_pending,
+    )
+    seqs = itertools.count()
+
     try:
         while True:
             logger.info(f"Waiting: {ws.remote_address}")
 
             recv_msg = await ws.recv()
 
-            asyncio.ensure_future(_handle_message(event_loop, executor, ws, recv_msg))
+            m = json.loads(recv_msg)
+            try:
+                m_action = Message(m["action"])
+            except ValueError:
+                logger.warning(f"Unknown action: {m['action']}")
+                continue
+            # sequence ids sent by the client are returned with the responses
+            seq = m.get("seq", next(seqs))
+
+            # logger.info(f'Received Message from {ws.remote_address}: message={m}')
+
+            await requests.put(m_action, seq, m["content"])
 
     except websockets.ConnectionClosed as e:
         logger.info(f"ConnectionClosed: {ws.remote_address}")
@@ -165,27 +291,63 @@ async def _handler(ws, event_loop, executor):
     except Exception as e:
         logger.warning(f"Unexpected exception {e}: {sys.exc_info()[0]}")
 
+    finally:
+        requests.close()
+
+
+async def _handle_request(event_loop, executor, ws, fmt, action, seq, content):
+    if action == Message.addNewFcs:
+        # decoded once for the cache key and both fits
+        content = dict(content, selected=decode_selection(content["selected"]))
+        await _send_cached(
+            event_loop,
+            executor,
+            ws,
+            fmt,
+            action,
+            seq,
+            content,
+            _new_fcs_content,
+            _fcs_response_cache,
+            _fcs_response_key(content, fmt),
+        )
+    elif action == Message.getHistInfo:
+        await _send(
+            event_loop, executor, ws, fmt, action, seq, content, _hist_info_content
+        )
 
-async def _handle_message(event_loop, executor, ws, recv_msg):
-    m = json.loads(recv_msg)
-    m_action = m["action"]
-
-    # logger.info(f'Received Message from {ws.remote_address}: message={m}')
 
-    if m_action == Message.addNewFcs:
-        await _send(event_loop, executor, ws, m["content"], _write_new_fcs_response)
-    elif m_action == Message.getHistInfo:
-        await _send(event_loop, executor, ws, m["content"], _write_hist_info_response)
+def _make_executor(executor_type, max_workers):
+    global _dataset_cache
+
+    if executor_type == "thread":
+        return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    elif executor_type == "process":
+        # the CPU-bound handlers hold the GIL, so processes scale with cores
+        if not isinstance(_dataset_cache, SharedDatasetCache):
+            _dataset_cache = SharedDatasetCache(
+                data_dir=_dataset_cache.data_dir, max_bytes=_dataset_cache.max_bytes
+            )
+        # spawn avoids forking the running event loop
+        return RecyclingProcessPool(
+            max_workers=max_workers,
+            initializer=functools.partial(_init_worker, _dataset_cache.data_dir),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    else:
+        raise ValueError(f"Unknown executor type: {executor_type}")
 
 
-async def start_websocket_server(host="0.0.0.0", port=9000, max_workers=4):
+async def start_websocket_server(
+    host="0.0.0.0", port=9000, max_workers=4, executor_type="thread", max_pending=8
+):
     if not sys.platform.startswith("win"):
         import uvloop
 
         asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
         event_loop = asyncio.get_event_loop()
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        executor = _make_executor(executor_type, max_workers)
 
         # The stop condition is set when receiving SIGINT.
         stop = asyncio.Future()
@@ -194,19 +356,19 @@ async def start_websocket_server(host="0.0.0.0", port=9000, max_workers=4):
 
         # Run the server until the stop condition is met.
         event_loop.run_until_complete(
-            await _serve(event_loop, executor, stop, host, port)
+            await _serve(event_loop, executor, stop, host, port, max_pending)
         )
     else:  # windows
         # Windows cannot use uvloop library and signals
         asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
 
         event_loop = asyncio.get_event_loop()
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        executor = _make_executor(executor_type, max_workers)
 
         stop = asyncio.Future()
 
         try:
-            await _serve(event_loop, executor, stop, host, port)
+            await _serve(event_loop, executor, stop, host, port, max_pending)
             # event_loop.run_until_complete(
             #     _serve(event_loop, executor, stop, host, port)
             # )
@@ -215,4 +377,73 @@ async def start_websocket_server(host="0.0.0.0", port=9000, max_workers=4):
             # event_loop.close()
 
 
-asyncio.run(start_websocket_server(host="0.0.0.0", port=9000, max_workers=4))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=None,
+        help="number of workers (default: 4 threads or one process per CPU)",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=["thread", "process"],
+        default="thread",
+        help="run handlers in a thread pool or in a process pool sharing "
+        "datasets through shared memory",
+    )
+    parser.add_argument(
+        "--cache_max_bytes",
+        type=int,
+        default=2**30,
+        help="memory budget of cached datasets",
+    )
+    parser.add_argument(
+        "--max_pending",
+        type=int,
+        default=8,
+        help="maximum number of pending requests of each connection",
+    )
+    parser.add_argument(
+        "--response_cache_size",
+        type=int,
+        default=256,
+        help="number of cached addNewFcs responses (0 disables caching)",
+    )
+    parser.add_argument(
+        "--preload",
+        nargs="*",
+        metavar="DATA_KEY",
+        help="datasets loaded at startup (all datasets in ./data if no key is given)",
+    )
+    args = parser.parse_args()
+
+    if args.executor == "process":
+        # matrices are published in shared memory (also when preloaded)
+        _dataset_cache = SharedDatasetCache(data_dir=_dataset_cache.data_dir)
+        max_workers = args.max_workers or os.cpu_count()
+    else:
+        max_workers = args.max_workers or 4
+
+    _dataset_cache.max_bytes = args.cache_max_bytes
+    _fcs_response_cache.max_entries = args.response_cache_size
+    if args.preload is not None:
+        loaded = _dataset_cache.preload(args.preload or None)
+        logger.info(f"Preloaded {len(loaded)} matrices ({_dataset_cache.nbytes} bytes)")
+
+    try:
+        asyncio.run(
+            start_websocket_server(
+                host=args.host,
+                port=args.port,
+                max_workers=max_workers,
+                executor_type=args.executor,
+                max_pending=args.max_pending,
+            )
+        )
+    finally:
+        logger.info(f"addNewFcs response cache: {_fcs_response_cache.stats}")
+        # unlink shared memory blocks
+        _dataset_cache.clear()